@@ -0,0 +1,115 @@
+import argparse
+import logging
+import os
+import sys
+import qbstreamlit.benchmark
+import qbstreamlit.instrument
+import qbstreamlit.live
+import qbstreamlit.parser
+import qbstreamlit.pipeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m qbstreamlit',
+        description='Builds stats.db outside of a Streamlit session.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser(
+        'build', help="Parse a tournament's packets and QBJ files into stats.db")
+    build.add_argument(
+        '--tournament', required=True, help='Folder name under packets/ and qbjs/')
+    build.add_argument(
+        '--workers', type=int, default=1, help='Processes used to parse QBJ files')
+    build.add_argument(
+        '--incremental', action='store_true',
+        help='Only parse QBJ files that changed since the last build')
+    build.add_argument(
+        '--root', default='.',
+        help='Directory holding packets/, qbjs/, the recoding CSVs and stats.db')
+    build.add_argument(
+        '--verbose', action='store_true', help='Log every instrumentation event')
+
+    benchmark = subparsers.add_parser(
+        'benchmark', help='Time ingest and display stages on a synthetic tournament')
+    benchmark.add_argument(
+        '--games', type=int, default=16, help='Games in the synthetic tournament')
+    benchmark.add_argument(
+        '--teams', type=int, default=16, help='Teams in the synthetic tournament; must be even')
+    benchmark.add_argument(
+        '--scoresheets', type=int, default=10, help='Games to render scoresheets for')
+    benchmark.add_argument(
+        '--root', default=None,
+        help='Directory for the generated files and stats.db; a temporary directory by default')
+    benchmark.add_argument('--seed', type=int, default=0, help='Random seed')
+    benchmark.add_argument(
+        '--out', default='benchmark-report.json', help='Path of the JSON report')
+
+    live = subparsers.add_parser(
+        'live', help='Apply a JSON-lines feed of live match events to stats.db')
+    live.add_argument(
+        '--tournament', required=True, help='Folder name under packets/ and qbjs/')
+    live.add_argument('--feed', required=True, help='Event feed, one JSON event per line')
+    live.add_argument(
+        '--follow', action='store_true', help='Keep applying events appended to the feed')
+    live.add_argument(
+        '--root', default='.',
+        help='Directory holding packets/, qbjs/, the recoding CSVs and stats.db')
+
+    args = parser.parse_args(argv)
+    if args.command == 'benchmark':
+        return run_benchmark(args)
+    if args.command == 'live':
+        return run_live(args)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    os.chdir(args.root)
+
+    try:
+        timings = qbstreamlit.pipeline.build_db(
+            args.tournament, incremental=args.incremental, workers=args.workers)
+    except (qbstreamlit.parser.IngestError, OSError) as e:
+        print(f'build failed: {e}', file=sys.stderr)
+        return 1
+
+    for stage, seconds in timings.items():
+        print(f'{stage:<12} {seconds:8.2f}s')
+    print(f'{"total":<12} {sum(timings.values()):8.2f}s')
+    print(f'profile written to {qbstreamlit.instrument.PROFILE_PATH}')
+    return 0
+
+
+def run_benchmark(args):
+    if args.teams < 2 or args.teams % 2 != 0:
+        print('benchmark failed: --teams must be an even number of at least 2', file=sys.stderr)
+        return 1
+    report = qbstreamlit.benchmark.run_benchmark(
+        games=args.games, teams=args.teams, scoresheets=args.scoresheets,
+        root=args.root, seed=args.seed)
+    qbstreamlit.benchmark.write_report(report, args.out)
+
+    for stage, entry in report['stages'].items():
+        print(f'{stage:<30} {entry["seconds"]:8.3f}s  x{entry["calls"]}')
+    print(f'report written to {args.out}')
+    return 0
+
+
+def run_live(args):
+    feed = os.path.abspath(args.feed)
+    os.chdir(args.root)
+    try:
+        applied = qbstreamlit.live.run_feed(
+            args.tournament, feed, follow=args.follow,
+            on_error=lambda e: print(f'skipped {e}', file=sys.stderr))
+    except OSError as e:
+        print(f'live failed: {e}', file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    print(f'{applied} events applied')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
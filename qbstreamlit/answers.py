@@ -0,0 +1,33 @@
+import functools
+import re
+
+FORMATTING_RE = re.compile(r'</?(?:b|i|u|em)>')
+ALTERNATE_ANSWERS_RE = re.compile(r'\s[\[(].*')
+
+@functools.lru_cache(maxsize=65536)
+def sanitize_answer(answer, remove_formatting = True, remove_alternate_answers = True):
+    if remove_formatting:
+        answer = FORMATTING_RE.sub('', answer)
+    if remove_alternate_answers:
+        answer = ALTERNATE_ANSWERS_RE.sub('', answer)
+
+    return answer
+
+def sanitize_answers(answers, remove_formatting = True, remove_alternate_answers = True):
+    """Sanitizes a Series of answer lines, once per distinct line."""
+    sanitized = {
+        answer: sanitize_answer(answer, remove_formatting, remove_alternate_answers)
+        for answer in answers.dropna().unique()
+    }
+    return answers.map(sanitized)
+
+def sanitize_bonus_answers(answers, remove_formatting = True, remove_alternate_answers = True):
+    """Sanitizes a Series of ' / '-joined bonus answer lines part by part."""
+    sanitized = {
+        answer: ' / '.join([
+            sanitize_answer(part, remove_formatting, remove_alternate_answers)
+            for part in answer.split(' / ')
+        ])
+        for answer in answers.dropna().unique()
+    }
+    return answers.map(sanitized)
@@ -0,0 +1,316 @@
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+import altair as alt
+import numpy as np
+import pandas as pd
+import qbstreamlit.cache
+import qbstreamlit.charts
+import qbstreamlit.data
+import qbstreamlit.db
+import qbstreamlit.jsonstream
+import qbstreamlit.parser
+from qbstreamlit.recoding import RecodingIndex
+
+# One packet's tossup categories, matching the per-packet distribution in
+# parser.packet_tuhs.
+PACKET_CATEGORIES = [
+    category for category, count in qbstreamlit.parser.packet_tuhs.items()
+    for _ in range(count)
+]
+PLAYERS_PER_TEAM = 4
+
+
+def make_packet(rnd, packet_num):
+    tossups = []
+    bonuses = []
+    for i, category in enumerate(PACKET_CATEGORIES):
+        length = rnd.randint(90, 150)
+        tossups.append({
+            'question': ' '.join(['word']*length),
+            'answer': f'<b>Answer {packet_num}-{i + 1}</b> [accept alternate]',
+            'metadata': f'Author {i % 5}, {category}',
+            'packetNumber': packet_num,
+            'questionNumber': i + 1
+        })
+        bonuses.append({
+            'answers_sanitized': [f'Part {k + 1} of {packet_num}-{i + 1}' for k in range(3)],
+            'metadata': f'Author {i % 5}, {category}'
+        })
+    return {'tossups': tossups, 'bonuses': bonuses}
+
+
+def make_game(rnd, teams, team1, team2, tossup_lengths):
+    questions = []
+    bonus_num = 1
+    for i, length in enumerate(tossup_lengths):
+        question = {'question_number': i + 1, 'buzzes': []}
+        order = [team1, team2]
+        rnd.shuffle(order)
+        for team in order:
+            value = rnd.choice([15, 10, 10, 10, -5, 0])
+            if value == 0:
+                continue
+            question['buzzes'].append({
+                'player': {'name': rnd.choice(teams[team])},
+                'team': {'name': team},
+                'buzz_position': {'word_index': rnd.randint(10, length - 1)},
+                'result': {'value': value}
+            })
+            if value > 0:
+                question['bonus'] = {
+                    'question': {'question_number': bonus_num},
+                    'parts': [{'controlled_points': rnd.choice([0, 10])} for _ in range(3)]
+                }
+                bonus_num += 1
+                break
+        questions.append(question)
+
+    return {
+        'match_teams': [
+            {'team': {'name': team}, 'lineups': [{'players': [{'name': player} for player in teams[team]]}]}
+            for team in [team1, team2]
+        ],
+        'match_questions': questions
+    }
+
+
+def generate_tournament(root, tournament='synthetic', games=16, teams=16, seed=0):
+    """Writes a synthetic tournament in the layout the parser reads.
+
+    Rounds of teams/2 games are added until there are enough games; each
+    round gets its own packet.
+    Args:
+        root (str): Directory to write packets/, qbjs/ and the recoding CSVs into
+        tournament (str): Tournament folder name
+        games (int): Number of QBJ files
+        teams (int): Number of teams; must be even
+        seed (int): Random seed
+    Returns:
+        dict: Counts of the files written
+    """
+    rnd = random.Random(seed)
+    os.makedirs(os.path.join(root, 'qbjs', tournament), exist_ok=True)
+    os.makedirs(os.path.join(root, 'packets', tournament), exist_ok=True)
+
+    rosters = {
+        f'Team {t + 1}': [f'Player {t + 1}-{p + 1}' for p in range(PLAYERS_PER_TEAM)]
+        for t in range(teams)
+    }
+    pd.DataFrame({'team': list(rosters), 'team_clean': list(rosters)}).to_csv(
+        os.path.join(root, 'team-recoding.csv'), index=False)
+    pd.DataFrame([
+        {'player': player, 'team': team, 'player_clean': player}
+        for team, players in rosters.items() for player in players
+    ]).to_csv(os.path.join(root, 'player-recoding.csv'), index=False)
+
+    games_per_round = teams // 2
+    rounds = -(-games // games_per_round)
+    written = 0
+    for packet_num in range(1, rounds + 1):
+        packet = make_packet(rnd, packet_num)
+        with open(os.path.join(root, 'packets', tournament, f'packet{packet_num}.json'), 'w') as f:
+            json.dump(packet, f)
+        tossup_lengths = [len(tossup['question'].split(' ')) for tossup in packet['tossups']]
+
+        names = list(rosters)
+        rnd.shuffle(names)
+        for g in range(min(games_per_round, games - written)):
+            qbj = make_game(rnd, rosters, names[2*g], names[2*g + 1], tossup_lengths)
+            with open(os.path.join(root, 'qbjs', tournament, f'Round_{packet_num}_{g + 1}.qbj'), 'w') as f:
+                json.dump(qbj, f)
+            written += 1
+
+    return {'games': written, 'packets': rounds, 'teams': teams}
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, **info):
+        start = time.perf_counter()
+        yield info
+        seconds = time.perf_counter() - start
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        entry.update(info)
+
+
+def get_environment():
+    versions = {'python': platform.python_version(), 'platform': platform.platform()}
+    for name, module in [('pandas', pd), ('numpy', np), ('altair', alt)]:
+        versions[name] = module.__version__
+    for name in ['orjson', 'ijson']:
+        module = getattr(qbstreamlit.jsonstream, name)
+        versions[name] = None if module is None else getattr(module, '__version__', 'installed')
+    return versions
+
+
+def time_loaders(timer, tournament):
+    loaders = [
+        ('load_buzzes', lambda: qbstreamlit.data.load_buzzes(tournament=tournament)),
+        ('load_bonuses', lambda: qbstreamlit.data.load_bonuses(tournament=tournament)),
+        ('load_tossup_meta', lambda: qbstreamlit.data.load_tossup_meta(tournament=tournament)),
+        ('load_bonus_meta', lambda: qbstreamlit.data.load_bonus_meta(tournament=tournament)),
+        ('load_team_stats', lambda: qbstreamlit.data.load_team_stats(tournament=tournament)),
+        ('load_player_stats', lambda: qbstreamlit.data.load_player_stats(tournament=tournament)),
+        ('load_player_bpa', lambda: qbstreamlit.data.load_player_bpa(tournament=tournament)),
+        ('load_team_bpa', lambda: qbstreamlit.data.load_team_bpa(tournament=tournament)),
+        ('load_buzz_histogram', lambda: qbstreamlit.data.load_buzz_histogram(tournament=tournament)),
+        ('load_player_career_bpa', lambda: qbstreamlit.data.load_player_career_bpa()),
+        ('load_page', lambda: qbstreamlit.data.load_page(
+            'buzzes', sort='buzz_position', page=1, page_size=100, tournament=tournament)),
+    ]
+    # Cold reads go to SQLite; warm reads are served by the loader cache.
+    qbstreamlit.cache.clear_cache()
+    for name, loader in loaders:
+        with timer.stage(f'{name}.cold'):
+            loader()
+    for name, loader in loaders:
+        with timer.stage(f'{name}.warm'):
+            loader()
+
+
+def time_fetch_df(timer, tournament, table='buzzes'):
+    """Times fetch_df against pd.read_sql, which it replaced, on one query."""
+    sql = f'SELECT * FROM {table} WHERE tournament = ?'
+    con = qbstreamlit.db.connect()
+    try:
+        with timer.stage('fetch_df') as info:
+            df = qbstreamlit.data.fetch_df(
+                con.execute(sql, (tournament,)), qbstreamlit.data.get_dtypes(table))
+            info.update(table=table, rows=len(df.index))
+        with timer.stage('read_sql') as info:
+            df = pd.read_sql(sql, con, params=(tournament,))
+            info.update(table=table, rows=len(df.index))
+    finally:
+        con.close()
+
+
+def run_benchmark(games=16, teams=16, scoresheets=10, root=None, seed=0):
+    """Generates a synthetic tournament and times each stage of ingest and
+    display against it.
+    Args:
+        games (int): Number of games to generate
+        teams (int): Number of teams; must be even
+        scoresheets (int): Number of games to render scoresheets for
+        root (str): Directory for the generated files and stats.db; a new
+            temporary directory when None
+        seed (int): Random seed
+    Returns:
+        dict: Report with the configuration, environment, row counts and
+            seconds per stage
+    """
+    if root is None:
+        root = tempfile.mkdtemp(prefix='qbstreamlit-benchmark-')
+    tournament = 'synthetic'
+    timer = StageTimer()
+    cwd = os.getcwd()
+
+    with timer.stage('generate') as info:
+        info.update(generate_tournament(root, tournament, games, teams, seed))
+
+    os.chdir(root)
+    try:
+        if os.path.exists(qbstreamlit.db.DB_PATH):
+            os.remove(qbstreamlit.db.DB_PATH)
+        qbstreamlit.cache.clear_cache()
+        qbj_paths = sorted(os.listdir(os.path.join('qbjs', tournament)))
+        qbj_paths = [os.path.join('qbjs', tournament, path) for path in qbj_paths]
+
+        with timer.stage('packet_ingest'):
+            qbstreamlit.parser.populate_db_packets_nasat(tournament)
+
+        with timer.stage('json_load', files=len(qbj_paths)):
+            qbjs = [qbstreamlit.jsonstream.load_json(path) for path in qbj_paths]
+
+        recoding = RecodingIndex.from_csvs(cache_dir=None)
+        results = []
+        with timer.stage('parse_stats', files=len(qbjs)):
+            for game_id, (qbj_path, qbj) in enumerate(zip(qbj_paths, qbjs)):
+                frames = qbstreamlit.parser.parse_stats(qbj, recoding=recoding)
+                packet = qbstreamlit.parser.get_qbj_packet(qbj_path, tournament)
+                for df in frames:
+                    df['packet'] = packet
+                    df['game_id'] = game_id
+                results.append(frames)
+
+        with timer.stage('concat'):
+            buzzes, bonuses, player_stats, team_stats = [
+                pd.concat([frames[i] for frames in results], ignore_index=True)
+                for i in range(4)
+            ]
+
+        with timer.stage('bpa', rows=len(buzzes.index)):
+            player_bpas, player_cat_bpas = qbstreamlit.parser.calculate_player_bpas(
+                tournament, buzzes.copy(), player_stats)
+            team_bpas, team_cat_bpas = qbstreamlit.parser.calculate_team_bpas(
+                tournament, buzzes.copy(), player_stats)
+            buzz_histogram = qbstreamlit.parser.calculate_buzz_histogram(
+                tournament, buzzes)
+
+        tables = {
+            'buzzes': buzzes,
+            'bonuses': bonuses,
+            'player_stats': player_stats,
+            'team_stats': team_stats,
+            'player_bpa': player_bpas,
+            'player_cat_bpa': player_cat_bpas,
+            'team_bpa': team_bpas,
+            'team_cat_bpa': team_cat_bpas,
+            'buzz_histogram': buzz_histogram,
+        }
+        with timer.stage('sqlite_write', rows=sum(len(df.index) for df in tables.values())):
+            qbstreamlit.db.write_tables(tables, tournament=tournament)
+
+        time_loaders(timer, tournament)
+        time_fetch_df(timer, tournament)
+
+        with timer.stage('load_scoresheet_data'):
+            buzzes, bonuses, player_stats, team_stats = qbstreamlit.charts.load_scoresheet_data(
+                tournament)
+
+        game_ids = sorted(buzzes['game_id'].unique())[:scoresheets]
+        spec_bytes = 0
+        for game_id in game_ids:
+            with timer.stage('make_scoresheet'):
+                chart = qbstreamlit.charts.make_scoresheet(
+                    game_id,
+                    buzzes[buzzes['game_id'] == game_id],
+                    bonuses[bonuses['game_id'] == game_id],
+                    player_stats[player_stats['game_id'] == game_id],
+                    team_stats=team_stats
+                )
+            with timer.stage('chart_serialization'):
+                spec_bytes += qbstreamlit.charts.get_payload_size(chart)
+        if len(game_ids) > 0:
+            timer.stages['chart_serialization']['bytes'] = spec_bytes
+
+        # The batch path render_scoresheet_specs stores, over the same games.
+        with timer.stage('make_scoresheet_specs', games=len(game_ids)):
+            qbstreamlit.charts.make_scoresheet_specs(
+                game_ids, buzzes, bonuses, player_stats, team_stats)
+    finally:
+        os.chdir(cwd)
+
+    return {
+        'config': {
+            'games': games, 'teams': teams, 'scoresheets': len(game_ids),
+            'seed': seed, 'root': root
+        },
+        'environment': get_environment(),
+        'rows': {name: len(df.index) for name, df in tables.items()},
+        'stages': timer.stages,
+    }
+
+
+def write_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
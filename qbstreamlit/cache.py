@@ -0,0 +1,126 @@
+import functools
+import os
+import sqlite3 as sq
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+import qbstreamlit.db
+
+# With copy-on-write, a shallow copy is enough to keep callers from writing
+# through to a cached frame. Without it, callers get a deep copy.
+COPY_ON_WRITE = int(pd.__version__.split('.')[0]) >= 3 or \
+    bool(pd.get_option('mode.copy_on_write'))
+
+
+class FrameCache:
+    """Thread-safe LRU cache with an optional TTL, shared by every Streamlit
+    session in the server process."""
+
+    def __init__(self, ttl=None, max_entries=128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                stored, value = self.entries[key]
+                if self.ttl is None or time.monotonic() - stored < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while self.max_entries is not None and len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+frame_cache = FrameCache()
+
+
+def configure_cache(ttl=None, max_entries=128):
+    """Sets the loader cache's eviction policy and empties it.
+    Args:
+        ttl (float): Seconds an entry stays valid; None keeps entries until evicted
+        max_entries (int): Entries kept before the least recently used is dropped
+    """
+    frame_cache.ttl = ttl
+    frame_cache.max_entries = max_entries
+    frame_cache.clear()
+
+
+def clear_cache():
+    frame_cache.clear()
+
+
+def get_db_identity(path=None):
+    """Returns (path, device, inode, generation) for stats.db, or None if it
+    does not exist yet."""
+    if path is None:
+        path = qbstreamlit.db.DB_PATH
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    con = sq.connect(path)
+    try:
+        generation = qbstreamlit.db.get_generation(con)
+    finally:
+        con.close()
+    return (os.path.realpath(path), stat.st_dev, stat.st_ino, generation)
+
+
+def share(value):
+    if isinstance(value, tuple):
+        return tuple(share(v) for v in value)
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=not COPY_ON_WRITE)
+    return value
+
+
+def freeze_arg(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze_arg(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(value)
+    return value
+
+
+def cached_loader(func):
+    """Caches a stats.db loader's result per database identity and arguments.
+
+    The key includes the database generation, so any committed rebuild
+    invalidates earlier entries.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        identity = get_db_identity()
+        if identity is None:
+            return func(*args, **kwargs)
+
+        key = (
+            identity,
+            func.__qualname__,
+            tuple(freeze_arg(arg) for arg in args),
+            tuple(sorted((k, freeze_arg(v)) for k, v in kwargs.items()))
+        )
+        found, value = frame_cache.get(key)
+        if not found:
+            value = func(*args, **kwargs)
+            frame_cache.set(key, value)
+        return share(value)
+
+    return wrapper
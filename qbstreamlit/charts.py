@@ -1,34 +1,68 @@
 import altair as alt
+import functools
+import json
 import numpy as np
 import pandas as pd
-import qbstreamlit.utils
+import qbstreamlit.data
+import qbstreamlit.db
+import qbstreamlit.instrument
+import qbstreamlit.parser
+import qbstreamlit.answers
 from textwrap import wrap
 
 
+def compact_data(df, columns):
+    """Keeps only the columns a chart encodes, so Altair does not inline the
+    rest of the frame into the spec. Identical frames are already stored
+    once as top-level named datasets by Altair's consolidate_datasets."""
+    return df[[column for column in columns if column in df.columns]]
+
+
+def get_payload_size(chart):
+    """Returns the size in bytes of a chart's serialized Vega-Lite spec."""
+    return len(chart.to_json(indent=None).encode('utf-8'))
+
+
 def make_buzz_chart(df):
+    df = compact_data(df, ['buzz_position', 'num', 'team', 'player', 'answer'])
     c = alt.Chart(df).mark_square(size=100).encode(x='buzz_position', y=alt.Y(field='num', type='ordinal',
                                                                               sort='descending'), color=alt.Color('team', legend=None), tooltip=['player', 'team', 'buzz_position', 'answer'])
     return c
 
 
 def make_category_buzz_chart(df, negs):
-    df['category'] = ['Other' if cat in ['Geo/CE', 'Other Academic']
-                      else cat for cat in df['category']]
+    """Faceted buzz-position histograms by category.
+    Args:
+        df (pd.DataFrame): Rows from data.load_buzz_histogram, or raw buzzes
+            with category, value and buzz_position, which are binned here
+        negs (bool): Whether to include negs
+    """
+    # Bins are summed on the server so the spec carries one row per bar.
+    if 'bin_start' in df.columns:
+        binned = df.groupby(
+            ['category', 'value', 'bin_start', 'bin_end'], as_index=False
+        )['count'].sum()
+    else:
+        df = df.assign(
+            category=qbstreamlit.parser.recode_categories(df['category']))
+        binned = qbstreamlit.parser.bin_buzz_positions(df, ['category', 'value'])
+
     if not negs:
-        df = df[df['value'].isin([15, 10])]
+        binned = binned[binned['value'].isin([15, 10])]
     else:
-        df = df[df['value'].isin([15, 10, -5])]
+        binned = binned[binned['value'].isin([15, 10, -5])]
 
     domain = [15, 10, -5]
     range_ = ['blue', '#007ccf', '#ff4b4b']
 
-    c = alt.Chart(df).mark_bar(
+    c = alt.Chart(binned).mark_bar(
         opacity=0.8,
         binSpacing=2
     ).encode(
-        x=alt.X('buzz_position', bin=alt.Bin(maxbins=10),
+        x=alt.X('bin_start:Q', bin='binned', title='buzz_position',
                 scale=alt.Scale(domain=(0, 150))),
-        y=alt.Y('count()'),
+        x2='bin_end:Q',
+        y=alt.Y('count:Q', title='Count of Records'),
         color=alt.Color('value:O', scale=alt.Scale(
             domain=domain, range=range_)),
         facet=alt.Facet('category', columns=2)
@@ -91,181 +125,230 @@ def make_category_ppb_chart(df, cat_ppb):
     return bar + top + ppb + rank
 
 
-def make_scoresheet(game_id, buzzes, bonuses, player_stats, has_bonuses=True):
+def get_score_progressions(buzzes, bonuses=None, teams=None):
+    """Computes each team's running score after every tossup of every game.
+    Args:
+        buzzes (pd.DataFrame): Buzzes with game_id, team, tossup and value
+        bonuses (pd.DataFrame): Bonuses with game_id, team, tossup and part values, if any
+        teams (pd.DataFrame): game_id and team of every team to score, including
+            teams without buzzes; defaults to the teams in buzzes
+    Returns:
+        pd.DataFrame: game_id, team, tossup and score, covering at least 20 tossups
+            per game and any overtime tossups
+    """
+    points = buzzes[['game_id', 'team', 'tossup', 'value']].astype({'value': int})
+    if bonuses is not None:
+        bonus_points = bonuses[['game_id', 'team', 'tossup']].copy()
+        bonus_points['value'] = bonuses['part1_value'] + \
+            bonuses['part2_value'] + bonuses['part3_value']
+        points = pd.concat([points, bonus_points])
+    points = points.groupby(
+        ['game_id', 'team', 'tossup'], as_index=False)['value'].sum()
+
+    game_lengths = points.groupby('game_id', as_index=False).agg(
+        length=('tossup', 'max'))
+    game_lengths['length'] = game_lengths['length'].clip(lower=20)
+
+    if teams is None:
+        teams = buzzes[['game_id', 'team']].drop_duplicates()
+    scores = teams[['game_id', 'team']].merge(game_lengths, on='game_id', how='left')
+    # A game without any points yet still covers 20 tossups.
+    scores['length'] = scores['length'].fillna(20).astype(int)
+    scores = scores.loc[scores.index.repeat(scores['length'])]
+    scores['tossup'] = scores.groupby(['game_id', 'team']).cumcount() + 1
+    scores = scores.drop(columns='length').merge(
+        points, on=['game_id', 'team', 'tossup'], how='left')
+    scores['value'] = scores['value'].fillna(0).astype(int)
+    scores['score'] = scores.groupby(['game_id', 'team'])['value'].cumsum()
+
+    return scores.drop(columns='value').reset_index(drop=True)
+
+
+def get_scoresheet_data(game_id, buzzes, bonuses, player_stats, has_bonuses=True,
+                        team_stats=None, scores=None):
+    """Slices one game's rows into the frames and values a scoresheet draws.
+    Args:
+        game_id (int): Game to draw
+        buzzes (pd.DataFrame): Buzzes of this game, or of several games
+        bonuses (pd.DataFrame): Bonuses of this game, or of several games
+        player_stats (pd.DataFrame): Player stats of this game
+        has_bonuses (bool): Include bonus columns
+        team_stats (pd.DataFrame): game_id and team, so a team that never
+            buzzed still gets its columns
+        scores (pd.DataFrame): get_score_progressions covering this game;
+            computed from buzzes and bonuses when None
+    Returns:
+        dict: The game's frames under 'datasets', and its team titles,
+            player and tossup domains and tick count
+    """
     game_buzzes = buzzes[buzzes['game_id'] == game_id]
     game_buzzes['value'] = game_buzzes['value'].astype(int)
-    game_buzzes['answer'] = [qbstreamlit.utils.sanitize_answer(
-        answer) for answer in game_buzzes['answer']]
-    
-    team1_name = game_buzzes['team'].unique().tolist()[0]
-    team2_name = game_buzzes['team'].unique().tolist()[1]
+    if 'answer_clean' in game_buzzes.columns:
+        game_buzzes['answer'] = game_buzzes['answer_clean']
+    else:
+        game_buzzes['answer'] = qbstreamlit.answers.sanitize_answers(
+            game_buzzes['answer'])
+
+    # Teams come from team_stats so a team that never buzzed still gets its
+    # columns; a one-team game gets an empty second side.
+    if team_stats is not None:
+        teams = team_stats[team_stats['game_id'] == game_id]['team'].unique().tolist()
+    else:
+        teams = player_stats[player_stats['game_id'] == game_id]['team'].unique().tolist()
+    team1_name, team2_name = (teams + ['', ''])[:2]
 
+    datasets = {}
     if has_bonuses:
         game_bonuses = bonuses[bonuses['game_id'] == game_id]
-        game_bonuses['answers'] = [[qbstreamlit.utils.sanitize_answer(
-            part) for part in answer.split(' / ')] for answer in game_bonuses['answers']]
-        game_bonuses['answers'] = [
-            ' / '.join(answers) for answers in game_bonuses['answers']]
-
-        team1_bonuses = game_bonuses[game_bonuses['team'] == team1_name]
-        team2_bonuses = game_bonuses[game_bonuses['team'] == team2_name]
-
-        team1_bonuses = team1_bonuses.melt(
-            id_vars=['tossup', 'answers'],
-            value_vars=['part1_value', 'part2_value', 'part3_value'],
-            var_name='part', value_name='value'
-        )
-
-        team2_bonuses = team2_bonuses.melt(
-            id_vars=['tossup', 'answers'],
-            value_vars=['part1_value', 'part2_value', 'part3_value'],
-            var_name='part', value_name='value'
-        )
-
-    team1_buzzes = game_buzzes[game_buzzes['team'] == team1_name]
-    team2_buzzes = game_buzzes[game_buzzes['team'] == team2_name]
-
-    team1_score = []
-    team2_score = []
-    rscore1 = 0
-    rscore2 = 0
-    for i in range(1, 21):
-        if len(team1_buzzes[team1_buzzes['tossup'] == i]['value']) > 0:
-            team1_tossup = sum(
-                team1_buzzes[team1_buzzes['tossup'] == i]['value'].tolist())
-            if has_bonuses:
-                team1_bonus = sum(
-                    team1_bonuses[team1_bonuses['tossup'] == i]['value'].tolist())
-                team1_score.append(rscore1 + team1_tossup + team1_bonus)
-                rscore1 = rscore1 + team1_tossup + team1_bonus
-            else:
-                team1_score.append(rscore1 + team1_tossup)
-                rscore1 = rscore1 + team1_tossup
-        else:
-            team1_score.append(rscore1)
-
-        if len(team2_buzzes[team2_buzzes['tossup'] == i]['value']) > 0:
-            team2_tossup = sum(
-                team2_buzzes[team2_buzzes['tossup'] == i]['value'].tolist())
-            if has_bonuses:
-                team2_bonus = sum(
-                    team2_bonuses[team2_bonuses['tossup'] == i]['value'].tolist())
-                team2_score.append(rscore2 + team2_tossup + team2_bonus)
-                rscore2 = rscore2 + team2_tossup + team2_bonus
-            else:
-                team2_score.append(rscore2 + team2_tossup)
-                rscore2 = rscore2 + team2_tossup
+        if 'answers_clean' in game_bonuses.columns:
+            game_bonuses['answers'] = game_bonuses['answers_clean']
         else:
-            team2_score.append(rscore2)
-
-    team1_score_df = pd.DataFrame(
-        {'tossup': list(range(1, 21)), 'score': team1_score, 'total': [1]*20})
-    team2_score_df = pd.DataFrame(
-        {'tossup': list(range(1, 21)), 'score': team2_score, 'total': [1]*20})
-
-    all_player_cells = pd.DataFrame({
-        'player': np.repeat(player_stats['player'].unique(), 20),
-        'tossup': list(range(1, 21))*len(player_stats['player'].unique())
-    })
-
-    all_bonus_cells = pd.DataFrame({
-        'part': np.repeat(['part1_value', 'part2_value', 'part3_value'], 20),
-        'tossup': list(range(1, 21))*3
+            game_bonuses['answers'] = qbstreamlit.answers.sanitize_bonus_answers(
+                game_bonuses['answers'])
+
+        for side, name in [('team1', team1_name), ('team2', team2_name)]:
+            datasets[f'{side}_bonuses'] = game_bonuses[game_bonuses['team'] == name].melt(
+                id_vars=['tossup', 'answers'],
+                value_vars=['part1_value', 'part2_value', 'part3_value'],
+                var_name='part', value_name='value'
+            )
+
+    if scores is None:
+        scores = get_score_progressions(
+            game_buzzes, game_bonuses if has_bonuses else None,
+            teams=pd.DataFrame({'game_id': game_id, 'team': teams[:2]}))
+    else:
+        scores = scores[scores['game_id'] == game_id]
+    tossups = scores['tossup'].unique().tolist()
+
+    buzz_columns = ['player', 'tossup', 'value', 'answer', 'buzz_position']
+    for side, name in [('team1', team1_name), ('team2', team2_name)]:
+        datasets[f'{side}_buzzes'] = compact_data(
+            game_buzzes[game_buzzes['team'] == name], buzz_columns)
+        score_df = scores[scores['team'] == name][['tossup', 'score']]
+        score_df['total'] = 1
+        datasets[f'{side}_scores'] = score_df
+
+    players = player_stats['player'].unique()
+    datasets['player_cells'] = pd.DataFrame({
+        'player': np.repeat(players, len(tossups)),
+        'tossup': tossups*len(players)
     })
-
-    all_total_cells = pd.DataFrame({
-        'total': np.repeat(1, 20),
-        'tossup': list(range(1, 21))
+    if has_bonuses:
+        datasets['bonus_cells'] = pd.DataFrame({
+            'part': np.repeat(['part1_value', 'part2_value', 'part3_value'], len(tossups)),
+            'tossup': tossups*3
+        })
+    datasets['total_cells'] = pd.DataFrame({
+        'total': np.repeat(1, len(tossups)),
+        'tossup': tossups
     })
 
-    t1_tossups = alt.Chart(team1_buzzes).mark_text(
+    return {
+        'datasets': datasets,
+        'team1_title': wrap(team1_name, width=12),
+        'team2_title': wrap(team2_name, width=12),
+        'team1_players': player_stats[player_stats['team'] == team1_name]['player'].unique().tolist(),
+        'team2_players': player_stats[player_stats['team'] == team2_name]['player'].unique().tolist(),
+        'tossups': tossups,
+        'tick_count': len(tossups),
+    }
+
+
+def build_scoresheet(data, has_bonuses=True):
+    """Lays out a scoresheet from get_scoresheet_data's frames and values.
+    Returns:
+        alt.HConcatChart: The scoresheet
+    """
+    datasets = data['datasets']
+    tossups = data['tossups']
+
+    t1_tossups = alt.Chart(datasets['team1_buzzes']).mark_text(
     ).encode(
         x=alt.X(
             "player:N",
             axis=alt.Axis(orient='top', ticks=False, offset=5),
-            scale=alt.Scale(
-                domain=player_stats[player_stats['team'] == team1_name]['player'].unique()),
+            scale=alt.Scale(domain=data['team1_players']),
             title=None),
         y=alt.Y(
             'tossup:O',
-            scale=alt.Scale(domain=list(range(1, 21))),
+            scale=alt.Scale(domain=tossups),
             axis=alt.Axis(
-                orient='left', domain=False, ticks=False, tickCount=20, title=None, labelAlign='right', labelFontWeight='bold', labelAngle=0
+                orient='left', domain=False, ticks=False, tickCount=data['tick_count'], title=None, labelAlign='right', labelFontWeight='bold', labelAngle=0
             )),
         text='value:Q',
         tooltip=[alt.Tooltip('answer:N', title="Tossup answer"), alt.Tooltip('buzz_position:Q', title="Buzz location")])
     if has_bonuses:
-        t1_bonuses = alt.Chart(team1_bonuses).mark_text().encode(
+        t1_bonuses = alt.Chart(datasets['team1_bonuses']).mark_text().encode(
             x=alt.X(
                 'part:N',
                 axis=alt.Axis(orient='top', ticks=False, labels=False,
-                              offset=5, title=wrap(team1_name, width=12))
+                              offset=5, title=data['team1_title'])
             ),
             y=alt.Y(
                 'tossup:O',
-                scale=alt.Scale(domain=list(range(1, 21))),
+                scale=alt.Scale(domain=tossups),
                 axis=None),
             text='value:Q',
             tooltip=[alt.Tooltip('answers:N', title="Bonus answers")])
-    t1_score = alt.Chart(team1_score_df).mark_text().encode(
+    t1_score = alt.Chart(datasets['team1_scores']).mark_text().encode(
         x=alt.X('total:N', axis=alt.Axis(orient='top',
                 ticks=False, labels=False, offset=5)),
         y=alt.Y(
             'tossup:O',
-            scale=alt.Scale(domain=list(range(1, 21))),
+            scale=alt.Scale(domain=tossups),
             axis=None),
         text='score:Q')
-    t2_tossups = alt.Chart(team2_buzzes).mark_text().encode(
+    t2_tossups = alt.Chart(datasets['team2_buzzes']).mark_text().encode(
         x=alt.X(
             "player:N",
             axis=alt.Axis(orient='top', ticks=False, offset=5),
-            scale=alt.Scale(
-                domain=player_stats[player_stats['team'] == team2_name]['player'].unique()),
+            scale=alt.Scale(domain=data['team2_players']),
             title=None),
         y=alt.Y(
             'tossup:O',
-            scale=alt.Scale(domain=list(range(1, 21))),
+            scale=alt.Scale(domain=tossups),
             axis=alt.Axis(
-                orient='left', grid=False, ticks=False, tickCount=20, title=None, labelAlign='right', labelFontWeight='bold', labelAngle=0
+                orient='left', grid=False, ticks=False, tickCount=data['tick_count'], title=None, labelAlign='right', labelFontWeight='bold', labelAngle=0
             )),
         text='value:Q',
         tooltip=[alt.Tooltip('answer:N', title="Tossup answer"), alt.Tooltip('buzz_position:Q', title="Buzz location")])
     if has_bonuses:
-        t2_bonuses = alt.Chart(team2_bonuses).mark_text().encode(
+        t2_bonuses = alt.Chart(datasets['team2_bonuses']).mark_text().encode(
             x=alt.X(
                 'part:N',
                 axis=alt.Axis(orient='top', ticks=False, labels=False,
-                              offset=5, title=wrap(team2_name, width=12))
+                              offset=5, title=data['team2_title'])
             ),
             y=alt.Y(
                 'tossup:O',
-                scale=alt.Scale(domain=list(range(1, 21))),
+                scale=alt.Scale(domain=tossups),
                 axis=None),
             text='value:Q',
             tooltip=[alt.Tooltip('answers:N', title="Bonus answers")])
-    t2_score = alt.Chart(team2_score_df).mark_text().encode(
+    t2_score = alt.Chart(datasets['team2_scores']).mark_text().encode(
         x=alt.X('total:N', axis=alt.Axis(orient='top',
                 ticks=False, offset=5, labels=False)),
         y=alt.Y(
             'tossup:O',
-            scale=alt.Scale(domain=list(range(1, 21))),
+            scale=alt.Scale(domain=tossups),
             axis=None),
         text='score:Q')
 
-    player_grid = alt.Chart(all_player_cells).mark_rect(
+    player_grid = alt.Chart(datasets['player_cells']).mark_rect(
         stroke='black', strokeWidth=.1, fill=None
     ).encode(
         x='player:N', y=alt.Y('tossup:O'), detail='count()'
     )
 
     if has_bonuses:
-        bonus_grid = alt.Chart(all_bonus_cells).mark_rect(
+        bonus_grid = alt.Chart(datasets['bonus_cells']).mark_rect(
             stroke='black', strokeWidth=.1, fill=None
         ).encode(
             x='part:N', y='tossup:O'
         )
 
-    total_grid = alt.Chart(all_total_cells).mark_rect(
+    total_grid = alt.Chart(datasets['total_cells']).mark_rect(
         stroke='black', strokeWidth=.1, fill=None
     ).encode(
         x='total:N', y='tossup:O'
@@ -291,6 +374,211 @@ def make_scoresheet(game_id, buzzes, bonuses, player_stats, has_bonuses=True):
 
     return final_chart
 
+
+def make_scoresheet(game_id, buzzes, bonuses, player_stats, has_bonuses=True,
+                    team_stats=None):
+    return build_scoresheet(get_scoresheet_data(
+        game_id, buzzes, bonuses, player_stats, has_bonuses=has_bonuses,
+        team_stats=team_stats), has_bonuses=has_bonuses)
+
+
+@functools.lru_cache(maxsize=2)
+def get_scoresheet_template(has_bonuses=True):
+    """Lays out a scoresheet once, with named datasets and '{name}'
+    placeholders where get_scoresheet_data's values go.
+    Returns:
+        str: The template's Vega-Lite JSON
+    """
+    data = {
+        'datasets': {name: alt.NamedData(name=name) for name in [
+            'team1_buzzes', 'team1_bonuses', 'team1_scores', 'team2_buzzes',
+            'team2_bonuses', 'team2_scores', 'player_cells', 'bonus_cells', 'total_cells']},
+        # Vega-Lite takes an expression wherever it takes a number.
+        'tick_count': {'expr': '{tick_count}'},
+    }
+    for name in ['team1_title', 'team2_title', 'team1_players', 'team2_players', 'tossups']:
+        data[name] = [f'{{{name}}}']
+    return build_scoresheet(data, has_bonuses=has_bonuses).to_json(indent=None)
+
+
+def fill_scoresheet_spec(spec, values):
+    """Replaces a template's placeholders with their values. A placeholder
+    stands alone, as a one-item list, or as an expression."""
+    if isinstance(spec, dict):
+        if list(spec) == ['expr'] and spec['expr'] in values:
+            return values[spec['expr']]
+        return {key: fill_scoresheet_spec(value, values) for key, value in spec.items()}
+    if isinstance(spec, list):
+        if len(spec) == 1 and isinstance(spec[0], str) and spec[0] in values:
+            return values[spec[0]]
+        return [fill_scoresheet_spec(value, values) for value in spec]
+    if isinstance(spec, str) and spec in values:
+        return values[spec]
+    return spec
+
+
+def make_scoresheet_specs(game_ids, buzzes, bonuses, player_stats, team_stats,
+                          has_bonuses=True, on_error=None):
+    """Serializes the scoresheets of several games at once. Running scores
+    come from one get_score_progressions over all the games, and each spec
+    fills the game's slices into get_scoresheet_template, so Altair lays
+    out the chart once rather than once per game.
+    Args:
+        game_ids (list): Games to serialize
+        buzzes (pd.DataFrame): Buzzes of the games, as from load_scoresheet_data
+        bonuses (pd.DataFrame): Bonuses of the games
+        player_stats (pd.DataFrame): Player stats of the games
+        team_stats (pd.DataFrame): game_id and team of the games
+        has_bonuses (bool): Include bonus columns
+        on_error (callable): Called with the game_id and exception of each
+            game that fails; None raises it
+    Returns:
+        dict: Vega-Lite JSON by game_id
+    """
+    try:
+        scores = get_score_progressions(
+            buzzes, bonuses if has_bonuses else None,
+            teams=team_stats[['game_id', 'team']].drop_duplicates())
+    except Exception:
+        # Each game then works out its own scores, so only bad games fail.
+        scores = None
+    template = json.loads(get_scoresheet_template(has_bonuses))
+    frames = [buzzes, bonuses, player_stats, team_stats]
+    slices = [dict(tuple(df.groupby('game_id'))) for df in frames]
+
+    specs = {}
+    for game_id in game_ids:
+        try:
+            game_buzzes, game_bonuses, game_player_stats, game_team_stats = [
+                groups.get(game_id, df.iloc[:0]) for groups, df in zip(slices, frames)]
+            data = get_scoresheet_data(
+                game_id, game_buzzes, game_bonuses, game_player_stats,
+                has_bonuses=has_bonuses, team_stats=game_team_stats, scores=scores)
+            values = {f'{{{name}}}': value for name, value in data.items() if name != 'datasets'}
+            spec = fill_scoresheet_spec(template, values)
+            spec['datasets'] = {name: alt.utils.data.to_values(df)['values']
+                                for name, df in data['datasets'].items()}
+            specs[game_id] = json.dumps(spec, sort_keys=True)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(game_id, e)
+    return specs
+
+def load_scoresheet_data(tournament, game_id=None):
+    tossup_meta = qbstreamlit.data.load_tossup_meta(tournament=tournament)
+    tossup_meta = compact_data(
+        tossup_meta, ['packet', 'tossup', 'answer', 'answer_clean'])
+    bonus_meta = qbstreamlit.data.load_bonus_meta(tournament=tournament)
+    bonus_meta = compact_data(
+        bonus_meta, ['packet', 'bonus', 'answers', 'answers_clean'])
+
+    buzzes = qbstreamlit.data.load_buzzes(
+        game_id=game_id, tournament=tournament).merge(
+        tossup_meta, on=['packet', 'tossup'])
+    bonuses = qbstreamlit.data.load_bonuses(
+        game_id=game_id, tournament=tournament).merge(
+        bonus_meta, on=['packet', 'bonus'])
+    player_stats = qbstreamlit.data.load_player_stats(
+        game_id=game_id, tournament=tournament)
+    team_stats = qbstreamlit.data.load_team_stats(
+        game_id=game_id, columns=['game_id', 'team'], tournament=tournament)
+    return buzzes, bonuses, player_stats, team_stats
+
+
+def render_scoresheet_specs(tournament, has_bonuses=True, game_ids=None):
+    """Renders scoresheets and stores their Vega-Lite JSON in the
+    tournament's partition of the scoresheets table.
+
+    Run it after ingest. Writes that change a game's rows or packet drop its
+    stored spec, so only games without one are rendered, plus any listed in
+    game_ids. Games still being scored live are rendered on the fly instead.
+    Args:
+        tournament (str): Tournament to render
+        has_bonuses (bool): Include bonus columns
+        game_ids (list): Games to render even if they have a stored spec
+    Returns:
+        list: game_ids rendered; games that fail are left out and reported
+            as 'scoresheet_error' instrumentation events
+    """
+    con = qbstreamlit.db.connect()
+    try:
+        games = set()
+        if qbstreamlit.db.table_exists(con, 'team_stats'):
+            games = {row[0] for row in con.execute(
+                'SELECT DISTINCT game_id FROM team_stats WHERE tournament = ?', (tournament,))}
+        if qbstreamlit.db.table_exists(con, 'live_games'):
+            games -= {row[0] for row in con.execute(
+                'SELECT game_id FROM live_games WHERE tournament = ? AND finished = 0',
+                (tournament,))}
+        stored = set()
+        if qbstreamlit.db.table_exists(con, 'scoresheets') and \
+                'tournament' in qbstreamlit.db.get_table_columns(con, 'scoresheets'):
+            stored = {row[0] for row in con.execute(
+                'SELECT game_id FROM scoresheets WHERE tournament = ? AND has_bonuses = ?',
+                (tournament, int(has_bonuses)))}
+    finally:
+        con.close()
+    pending = sorted((games - stored) | (games & set(game_ids or [])))
+    if len(pending) == 0:
+        return []
+
+    buzzes, bonuses, player_stats, team_stats = load_scoresheet_data(tournament, pending)
+
+    # One game that cannot be drawn does not fail the build; it is reported
+    # and rendered on the fly when viewed.
+    def report(game_id, e):
+        qbstreamlit.instrument.emit(
+            'scoresheet_error', tournament=tournament, game_id=int(game_id),
+            error=f'{type(e).__name__}: {e}')
+        qbstreamlit.instrument.logger.warning(
+            'Scoresheet for %s game %s failed: %s: %s',
+            tournament, game_id, type(e).__name__, e)
+
+    specs = [
+        {'game_id': int(game_id), 'has_bonuses': int(has_bonuses), 'spec': spec}
+        for game_id, spec in make_scoresheet_specs(
+            pending, buzzes, bonuses, player_stats, team_stats,
+            has_bonuses=has_bonuses, on_error=report).items()
+    ]
+
+    con = qbstreamlit.db.connect()
+    try:
+        with qbstreamlit.db.transaction(con):
+            scoresheets = pd.DataFrame(
+                specs, columns=['game_id', 'has_bonuses', 'spec'])
+            # The commit bumps the generation, so tag rows with the next one.
+            scoresheets['generation'] = qbstreamlit.db.get_generation(con) + 1
+            if qbstreamlit.db.table_exists(con, 'scoresheets') and \
+                    'tournament' in qbstreamlit.db.get_table_columns(con, 'scoresheets'):
+                qbstreamlit.db.delete_partition_rows(
+                    con, 'scoresheets', tournament, 'game_id', pending)
+                qbstreamlit.db.append_partition(con, 'scoresheets', scoresheets, tournament)
+            else:
+                qbstreamlit.db.replace_partition(con, 'scoresheets', scoresheets, tournament)
+    finally:
+        con.close()
+    return list(scoresheets['game_id'])
+
+
+def get_scoresheet_spec(tournament, game_id, has_bonuses=True):
+    """Returns a game's scoresheet as a Vega-Lite spec dict.
+
+    Serves the spec stored by render_scoresheet_specs when there is one and
+    renders the game on the fly otherwise.
+    """
+    stored = qbstreamlit.data.load_scoresheet(
+        game_id, has_bonuses, tournament=tournament)
+    if stored is not None:
+        return json.loads(stored)
+
+    buzzes, bonuses, player_stats, team_stats = load_scoresheet_data(tournament, game_id)
+    return make_scoresheet(
+        game_id, buzzes, bonuses, player_stats, has_bonuses=has_bonuses,
+        team_stats=team_stats
+    ).to_dict()
+
+
 def make_bpa_ppg_chart(df):
     char = alt.Chart(df).mark_point().encode(
         y=alt.Y('ACC', axis=alt.Axis(title='Avg. Correct Celerity')),
@@ -1,119 +1,377 @@
 import sqlite3 as sq
+import numpy as np
 import pandas as pd
 import glob
-import json
-import streamlit as st
+import os
+import qbstreamlit.db
+import qbstreamlit.instrument
+import qbstreamlit.jsonstream
+from qbstreamlit.cache import cached_loader
 
-def fetch_df(_cursor):
-    rows = _cursor.fetchall()
+SQL_DTYPES = {'INTEGER': 'int64', 'REAL': 'float64'}
+
+def get_dtypes(table):
+    columns = qbstreamlit.db.SCHEMA.get(table, {}).get('columns', {})
+    return {
+        column: SQL_DTYPES[sql_type]
+        for column, sql_type in columns.items() if sql_type in SQL_DTYPES
+    }
+
+def fetch_df(_cursor, dtypes=None, chunksize=10000):
+    """Reads a cursor's results column by column into a DataFrame.
+    Args:
+        _cursor (sqlite3.Cursor): Executed cursor
+        dtypes (dict): Column to numpy dtype; other columns are inferred
+        chunksize (int): Rows fetched from SQLite at a time
+    Returns:
+        pd.DataFrame: The query results
+    """
+    if dtypes is None:
+        dtypes = {}
     keys = [k[0] for k in _cursor.description]
-    game_results = [dict(zip(keys, row)) for row in rows]
-    results = pd.DataFrame(game_results)
-    return results
-
-def load_buzzes():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM buzzes')
-    buzzes = fetch_df(cur)
-    con.close()
-    buzzes[['packet']] = buzzes[['packet']].astype(int)
-    buzzes[['tossup']] = buzzes[['tossup']].astype(int)
-    buzzes[['buzz_position']] = buzzes[['buzz_position']].astype(int)
-    buzzes[['value']] = buzzes[['value']].astype(int)
-    return buzzes
-
-def load_bonuses():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM bonuses')
-    bonuses = fetch_df(cur)
-    con.close()
-    bonuses[['packet']] = bonuses[['packet']].astype(int)
-    bonuses[['bonus']] = bonuses[['bonus']].astype(int)
-    bonuses[['tossup']] = bonuses[['tossup']].astype(int)
-    return bonuses
-
-def load_tossup_meta():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM tossup_meta')
-    tossup_meta = fetch_df(cur)
-    con.close()
-    tossup_meta[['packet']] = tossup_meta[['packet']].astype(int)
-    return tossup_meta
-
-def load_bonus_meta():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM bonus_meta')
-    bonus_meta = fetch_df(cur)
-    con.close()
-    bonus_meta[['packet']] = bonus_meta[['packet']].astype(int)
-    return bonus_meta
-
-def load_team_stats():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM team_stats')
-    team_stats = fetch_df(cur)
-    con.close()
-    return team_stats
-
-def load_player_stats():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM player_stats')
-    player_stats = fetch_df(cur)
-    con.close()
-    return player_stats
-
-def load_player_bpa():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
-
-    cur.execute('SELECT * FROM player_bpa')
-    player_bpa = fetch_df(cur)
-    cur.execute('SELECT * FROM player_cat_bpa')
-    player_cat_bpa = fetch_df(cur)
-    con.close()
-    return player_bpa, player_cat_bpa
+    columns = [[] for key in keys]
+    while True:
+        rows = _cursor.fetchmany(chunksize)
+        if len(rows) == 0:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+
+    results = {}
+    for key, values in zip(keys, columns):
+        if key in dtypes:
+            try:
+                results[key] = np.array(values, dtype=dtypes[key])
+                continue
+            except (TypeError, ValueError):
+                pass
+        results[key] = pd.Series(values, dtype=object).infer_objects()
+    return pd.DataFrame(results, columns=keys)
+
+def build_where(contains=None, **filters):
+    """Builds a parameterized WHERE clause.
+    Args:
+        contains (dict): Column to a substring it must contain (case-insensitive)
+        **filters: Column to value, or to a list of values; None is ignored
+    Returns:
+        tuple: SQL string (empty when nothing is filtered) and its parameters
+    """
+    clauses = []
+    params = []
+    for column, value in filters.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            clauses.append(
+                f'"{column}" IN ({", ".join(["?"]*len(value))})')
+            params.extend(value)
+        else:
+            clauses.append(f'"{column}" = ?')
+            params.append(value)
+
+    for column, text in (contains or {}).items():
+        if text is None or text == '':
+            continue
+        clauses.append(f'"{column}" LIKE ? ESCAPE \'\\\'')
+        escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f'%{escaped}%')
+
+    if len(clauses) == 0:
+        return '', params
+    return ' WHERE ' + ' AND '.join(clauses), params
+
+def build_query(table, columns=None, **filters):
+    """Builds a parameterized SELECT for one stats.db table.
+    Args:
+        table (str): Table name
+        columns (list): Columns to select; None selects all of them
+        **filters: Column to value, or to a list of values; None is ignored
+    Returns:
+        tuple: SQL string and its parameters
+    """
+    if columns is None:
+        select = '*'
+    else:
+        select = ', '.join([f'"{column}"' for column in columns])
+
+    where, params = build_where(**filters)
+    return f'SELECT {select} FROM {table}{where}', params
+
+def query_table(table, columns=None, **filters):
+    with qbstreamlit.instrument.timed('sql_read', table=table) as fields:
+        con = sq.connect(qbstreamlit.db.DB_PATH)
+        cur = con.cursor()
+
+        cur.execute(*build_query(table, columns, **filters))
+        df = fetch_df(cur, get_dtypes(table))
+        con.close()
+        fields['rows'] = len(df.index)
+    return df
+
+class TournamentRequiredError(ValueError):
+    """Raised when a per-tournament loader is called without a tournament
+    while stats.db holds more than one."""
+
+def require_tournament(tournament):
+    """Raises unless tournament is given or stats.db holds at most one
+    tournament. Rows from different tournaments reuse game_ids, packet and
+    tossup numbers, so an unfiltered read would mix them silently. Frames
+    read with a list of tournaments (or with none, from a single-tournament
+    stats.db) carry a tournament column, and merges between them must
+    include tournament in their keys.
+    Args:
+        tournament (str or list): The loader's tournament filter
+    """
+    if tournament is not None or not os.path.exists(qbstreamlit.db.DB_PATH):
+        return
+    con = sq.connect(qbstreamlit.db.DB_PATH)
+    try:
+        if not qbstreamlit.db.table_exists(con, 'partitions'):
+            return
+        count = con.execute('SELECT COUNT(*) FROM partitions').fetchone()[0]
+    finally:
+        con.close()
+    if count > 1:
+        raise TournamentRequiredError(
+            f'stats.db holds {count} tournaments; pass tournament= to choose one')
+
+@cached_loader
+def load_page(table, columns=None, sort=None, ascending=True, page=0, page_size=100,
+              contains=None, **filters):
+    """Reads one page of a stats.db table, sorted and filtered in SQLite, so
+    only that page leaves the database.
+    Args:
+        table (str): Table name
+        columns (list): Columns to select; None selects all of them
+        sort (str): Column to sort by; None keeps table order
+        ascending (bool): Sort direction
+        page (int): Zero-based page number
+        page_size (int): Rows per page
+        contains (dict): Column to a substring it must contain
+        **filters: Column to value, or to a list of values; None is ignored
+    Returns:
+        tuple: The page as a DataFrame and the number of matching rows
+    """
+    if 'tournament' in qbstreamlit.db.SCHEMA.get(table, {}).get('columns', {}):
+        require_tournament(filters.get('tournament'))
+    if columns is None:
+        select = '*'
+    else:
+        select = ', '.join([f'"{column}"' for column in columns])
+    where, params = build_where(
+        contains=None if contains is None else dict(contains), **filters)
+
+    sql = f'SELECT {select} FROM {table}{where}'
+    if sort is not None:
+        # rowid breaks ties so pages do not overlap.
+        sql += f' ORDER BY "{sort}" {"ASC" if ascending else "DESC"}, rowid'
+    sql += ' LIMIT ? OFFSET ?'
+
+    con = sq.connect(qbstreamlit.db.DB_PATH)
+    try:
+        total = con.execute(f'SELECT COUNT(*) FROM {table}{where}', params).fetchone()[0]
+        cur = con.cursor()
+        cur.execute(sql, params + [page_size, page*page_size])
+        df = fetch_df(cur, get_dtypes(table))
+    finally:
+        con.close()
+    return df, total
+
+@cached_loader
+def load_buzzes(game_id=None, team=None, player=None, packet=None, columns=None,
+                tournament=None):
+    require_tournament(tournament)
+    return query_table(
+        'buzzes', columns, tournament=tournament, game_id=game_id, team=team,
+        player=player, packet=packet)
+
+@cached_loader
+def load_bonuses(game_id=None, team=None, packet=None, columns=None, tournament=None):
+    require_tournament(tournament)
+    return query_table(
+        'bonuses', columns, tournament=tournament, game_id=game_id, team=team,
+        packet=packet)
+
+@cached_loader
+def load_tossup_meta(packet=None, columns=None, tournament=None):
+    require_tournament(tournament)
+    return query_table('tossup_meta', columns, tournament=tournament, packet=packet)
+
+@cached_loader
+def load_bonus_meta(packet=None, columns=None, tournament=None):
+    require_tournament(tournament)
+    return query_table('bonus_meta', columns, tournament=tournament, packet=packet)
 
-def load_team_bpa():
-    con = sq.connect('stats.db')
-    cur = con.cursor()
+@cached_loader
+def load_team_stats(game_id=None, team=None, columns=None, tournament=None):
+    require_tournament(tournament)
+    return query_table(
+        'team_stats', columns, tournament=tournament, game_id=game_id, team=team)
 
-    cur.execute('SELECT * FROM team_bpa')
-    team_bpa = fetch_df(cur)
-    cur.execute('SELECT * FROM team_cat_bpa')
-    team_cat_bpa = fetch_df(cur)
-    con.close()
+@cached_loader
+def load_player_stats(game_id=None, team=None, player=None, columns=None,
+                      tournament=None):
+    require_tournament(tournament)
+    return query_table(
+        'player_stats', columns, tournament=tournament, game_id=game_id, team=team,
+        player=player)
+
+@cached_loader
+def load_player_bpa(team=None, player=None, tournament=None):
+    require_tournament(tournament)
+    player_bpa = query_table(
+        'player_bpa', tournament=tournament, team=team, player=player)
+    player_cat_bpa = query_table(
+        'player_cat_bpa', tournament=tournament, team=team, player=player)
+    return player_bpa, player_cat_bpa
+
+@cached_loader
+def load_team_bpa(team=None, tournament=None):
+    require_tournament(tournament)
+    team_bpa = query_table('team_bpa', tournament=tournament, team=team)
+    team_cat_bpa = query_table('team_cat_bpa', tournament=tournament, team=team)
     return team_bpa, team_cat_bpa
 
-def get_packets(tournament):
-    packets = {}
+@cached_loader
+def load_buzz_histogram(team=None, player=None, category=None, tournament=None):
+    require_tournament(tournament)
+    return query_table(
+        'buzz_histogram', tournament=tournament, team=team, player=player,
+        category=category)
+
+@cached_loader
+def load_player_career_bpa(player=None, tournament=None):
+    """Combines players' BPA and ACC across tournaments.
+
+    Each tournament's BPA is weighted by games played. ACC is the mean
+    celerity over every correct buzz, recovered from each tournament's BPA,
+    TUH and ACC.
+    Args:
+        player (str or list): Players to include; None includes every player
+        tournament (str or list): Tournaments to include; None includes all of them
+    Returns:
+        pd.DataFrame: player, Tournaments, Games, BPA and ACC
+    """
+    keys = ['tournament', 'player', 'team']
+    bpa = query_table(
+        'player_bpa', keys + ['BPA', 'ACC'], tournament=tournament, player=player)
+    games = query_table(
+        'player_stats', keys + ['game_id'], tournament=tournament, player=player)
+    games = games.groupby(keys, as_index=False).agg(Games=('game_id', 'nunique'))
+
+    career = bpa.merge(games, on=keys)
+    # BPA = 100*sum(celerity)/TUH and ACC = sum(celerity)/correct buzzes.
+    career['celerity'] = career['BPA']*career['Games']*20/100
+    career['correct'] = (career['celerity']/career['ACC']).fillna(0)
+    career['weighted_bpa'] = career['BPA']*career['Games']
+    career = career.groupby('player', as_index=False).agg(
+        Tournaments=('tournament', 'nunique'), Games=('Games', 'sum'),
+        weighted_bpa=('weighted_bpa', 'sum'), celerity=('celerity', 'sum'),
+        correct=('correct', 'sum'))
+    career['BPA'] = career['weighted_bpa']/career['Games']
+    career['ACC'] = career['celerity']/career['correct'].replace(0, np.nan)
+    return career[['player', 'Tournaments', 'Games', 'BPA', 'ACC']]
+
+@cached_loader
+def load_scoresheet(game_id, has_bonuses=True, tournament=None):
+    """Returns the stored scoresheet JSON for a game, or None if there is
+    none since the game's rows or packet last changed."""
+    if not os.path.exists(qbstreamlit.db.DB_PATH):
+        return None
+    require_tournament(tournament)
+    con = sq.connect(qbstreamlit.db.DB_PATH)
+    try:
+        if not qbstreamlit.db.table_exists(con, 'scoresheets') or \
+                'tournament' not in qbstreamlit.db.get_table_columns(con, 'scoresheets'):
+            return None
+        sql = 'SELECT spec FROM scoresheets WHERE game_id = ? AND has_bonuses = ?'
+        params = [int(game_id), int(has_bonuses)]
+        if tournament is not None:
+            sql += ' AND tournament = ?'
+            params.append(tournament)
+        row = con.execute(sql, params).fetchone()
+    finally:
+        con.close()
+    if row is None:
+        return None
+    return row[0]
+
+@cached_loader
+def load_live_games(tournament=None):
+    """Returns the games being scored live whose QBJ file has not been
+    ingested yet: path, game_id, packet, events applied and finished."""
+    columns = list(qbstreamlit.db.SCHEMA['live_games']['columns'])
+    if not os.path.exists(qbstreamlit.db.DB_PATH):
+        return pd.DataFrame(columns=columns)
+    con = sq.connect(qbstreamlit.db.DB_PATH)
+    try:
+        exists = qbstreamlit.db.table_exists(con, 'live_games')
+    finally:
+        con.close()
+    if not exists:
+        return pd.DataFrame(columns=columns)
+    return query_table('live_games', tournament=tournament)
+
+def iter_packets(tournament):
+    """Yields (path, packet) one file at a time, so only one packet is in
+    memory at once."""
     for file in glob.glob(f'packets/{tournament}/*.json'):
-        print(file)
-        with open(file, 'r') as f:
-            packets[file] = json.load(f)
-    return packets
+        qbstreamlit.instrument.logger.debug('Reading packet %s', file)
+        yield file, qbstreamlit.jsonstream.load_json(file)
 
-def get_packet_meta(tournament):
-    packets = get_packets(tournament)
+def get_packets(tournament):
+    return dict(iter_packets(tournament))
+
+def get_tossup_lengths(tossups):
     packet_meta = []
-    for packet in packets.keys():
-        for tossup in packets[packet]['tossups']:
-            packet_meta.append(
-                {
-                    'packet': tossup['packetNumber'],
-                    'tossup': tossup['questionNumber'],
-                    'tossup_length': len(tossup['question'].split(' '))
-                }
-            )
-    return pd.DataFrame(packet_meta)
\ No newline at end of file
+    for tossup in tossups:
+        packet_meta.append(
+            {
+                'packet': tossup['packetNumber'],
+                'tossup': tossup['questionNumber'],
+                'tossup_length': len(tossup['question'].split(' '))
+            }
+        )
+    return pd.DataFrame(packet_meta, columns=['packet', 'tossup', 'tossup_length'])
+
+def load_stored_packet_meta(tournament):
+    """Returns tossup lengths stored at packet ingest, or None if stats.db
+    has none or any packet file changed since it was ingested."""
+    packet_paths = glob.glob(f'packets/{tournament}/*.json')
+    if len(packet_paths) == 0 or not os.path.exists(qbstreamlit.db.DB_PATH):
+        return None
+
+    con = sq.connect(qbstreamlit.db.DB_PATH)
+    try:
+        if not qbstreamlit.db.table_exists(con, 'packet_manifest') or \
+                'tournament' not in qbstreamlit.db.get_table_columns(con, 'packet_manifest'):
+            return None
+        cur = con.cursor()
+        cur.execute(*build_query(
+            'packet_manifest', ['path', 'mtime'], tournament=tournament,
+            path=packet_paths))
+        manifest = fetch_df(cur, get_dtypes('packet_manifest'))
+    finally:
+        con.close()
+
+    mtimes = dict(zip(manifest['path'], manifest['mtime']))
+    for packet_path in packet_paths:
+        if mtimes.get(packet_path) != os.path.getmtime(packet_path):
+            return None
+
+    return query_table(
+        'packet_meta', ['packet', 'tossup', 'tossup_length'], tournament=tournament,
+        path=packet_paths)
+
+def get_packet_meta(tournament):
+    packet_meta = load_stored_packet_meta(tournament)
+    if packet_meta is not None:
+        return packet_meta
+
+    # Tossups are streamed one at a time when ijson is installed.
+    return pd.concat(
+        [get_tossup_lengths(qbstreamlit.jsonstream.iter_json_items(file, 'tossups'))
+         for file in glob.glob(f'packets/{tournament}/*.json')],
+        ignore_index=True
+    )
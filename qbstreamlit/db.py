@@ -0,0 +1,577 @@
+import sqlite3 as sq
+from contextlib import contextmanager
+import pandas as pd
+import qbstreamlit.instrument
+
+DB_PATH = 'stats.db'
+
+# Declared column types, primary keys and indexes for the tables written by
+# qbstreamlit.parser. Columns not listed here get a type inferred from the
+# DataFrame dtype.
+#
+# references maps a table to the columns each of its rows should match in
+# another table. SQLite does not enforce them: stages replace the tables of
+# a partition one at a time, so they only hold once a build has finished,
+# when find_orphans checks them.
+#
+# Every table is partitioned by tournament: rows carry a tournament column,
+# writes replace one tournament's rows at a time, and indexes lead with
+# tournament so per-tournament queries never scan other partitions.
+SCHEMA = {
+    'buzzes': {
+        'columns': {
+            'tournament': 'TEXT', 'tossup': 'INTEGER', 'player': 'TEXT', 'team': 'TEXT',
+            'buzz_position': 'INTEGER', 'value': 'INTEGER',
+            'packet': 'INTEGER', 'game_id': 'INTEGER'
+        },
+        'indexes': [
+            ['tournament', 'game_id'], ['tournament', 'packet', 'tossup'],
+            ['tournament', 'player', 'team'], ['tournament', 'team']
+        ],
+        'references': {
+            'tossup_meta': ['tournament', 'packet', 'tossup'],
+            'team_stats': ['tournament', 'game_id']
+        }
+    },
+    'bonuses': {
+        'columns': {
+            'tournament': 'TEXT', 'tossup': 'INTEGER', 'bonus': 'INTEGER',
+            'part1_value': 'INTEGER', 'part2_value': 'INTEGER', 'part3_value': 'INTEGER',
+            'team': 'TEXT', 'packet': 'INTEGER', 'game_id': 'INTEGER'
+        },
+        'indexes': [
+            ['tournament', 'game_id'], ['tournament', 'packet', 'tossup'],
+            ['tournament', 'team']
+        ],
+        'references': {
+            'bonus_meta': ['tournament', 'packet', 'bonus'],
+            'team_stats': ['tournament', 'game_id']
+        }
+    },
+    'player_stats': {
+        'columns': {
+            'tournament': 'TEXT', 'player': 'TEXT', 'team': 'TEXT', '15': 'INTEGER',
+            '10': 'INTEGER', '-5': 'INTEGER', 'Pts': 'INTEGER', 'packet': 'INTEGER',
+            'game_id': 'INTEGER'
+        },
+        # The player index serves cross-tournament (career) lookups.
+        'indexes': [
+            ['tournament', 'game_id'], ['tournament', 'player', 'team'],
+            ['tournament', 'team'], ['player']
+        ],
+        'references': {'team_stats': ['tournament', 'game_id', 'team']}
+    },
+    'team_stats': {
+        'columns': {
+            'tournament': 'TEXT', 'team': 'TEXT', '15': 'INTEGER', '10': 'INTEGER',
+            '-5': 'INTEGER', 'TUPts': 'INTEGER', 'BHrd': 'INTEGER', 'BPts': 'INTEGER',
+            'PPB': 'REAL', 'Pts': 'INTEGER', 'packet': 'INTEGER', 'game_id': 'INTEGER'
+        },
+        'indexes': [['tournament', 'game_id'], ['tournament', 'team']],
+        'references': {'tossup_meta': ['tournament', 'packet']}
+    },
+    'tossup_meta': {
+        'columns': {'tournament': 'TEXT', 'tossup': 'INTEGER', 'packet': 'INTEGER'},
+        'indexes': [['tournament', 'packet', 'tossup']]
+    },
+    'bonus_meta': {
+        'columns': {'tournament': 'TEXT', 'bonus': 'INTEGER', 'packet': 'INTEGER'},
+        'indexes': [['tournament', 'packet', 'bonus']]
+    },
+    'player_bpa': {
+        'columns': {
+            'tournament': 'TEXT', 'player': 'TEXT', 'team': 'TEXT',
+            'BPA': 'REAL', 'ACC': 'REAL'
+        },
+        'primary_key': ['tournament', 'player', 'team'],
+        'indexes': [['tournament', 'team'], ['player']],
+        'references': {'player_stats': ['tournament', 'player', 'team']}
+    },
+    'player_cat_bpa': {
+        'columns': {
+            'tournament': 'TEXT', 'player': 'TEXT', 'team': 'TEXT', 'category': 'TEXT',
+            'BPA': 'REAL', 'ACC': 'REAL'
+        },
+        'primary_key': ['tournament', 'player', 'team', 'category'],
+        'indexes': [['tournament', 'team']],
+        'references': {'player_stats': ['tournament', 'player', 'team']}
+    },
+    'team_bpa': {
+        'columns': {'tournament': 'TEXT', 'team': 'TEXT', 'BPA': 'REAL', 'ACC': 'REAL'},
+        'primary_key': ['tournament', 'team'],
+        'references': {'team_stats': ['tournament', 'team']}
+    },
+    'team_cat_bpa': {
+        'columns': {
+            'tournament': 'TEXT', 'team': 'TEXT', 'category': 'TEXT',
+            'BPA': 'REAL', 'ACC': 'REAL'
+        },
+        'primary_key': ['tournament', 'team', 'category'],
+        'references': {'team_stats': ['tournament', 'team']}
+    },
+    'packet_meta': {
+        'columns': {
+            'tournament': 'TEXT', 'packet': 'INTEGER', 'tossup': 'INTEGER',
+            'tossup_length': 'INTEGER', 'path': 'TEXT'
+        },
+        'indexes': [['tournament', 'packet', 'tossup'], ['path']],
+        'references': {'tossup_meta': ['tournament', 'packet', 'tossup']}
+    },
+    'packet_manifest': {
+        'columns': {
+            'tournament': 'TEXT', 'path': 'TEXT', 'hash': 'TEXT', 'mtime': 'REAL',
+            'packet': 'INTEGER'
+        },
+        'primary_key': ['tournament', 'path']
+    },
+    'buzz_histogram': {
+        'columns': {
+            'tournament': 'TEXT', 'team': 'TEXT', 'player': 'TEXT', 'category': 'TEXT',
+            'value': 'INTEGER', 'bin_start': 'INTEGER', 'count': 'INTEGER',
+            'bin_end': 'INTEGER'
+        },
+        'indexes': [['tournament', 'team'], ['tournament', 'player', 'team']]
+    },
+    # A stored scoresheet is current until a write to its game's rows or
+    # packet drops it (see delete_scoresheets).
+    'scoresheets': {
+        'columns': {
+            'tournament': 'TEXT', 'game_id': 'INTEGER', 'has_bonuses': 'INTEGER',
+            'spec': 'TEXT', 'generation': 'INTEGER'
+        },
+        'primary_key': ['tournament', 'game_id', 'has_bonuses'],
+        'references': {'team_stats': ['tournament', 'game_id']}
+    },
+    'qbj_manifest': {
+        'columns': {
+            'tournament': 'TEXT', 'path': 'TEXT', 'hash': 'TEXT', 'mtime': 'REAL',
+            'game_id': 'INTEGER'
+        },
+        'primary_key': ['tournament', 'path'],
+        'indexes': [['tournament', 'game_id']],
+        'references': {'team_stats': ['tournament', 'game_id']}
+    },
+    # Games being scored from a live event feed whose QBJ file has not been
+    # ingested yet. events counts the feed events applied to the game.
+    'live_games': {
+        'columns': {
+            'tournament': 'TEXT', 'path': 'TEXT', 'game_id': 'INTEGER',
+            'packet': 'INTEGER', 'events': 'INTEGER', 'finished': 'INTEGER'
+        },
+        'primary_key': ['tournament', 'path']
+    },
+    # The generation at which each tournament's data last changed.
+    'partitions': {
+        'columns': {'tournament': 'TEXT', 'generation': 'INTEGER'},
+        'primary_key': ['tournament']
+    },
+}
+
+
+def connect(path=None, timeout=30):
+    """Opens stats.db in WAL mode so readers keep working during a rebuild.
+    Args:
+        path (str): Path to the database file; defaults to DB_PATH
+        timeout (int): Seconds to wait on a locked database
+    Returns:
+        sqlite3.Connection: Connection with transactions managed by `transaction`
+    """
+    if path is None:
+        path = DB_PATH
+    con = sq.connect(path, timeout=timeout, isolation_level=None)
+    con.execute('PRAGMA journal_mode=WAL')
+    return con
+
+
+@contextmanager
+def transaction(con, bulk=False):
+    """Runs the enclosed writes as one transaction.
+
+    Readers keep seeing the previous contents until it commits, so a rebuild
+    swaps every table in at once. Each commit bumps the database generation.
+    """
+    if bulk:
+        con.execute('PRAGMA synchronous=NORMAL')
+        con.execute('PRAGMA temp_store=MEMORY')
+        con.execute('PRAGMA cache_size=-65536')
+    con.execute('BEGIN IMMEDIATE')
+    try:
+        yield con
+    except BaseException:
+        con.execute('ROLLBACK')
+        raise
+    bump_generation(con)
+    con.execute('COMMIT')
+
+
+def get_generation(con):
+    return con.execute('PRAGMA user_version').fetchone()[0]
+
+
+def bump_generation(con):
+    # user_version lives in the database header, so the new generation
+    # becomes visible to readers in the same commit as the data.
+    con.execute(f'PRAGMA user_version = {get_generation(con) + 1}')
+
+
+def get_column_types(df):
+    column_types = {}
+    for name in df.columns:
+        if pd.api.types.is_bool_dtype(df[name]) or pd.api.types.is_integer_dtype(df[name]):
+            column_types[name] = 'INTEGER'
+        elif pd.api.types.is_float_dtype(df[name]):
+            column_types[name] = 'REAL'
+        else:
+            column_types[name] = 'TEXT'
+    return column_types
+
+
+def table_exists(con, name):
+    cur = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cur.fetchone() is not None
+
+
+def create_table(con, name, df, column_types=None):
+    schema = SCHEMA.get(name, {})
+    types = get_column_types(df)
+    types.update(schema.get('columns', {}))
+    if column_types is not None:
+        types.update(column_types)
+    columns = [f'"{column}" {types[column]}' for column in df.columns]
+    if 'primary_key' in schema:
+        key = ', '.join([f'"{column}"' for column in schema['primary_key']])
+        columns.append(f'PRIMARY KEY ({key})')
+    con.execute(f'CREATE TABLE "{name}" ({", ".join(columns)})')
+
+
+def create_indexes(con, name):
+    with qbstreamlit.instrument.timed('sql_index', table=name):
+        for index in SCHEMA.get(name, {}).get('indexes', []):
+            index_name = f'idx_{name}_' + '_'.join(index)
+            columns = ', '.join([f'"{column}"' for column in index])
+            con.execute(
+                f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{name}" ({columns})')
+
+
+def insert_rows(con, name, df, chunksize=10000):
+    if len(df.index) == 0:
+        return
+    columns = ', '.join([f'"{column}"' for column in df.columns])
+    placeholders = ', '.join(['?']*len(df.columns))
+    sql = f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders})'
+
+    with qbstreamlit.instrument.timed('sql_insert', table=name, rows=len(df.index)):
+        for start in range(0, len(df.index), chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            values = [
+                chunk[column].astype(object).where(chunk[column].notna(), None).tolist()
+                for column in chunk.columns
+            ]
+            con.executemany(sql, zip(*values))
+
+
+def replace_table(con, name, df, column_types=None):
+    con.execute(f'DROP TABLE IF EXISTS "{name}"')
+    create_table(con, name, df, column_types)
+    insert_rows(con, name, df)
+    # Building indexes after the bulk insert is faster than maintaining
+    # them row by row.
+    create_indexes(con, name)
+
+
+def get_table_columns(con, name):
+    return [row[1] for row in con.execute(f'PRAGMA table_info("{name}")')]
+
+
+def add_missing_columns(con, name, df, column_types=None):
+    existing = get_table_columns(con, name)
+    types = get_column_types(df)
+    types.update(SCHEMA.get(name, {}).get('columns', {}))
+    if column_types is not None:
+        types.update(column_types)
+    for column in df.columns:
+        if column not in existing:
+            con.execute(
+                f'ALTER TABLE "{name}" ADD COLUMN "{column}" {types[column]}')
+
+
+def append_table(con, name, df, column_types=None):
+    if not table_exists(con, name):
+        create_table(con, name, df, column_types)
+        create_indexes(con, name)
+    else:
+        add_missing_columns(con, name, df, column_types)
+    insert_rows(con, name, df)
+
+
+def find_orphans(con, tournament=None):
+    """Counts the rows that match no row of a table they reference (see
+    SCHEMA). Tables that are missing, or predate a referenced column, are
+    skipped.
+    Args:
+        con (sqlite3.Connection): Open connection to stats.db
+        tournament (str): Only check this tournament's rows; None checks all
+    Returns:
+        list: A dict of table, references, columns and orphaned rows for each
+            reference that does not hold
+    """
+    orphans = []
+    for name, spec in SCHEMA.items():
+        for parent, columns in spec.get('references', {}).items():
+            if not table_exists(con, name) or not table_exists(con, parent):
+                continue
+            if not set(columns) <= set(get_table_columns(con, name)) or \
+                    not set(columns) <= set(get_table_columns(con, parent)):
+                continue
+            match = ' AND '.join([f'p."{column}" = t."{column}"' for column in columns])
+            sql = (f'SELECT COUNT(*) FROM "{name}" t WHERE NOT EXISTS '
+                   f'(SELECT 1 FROM "{parent}" p WHERE {match})')
+            params = []
+            if tournament is not None:
+                sql += ' AND t.tournament = ?'
+                params.append(tournament)
+            rows = con.execute(sql, params).fetchone()[0]
+            if rows > 0:
+                orphans.append({'table': name, 'references': parent,
+                                'columns': columns, 'rows': rows})
+    return orphans
+
+
+def empty_frame(name):
+    """Returns an empty DataFrame with a table's declared columns, less
+    tournament, for writing an empty partition."""
+    return pd.DataFrame(columns=[
+        column for column in SCHEMA[name]['columns'] if column != 'tournament'])
+
+
+def with_tournament(df, tournament):
+    df = df.drop(columns='tournament', errors='ignore')
+    df.insert(0, 'tournament', tournament)
+    return df
+
+
+def touch_partition(con, tournament):
+    """Records that a tournament's rows change in the current transaction."""
+    if not table_exists(con, 'partitions'):
+        create_table(
+            con, 'partitions', pd.DataFrame(columns=['tournament', 'generation']))
+    con.execute(
+        'INSERT OR REPLACE INTO partitions (tournament, generation) VALUES (?, ?)',
+        (tournament, get_generation(con) + 1))
+
+
+def get_partition_generation(con, tournament):
+    if not table_exists(con, 'partitions'):
+        return None
+    row = con.execute(
+        'SELECT generation FROM partitions WHERE tournament = ?', (tournament,)).fetchone()
+    return None if row is None else row[0]
+
+
+def delete_partition_rows(con, name, tournament, column=None, values=None):
+    """Deletes a tournament's rows from a table, optionally only those whose
+    column is in values."""
+    if not table_exists(con, name):
+        return
+    sql = f'DELETE FROM "{name}" WHERE tournament = ?'
+    params = [tournament]
+    if column is not None:
+        values = list(values)
+        sql += f' AND "{column}" IN ({", ".join(["?"]*len(values))})'
+        params.extend(values)
+    with qbstreamlit.instrument.timed('sql_delete', table=name) as fields:
+        fields['deleted'] = con.execute(sql, params).rowcount
+
+
+def delete_scoresheets(con, tournament, game_ids=None, packets=None):
+    """Drops the stored scoresheets of games whose rows changed, or that
+    were played on a changed packet. Other games' specs stay current."""
+    if not table_exists(con, 'scoresheets'):
+        return
+    if game_ids is not None:
+        delete_partition_rows(con, 'scoresheets', tournament, 'game_id', game_ids)
+    if packets is not None and table_exists(con, 'team_stats'):
+        packets = list(packets)
+        game_ids = [row[0] for row in con.execute(
+            'SELECT DISTINCT game_id FROM team_stats WHERE tournament = ? '
+            f'AND packet IN ({", ".join(["?"]*len(packets))})', [tournament] + packets)]
+        delete_partition_rows(con, 'scoresheets', tournament, 'game_id', game_ids)
+
+
+def replace_partition(con, name, df, tournament, column_types=None):
+    """Replaces one tournament's rows in a table, leaving other tournaments'
+    rows in place.
+
+    Tables from before partitioning have no tournament column; they are
+    dropped and recreated.
+    """
+    df = with_tournament(df, tournament)
+    if table_exists(con, name) and 'tournament' not in get_table_columns(con, name):
+        con.execute(f'DROP TABLE "{name}"')
+    if not table_exists(con, name):
+        replace_table(con, name, df, column_types)
+        return
+    delete_partition_rows(con, name, tournament)
+    append_table(con, name, df, column_types)
+    create_indexes(con, name)
+
+
+def append_partition(con, name, df, tournament, column_types=None):
+    append_table(con, name, with_tournament(df, tournament), column_types)
+
+
+def write_tables(tables, path=None, tournament=None):
+    """Replaces several tables in a single bulk transaction.
+    Args:
+        tables (dict): Table name to DataFrame
+        path (str): Path to the database file; defaults to DB_PATH
+        tournament (str): Only replace this tournament's rows; None replaces
+            the whole tables
+    """
+    con = connect(path)
+    try:
+        with transaction(con, bulk=True):
+            for name, df in tables.items():
+                if tournament is None:
+                    replace_table(con, name, df)
+                else:
+                    replace_partition(con, name, df, tournament)
+            if tournament is not None:
+                touch_partition(con, tournament)
+    finally:
+        con.close()
+
+
+def get_partitioned_tables(con, schema):
+    """Returns (name, sql) for the tables of an attached database that have
+    a tournament column."""
+    tables = con.execute(
+        f"SELECT name, sql FROM {schema}.sqlite_master "
+        "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+    return [
+        (name, sql) for name, sql in tables
+        if 'tournament' in [row[1] for row in con.execute(f'PRAGMA {schema}.table_info("{name}")')]
+    ]
+
+
+def copy_partition(source_path, dest_path, tournament):
+    """Copies one tournament's partition of every table, with the tables'
+    indexes, into an empty database. Other tournaments' rows are not read.
+    Args:
+        source_path (str): Database to copy from, e.g. stats.db
+        dest_path (str): New database to copy into
+        tournament (str): Tournament whose rows are copied
+    Returns:
+        int: The source's generation for the tournament (see partitions)
+            when it was copied, for swap_partition; None if it has none
+    """
+    con = connect(dest_path)
+    try:
+        con.execute('ATTACH DATABASE ? AS source', (source_path,))
+        try:
+            with transaction(con, bulk=True):
+                # Scoresheets built in the copy are tagged with generations
+                # that follow the source's.
+                con.execute(f'PRAGMA user_version = {get_generation_of(con, "source")}')
+                tables = get_partitioned_tables(con, 'source')
+                for name, sql in tables:
+                    con.execute(sql)
+                    with qbstreamlit.instrument.timed('sql_insert', table=name) as fields:
+                        fields['rows'] = con.execute(
+                            f'INSERT INTO main."{name}" SELECT * FROM source."{name}" '
+                            'WHERE tournament = ?', (tournament,)).rowcount
+                copy_indexes(con, 'source', [name for name, sql in tables])
+                generation = get_partition_generation(con, tournament)
+        finally:
+            con.execute('DETACH DATABASE source')
+        return generation
+    finally:
+        con.close()
+
+
+def copy_indexes(con, schema, names):
+    """Creates an attached database's indexes on the named tables in main,
+    skipping those main already has. Primary key indexes have no SQL and
+    come with their tables."""
+    existing = {row[0] for row in con.execute(
+        "SELECT name FROM main.sqlite_master WHERE type = 'index'")}
+    placeholders = ', '.join(['?']*len(names))
+    for name, sql in con.execute(
+            f"SELECT name, sql FROM {schema}.sqlite_master WHERE type = 'index' "
+            f"AND sql IS NOT NULL AND tbl_name IN ({placeholders})", names).fetchall():
+        if name not in existing:
+            con.execute(sql)
+
+
+def get_generation_of(con, schema):
+    return con.execute(f'PRAGMA {schema}.user_version').fetchone()[0]
+
+
+class StaleSnapshotError(Exception):
+    """Raised inside swap_partition's transaction when the destination's
+    partition has been written since the copy a build started from."""
+
+
+def swap_partition(source_path, dest_path, tournament, generation, carry_over=None):
+    """Replaces one tournament's partition of the destination with the
+    source's in a single write transaction, unless an ingest has written
+    that partition since it was at generation. Other tournaments' rows are
+    neither read nor rewritten. Readers keep their snapshot until it
+    commits.
+    Args:
+        source_path (str): Database to copy from, e.g. a staging build
+        dest_path (str): Database whose partition is replaced
+        tournament (str): Tournament to replace
+        generation (int): Partition generation returned by copy_partition
+        carry_over (callable): Called with the connection, inside the
+            transaction and with the source attached as staged, before the
+            partition is replaced. It may return a callable, run once the
+            partition has been replaced, to restore rows written since the
+            copy (see qbstreamlit.live.carry_over_live_games).
+    Returns:
+        bool: Whether the swap happened
+    """
+    con = connect(dest_path)
+    try:
+        con.execute('ATTACH DATABASE ? AS staged', (source_path,))
+        try:
+            with transaction(con):
+                if get_partition_generation(con, tournament) != generation:
+                    raise StaleSnapshotError(dest_path)
+                restore = None if carry_over is None else carry_over(con)
+                tables = get_partitioned_tables(con, 'staged')
+                for name, sql in tables:
+                    replace_partition_from(con, 'staged', name, sql, tournament)
+                copy_indexes(con, 'staged', [name for name, sql in tables])
+                if restore is not None:
+                    restore()
+                touch_partition(con, tournament)
+        except StaleSnapshotError:
+            return False
+        finally:
+            con.execute('DETACH DATABASE staged')
+        return True
+    finally:
+        con.close()
+
+
+def replace_partition_from(con, schema, name, sql, tournament):
+    """Replaces a tournament's rows in a main table with those of the same
+    table in an attached database, creating the table or adding columns
+    the attached one has gained."""
+    if table_exists(con, name) and 'tournament' not in get_table_columns(con, name):
+        con.execute(f'DROP TABLE main."{name}"')
+    if not table_exists(con, name):
+        con.execute(sql)
+    columns = {row[1]: row[2] for row in con.execute(f'PRAGMA {schema}.table_info("{name}")')}
+    existing = get_table_columns(con, name)
+    for column, sql_type in columns.items():
+        if column not in existing:
+            con.execute(f'ALTER TABLE main."{name}" ADD COLUMN "{column}" {sql_type}')
+    delete_partition_rows(con, name, tournament)
+    column_list = ', '.join([f'"{column}"' for column in columns])
+    with qbstreamlit.instrument.timed('sql_insert', table=name) as fields:
+        fields['rows'] = con.execute(
+            f'INSERT INTO main."{name}" ({column_list}) SELECT {column_list} '
+            f'FROM {schema}."{name}" WHERE tournament = ?', (tournament,)).rowcount
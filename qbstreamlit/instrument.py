@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+import qbstreamlit.cache
+from qbstreamlit.recoding import CACHE_DIR
+
+# resource is POSIX-only; peak RSS is reported as None elsewhere.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('qbstreamlit')
+
+PROFILE_PATH = os.path.join(CACHE_DIR, 'last-profile.json')
+
+_hooks = []
+
+
+def add_hook(hook):
+    """Registers a callable that receives (event, fields) for every
+    instrumentation event, e.g. 'parse_file', 'sql_insert' or 'stage'."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def emit(event, **fields):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s %s', event, fields)
+    for hook in list(_hooks):
+        hook(event, fields)
+
+
+@contextmanager
+def timed(event, **fields):
+    """Emits an event with the seconds the enclosed block took. Fields set
+    on the yielded dict are included."""
+    start = time.perf_counter()
+    yield fields
+    emit(event, seconds=time.perf_counter() - start, **fields)
+
+
+def get_peak_rss():
+    """Returns this process's peak resident set size in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+    return peak if sys.platform == 'darwin' else peak*1024
+
+
+class Profile:
+    """Hook that collects the events of one rebuild and summarizes them."""
+
+    def __init__(self):
+        self.events = []
+        self.started = time.time()
+        self.cache_start = (
+            qbstreamlit.cache.frame_cache.hits, qbstreamlit.cache.frame_cache.misses)
+
+    def __call__(self, event, fields):
+        self.events.append(dict(fields, event=event))
+
+    def summary(self):
+        tables = {}
+        reads = {}
+        files = []
+        stages = []
+        errors = []
+        orphans = []
+        peaks = [get_peak_rss()]
+        for event in self.events:
+            peaks.append(event.get('peak_rss'))
+            kind = event['event']
+            if kind in ['sql_insert', 'sql_index', 'sql_delete']:
+                table = tables.setdefault(
+                    event['table'], {'rows': 0, 'insert_seconds': 0.0,
+                                     'index_seconds': 0.0, 'delete_seconds': 0.0})
+                table[kind[4:] + '_seconds'] += event['seconds']
+                table['rows'] += event.get('rows', 0)
+            elif kind == 'sql_read':
+                read = reads.setdefault(
+                    event['table'], {'calls': 0, 'rows': 0, 'seconds': 0.0})
+                read['calls'] += 1
+                read['rows'] += event['rows']
+                read['seconds'] += event['seconds']
+            elif kind == 'parse_file':
+                files.append({key: value for key, value in event.items() if key != 'event'})
+            elif kind == 'stage':
+                stages.append({key: value for key, value in event.items() if key != 'event'})
+            elif kind == 'scoresheet_error':
+                errors.append({key: value for key, value in event.items() if key != 'event'})
+            elif kind == 'orphan_rows':
+                orphans.append({key: value for key, value in event.items() if key != 'event'})
+
+        hits = qbstreamlit.cache.frame_cache.hits - self.cache_start[0]
+        misses = qbstreamlit.cache.frame_cache.misses - self.cache_start[1]
+        peaks = [peak for peak in peaks if peak is not None]
+        return {
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'peak_rss': max(peaks) if len(peaks) > 0 else None,
+            'stages': stages,
+            'files': sorted(files, key=lambda file: file['seconds'], reverse=True),
+            'tables': tables,
+            'reads': reads,
+            'scoresheet_errors': errors,
+            'orphan_rows': orphans,
+            'cache': {
+                'hits': hits, 'misses': misses,
+                'hit_rate': hits/(hits + misses) if hits + misses > 0 else None
+            },
+        }
+
+
+@contextmanager
+def record_profile(path=PROFILE_PATH):
+    """Collects instrumentation events for the enclosed block and writes
+    their summary to path, where show_ingest_profile reads it. The summary
+    is written even if the block fails.
+    Args:
+        path (str): JSON file for the summary; None keeps it in memory only
+    """
+    profile = Profile()
+    add_hook(profile)
+    try:
+        yield profile
+    finally:
+        remove_hook(profile)
+        if path is not None:
+            save_profile(profile.summary(), path)
+
+
+def save_profile(summary, path=PROFILE_PATH):
+    directory = os.path.dirname(path)
+    if directory != '':
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+def load_profile(path=PROFILE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
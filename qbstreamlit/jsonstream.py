@@ -0,0 +1,52 @@
+import json
+
+# Both backends are optional. orjson speeds up whole-document loads and
+# ijson lets large arrays be read one item at a time.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def load_json(path):
+    """Loads a whole JSON file, using orjson when it is installed."""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def iter_json_items(path, key):
+    """Yields the items of a top-level array one at a time.
+
+    With ijson installed only the current item is held in memory; otherwise
+    the file is loaded whole and its array iterated.
+    Args:
+        path (str): Path to the JSON file
+        key (str): Top-level key of the array, e.g. 'match_questions' or 'tossups'
+    """
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, f'{key}.item', use_float=True)
+    else:
+        yield from load_json(path)[key]
+
+
+def load_qbj(path):
+    """Returns a QBJ game whose match_questions are read lazily.
+
+    match_teams is small and is loaded up front. match_questions is a
+    one-shot iterator, which is enough for parse_stats' single pass.
+    """
+    if ijson is None:
+        return load_json(path)
+    return {
+        'match_teams': list(iter_json_items(path, 'match_teams')),
+        'match_questions': iter_json_items(path, 'match_questions')
+    }
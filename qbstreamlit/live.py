@@ -0,0 +1,520 @@
+import json
+import time
+import pandas as pd
+import qbstreamlit.db
+import qbstreamlit.instrument
+import qbstreamlit.parser
+from qbstreamlit.recoding import RecodingIndex, UnknownNameError
+
+EVENT_TYPES = ['start', 'buzz', 'bonus', 'end']
+TOSSUP_VALUES = {15: '15', 10: '10', -5: '-5'}
+# Tossups heard per game, as in parser.calculate_bpas.
+GAME_TUH = 20
+# Tables holding a live game's own rows, keyed by game_id.
+GAME_TABLES = ['buzzes', 'bonuses', 'player_stats', 'team_stats', 'scoresheets', 'live_games']
+
+
+class LiveEventError(ValueError):
+    """Raised when a live event cannot be applied. Nothing from the event
+    is written to stats.db."""
+
+
+def get_live_path(tournament, game):
+    return f'qbjs/{tournament}/{game}'
+
+
+class LiveScorer:
+    """Applies match events for games in progress straight to a tournament's
+    partition of stats.db, so its stats and scoresheets follow a round as it
+    is played.
+
+    Events are dicts with an 'event' type and a 'game', the name of the QBJ
+    file the game will be saved as (e.g. 'Round_3_1.qbj'):
+        start: teams, a list of {'name', 'players'}, and optionally the
+            packet, which otherwise comes from the file name as for QBJs
+        buzz: tossup, team, player, buzz_position and value
+        bonus: tossup, bonus, team, part (1-3) and value; a part sent again
+            replaces its earlier value
+        end: marks the game finished
+
+    Each event runs in its own transaction and only touches the rows it
+    changes: the game's buzz, bonus and stat rows, the BPA rows of the
+    player and team involved and one buzz_histogram bin. Its cost does not
+    grow with the tournament. The commit bumps the database generation,
+    which invalidates the cached loaders.
+
+    When the game's QBJ file is ingested incrementally it takes over the
+    game_id and replaces the live rows; a full rebuild drops live games.
+    Events that arrive while the ingest worker builds the tournament are
+    carried over into its swap (see carry_over_live_games).
+    """
+
+    def __init__(self, tournament, recoding=None, path=None):
+        self.tournament = tournament
+        if recoding is None:
+            recoding = RecodingIndex.from_csvs()
+        self.recoding = recoding
+        self.con = qbstreamlit.db.connect(path)
+
+    def close(self):
+        self.con.close()
+
+    def apply(self, event, seq=None):
+        """Applies one event.
+        Args:
+            event (dict): Live event
+            seq (int): Position of the event among its game's events in a
+                feed. Events at or before the last one applied are skipped,
+                so a feed can be replayed from the start.
+        Returns:
+            bool: Whether the event was applied
+        Raises:
+            LiveEventError: If the event is malformed or does not fit the game
+        """
+        if not isinstance(event, dict) or event.get('event') not in EVENT_TYPES:
+            raise LiveEventError(f'Not a live event: {event!r}')
+        if 'game' not in event:
+            raise LiveEventError(f"{event['event']} event has no game")
+        kind = event['event']
+        path = get_live_path(self.tournament, event['game'])
+
+        game = self.get_game(path)
+        if seq is not None and game is not None and seq <= game['events']:
+            return False
+
+        with qbstreamlit.instrument.timed('live_event', kind=kind, game=event['game']):
+            try:
+                with qbstreamlit.db.transaction(self.con):
+                    if kind == 'start':
+                        game = self.start(path, game, event)
+                    elif game is None:
+                        raise LiveEventError(f"{event['game']} has not started")
+                    elif kind == 'buzz':
+                        self.buzz(game, event)
+                    elif kind == 'bonus':
+                        self.bonus(game, event)
+                    else:
+                        self.con.execute(
+                            'UPDATE live_games SET finished = 1 WHERE tournament = ? AND path = ?',
+                            (self.tournament, path))
+
+                    # The stored scoresheet for this game is out of date; others stay current.
+                    qbstreamlit.db.delete_partition_rows(
+                        self.con, 'scoresheets', self.tournament, 'game_id', [game['game_id']])
+                    self.con.execute(
+                        'UPDATE live_games SET events = ? WHERE tournament = ? AND path = ?',
+                        (game['events'] + 1 if seq is None else seq, self.tournament, path))
+            except LiveEventError:
+                raise
+            except UnknownNameError as e:
+                raise LiveEventError(str(e)) from None
+            except KeyError as e:
+                raise LiveEventError(f'{kind} event has no {e}') from None
+            except (TypeError, ValueError) as e:
+                raise LiveEventError(f'{kind} event: {e}') from None
+        return True
+
+    def get_game(self, path):
+        if not qbstreamlit.db.table_exists(self.con, 'live_games'):
+            return None
+        row = self.con.execute(
+            'SELECT game_id, packet, events FROM live_games WHERE tournament = ? AND path = ?',
+            (self.tournament, path)).fetchone()
+        if row is None:
+            return None
+        return {'path': path, 'game_id': row[0], 'packet': row[1], 'events': row[2]}
+
+    def get_max(self, table, column):
+        if not qbstreamlit.db.table_exists(self.con, table):
+            return None
+        return self.con.execute(
+            f'SELECT MAX("{column}") FROM "{table}" WHERE tournament = ?',
+            (self.tournament,)).fetchone()[0]
+
+    def start(self, path, game, event):
+        if game is not None:
+            raise LiveEventError(f"{event['game']} has already started")
+        if qbstreamlit.db.table_exists(self.con, 'qbj_manifest') and self.con.execute(
+                'SELECT 1 FROM qbj_manifest WHERE tournament = ? AND path = ?',
+                (self.tournament, path)).fetchone() is not None:
+            raise LiveEventError(f'{path} has already been ingested')
+
+        if 'packet' in event:
+            packet = int(event['packet'])
+        else:
+            try:
+                packet = int(qbstreamlit.parser.get_qbj_packet(path, self.tournament))
+            except (AttributeError, KeyError):
+                raise LiveEventError(
+                    f"No packet for {event['game']}; give one in the start event") from None
+
+        game_ids = [self.get_max(table, 'game_id')
+                    for table in ['team_stats', 'qbj_manifest', 'live_games']]
+        game_id = max([-1] + [game_id for game_id in game_ids if game_id is not None]) + 1
+        game = {'path': path, 'game_id': game_id, 'packet': packet, 'events': 0}
+        qbstreamlit.db.append_partition(self.con, 'live_games', pd.DataFrame([{
+            'path': path, 'game_id': game_id, 'packet': packet, 'events': 0, 'finished': 0
+        }]), self.tournament)
+
+        for team in event['teams']:
+            self.add_team(game, self.recoding.team(team['name']))
+        for player, team in self.recoding.lineup(
+                [(team['name'], team['players']) for team in event['teams']]):
+            self.add_player(game, player, team)
+        return game
+
+    def buzz(self, game, event):
+        value = int(event['value'])
+        if value not in [15, 10, -5, 0]:
+            raise LiveEventError(f'Buzz value {value} is not 15, 10, -5 or 0')
+        tossup = int(event['tossup'])
+        position = int(event['buzz_position'])
+        team = self.recoding.team(event['team'])
+        player = self.recoding.player(event['player'], team)
+
+        self.add_team(game, team)
+        self.add_player(game, player, team)
+        if value in TOSSUP_VALUES:
+            self.update_player_stats(game, player, team, value)
+            self.update_team_stats(game, team, tossup_value=value)
+
+        category, length = self.get_tossup(game['packet'], tossup)
+        if value in [15, 10] and category is not None and length is not None:
+            celerity = 1 - position/length
+            player_keys = {'player': player, 'team': team}
+            player_games = self.count_games(player_keys)
+            team_games = self.count_games({'team': team})
+            self.update_bpas('player_bpa', 'player_cat_bpa', player_keys,
+                             player_games, player_games, celerity, category)
+            self.update_bpas('team_bpa', 'team_cat_bpa', {'team': team},
+                             team_games, team_games, celerity, category)
+        if category is not None:
+            self.add_to_histogram(team, player, category, value, position)
+
+        qbstreamlit.db.append_partition(self.con, 'buzzes', pd.DataFrame([{
+            'tossup': tossup, 'player': player, 'team': team, 'buzz_position': position,
+            'value': value, 'packet': game['packet'], 'game_id': game['game_id']
+        }]), self.tournament)
+
+    def bonus(self, game, event):
+        part = int(event['part'])
+        if part not in [1, 2, 3]:
+            raise LiveEventError(f'Bonus part {part} is not 1, 2 or 3')
+        value = int(event['value'])
+        tossup = int(event['tossup'])
+        team = self.recoding.team(event['team'])
+        self.add_team(game, team)
+
+        row = None
+        if qbstreamlit.db.table_exists(self.con, 'bonuses'):
+            row = self.con.execute(
+                'SELECT part1_value, part2_value, part3_value FROM bonuses '
+                'WHERE tournament = ? AND game_id = ? AND tossup = ? AND team = ?',
+                (self.tournament, game['game_id'], tossup, team)).fetchone()
+        if row is None:
+            parts = [0, 0, 0]
+            parts[part - 1] = value
+            qbstreamlit.db.append_partition(self.con, 'bonuses', pd.DataFrame([{
+                'tossup': tossup, 'bonus': int(event['bonus']), 'part1_value': parts[0],
+                'part2_value': parts[1], 'part3_value': parts[2], 'team': team,
+                'packet': game['packet'], 'game_id': game['game_id']
+            }]), self.tournament)
+            previous = 0
+        else:
+            previous = row[part - 1]
+            self.con.execute(
+                f'UPDATE bonuses SET part{part}_value = ? '
+                'WHERE tournament = ? AND game_id = ? AND tossup = ? AND team = ?',
+                (value, self.tournament, game['game_id'], tossup, team))
+        self.update_team_stats(game, team, bonus_points=value - previous)
+
+    def add_team(self, game, team):
+        if qbstreamlit.db.table_exists(self.con, 'team_stats') and self.con.execute(
+                'SELECT 1 FROM team_stats WHERE tournament = ? AND game_id = ? AND team = ?',
+                (self.tournament, game['game_id'], team)).fetchone() is not None:
+            return
+        qbstreamlit.db.append_partition(self.con, 'team_stats', pd.DataFrame([{
+            'team': team, '15': 0, '10': 0, '-5': 0, 'TUPts': 0, 'BHrd': 0, 'BPts': 0,
+            'PPB': 0.0, 'Pts': 0, 'packet': game['packet'], 'game_id': game['game_id']
+        }]), self.tournament)
+
+    def add_player(self, game, player, team):
+        """Adds a zero stat row for a player's first appearance in the game,
+        which counts as a game played toward the player's and team's BPA."""
+        team_played = False
+        if qbstreamlit.db.table_exists(self.con, 'player_stats'):
+            if self.con.execute(
+                    'SELECT 1 FROM player_stats '
+                    'WHERE tournament = ? AND game_id = ? AND player = ? AND team = ?',
+                    (self.tournament, game['game_id'], player, team)).fetchone() is not None:
+                return
+            team_played = self.con.execute(
+                'SELECT 1 FROM player_stats WHERE tournament = ? AND game_id = ? AND team = ?',
+                (self.tournament, game['game_id'], team)).fetchone() is not None
+
+        player_keys = {'player': player, 'team': team}
+        player_games = self.count_games(player_keys)
+        team_games = self.count_games({'team': team})
+        qbstreamlit.db.append_partition(self.con, 'player_stats', pd.DataFrame([{
+            'player': player, 'team': team, '15': 0, '10': 0, '-5': 0, 'Pts': 0,
+            'packet': game['packet'], 'game_id': game['game_id']
+        }]), self.tournament)
+
+        self.update_bpas('player_bpa', 'player_cat_bpa', player_keys,
+                         player_games, player_games + 1)
+        if not team_played:
+            self.update_bpas('team_bpa', 'team_cat_bpa', {'team': team},
+                             team_games, team_games + 1)
+
+    def count_games(self, keys):
+        if not qbstreamlit.db.table_exists(self.con, 'player_stats'):
+            return 0
+        where = ''.join([f' AND "{key}" = ?' for key in keys])
+        return self.con.execute(
+            f'SELECT COUNT(DISTINCT game_id) FROM player_stats WHERE tournament = ?{where}',
+            [self.tournament] + list(keys.values())).fetchone()[0]
+
+    def update_player_stats(self, game, player, team, value):
+        where = 'WHERE tournament = ? AND game_id = ? AND player = ? AND team = ?'
+        params = (self.tournament, game['game_id'], player, team)
+        counts = dict(zip(['15', '10', '-5'], self.con.execute(
+            f'SELECT "15", "10", "-5" FROM player_stats {where}', params).fetchone()))
+        counts[TOSSUP_VALUES[value]] += 1
+        points = 15*counts['15'] + 10*counts['10'] - 5*counts['-5']
+        self.con.execute(
+            f'UPDATE player_stats SET "15" = ?, "10" = ?, "-5" = ?, Pts = ? {where}',
+            (counts['15'], counts['10'], counts['-5'], points) + params)
+
+    def update_team_stats(self, game, team, tossup_value=None, bonus_points=0):
+        where = 'WHERE tournament = ? AND game_id = ? AND team = ?'
+        params = (self.tournament, game['game_id'], team)
+        row = self.con.execute(
+            f'SELECT "15", "10", "-5", TUPts, BPts FROM team_stats {where}', params).fetchone()
+        counts = dict(zip(['15', '10', '-5'], row[:3]))
+        tossup_points, bonus_total = row[3], row[4] + bonus_points
+        if tossup_value is not None:
+            counts[TOSSUP_VALUES[tossup_value]] += 1
+            tossup_points += tossup_value
+        # As in parse_stats, bonuses heard is the number of tens.
+        heard = counts['10']
+        ppb = round(bonus_total/heard, 2) if heard > 0 else 0.0
+        self.con.execute(
+            'UPDATE team_stats SET "15" = ?, "10" = ?, "-5" = ?, TUPts = ?, BHrd = ?, '
+            f'BPts = ?, PPB = ?, Pts = ? {where}',
+            (counts['15'], counts['10'], counts['-5'], tossup_points, heard, bonus_total,
+             ppb, tossup_points + bonus_total) + params)
+
+    def get_tossup(self, packet, tossup):
+        """Returns a tossup's category and length in words. Either is None
+        if its packet has not been ingested."""
+        found = []
+        for table, column in [('tossup_meta', 'category'), ('packet_meta', 'tossup_length')]:
+            row = None
+            if qbstreamlit.db.table_exists(self.con, table):
+                row = self.con.execute(
+                    f'SELECT "{column}" FROM "{table}" '
+                    'WHERE tournament = ? AND packet = ? AND tossup = ?',
+                    (self.tournament, packet, tossup)).fetchone()
+            found.append(None if row is None else row[0])
+        return found[0], found[1]
+
+    def update_bpas(self, table, cat_table, keys, games, new_games, celerity=None,
+                    category=None):
+        """Folds a game played, or a correct buzz in category, into an
+        entity's overall and per-category BPA rows."""
+        self.update_bpa(table, keys, GAME_TUH, games, new_games, celerity)
+        for cat, cat_tuh in qbstreamlit.parser.packet_tuhs.items():
+            if celerity is None or cat == category:
+                self.update_bpa(
+                    cat_table, dict(keys, category=cat), cat_tuh, games, new_games,
+                    celerity)
+
+    def update_bpa(self, table, keys, tuh, games, new_games, celerity=None):
+        # BPA = 100*sum(celerity)/TUH and ACC = sum(celerity)/correct buzzes,
+        # so both sums are recovered from the stored row.
+        where = ''.join([f' AND "{key}" = ?' for key in keys])
+        params = [self.tournament] + list(keys.values())
+        row = None
+        if qbstreamlit.db.table_exists(self.con, table):
+            row = self.con.execute(
+                f'SELECT BPA, ACC FROM "{table}" WHERE tournament = ?{where}', params).fetchone()
+
+        total = 0.0
+        correct = 0
+        if row is not None and games > 0:
+            total = (row[0] or 0)*games*tuh/100
+            if row[1] is not None and row[1] > 0:
+                correct = round(total/row[1])
+            elif row[1] is not None:
+                correct = self.count_correct(keys)
+        if celerity is not None:
+            total += celerity
+            correct += 1
+
+        bpa = 100*total/(new_games*tuh)
+        acc = total/correct if correct > 0 else None
+        if row is None:
+            qbstreamlit.db.append_partition(
+                self.con, table, pd.DataFrame([dict(keys, BPA=bpa, ACC=acc)]), self.tournament)
+        else:
+            self.con.execute(
+                f'UPDATE "{table}" SET BPA = ?, ACC = ? WHERE tournament = ?{where}',
+                [bpa, acc] + params)
+
+    def count_correct(self, keys):
+        # Only needed when every correct buzz so far came on the last word,
+        # leaving ACC at 0.
+        where = ''.join([
+            f' AND {"t" if key == "category" else "b"}."{key}" = ?' for key in keys])
+        return self.con.execute(
+            'SELECT COUNT(*) FROM buzzes b '
+            'JOIN tossup_meta t ON t.tournament = b.tournament AND t.packet = b.packet '
+            'AND t.tossup = b.tossup '
+            'JOIN packet_meta m ON m.tournament = b.tournament AND m.packet = b.packet '
+            'AND m.tossup = b.tossup '
+            f'WHERE b.tournament = ? AND b.value IN (15, 10){where}',
+            [self.tournament] + list(keys.values())).fetchone()[0]
+
+    def add_to_histogram(self, team, player, category, value, position):
+        category = qbstreamlit.parser.CATEGORY_RECODING.get(category, category)
+        step = qbstreamlit.parser.BUZZ_BIN_STEP
+        bin_start = position // step * step
+        if qbstreamlit.db.table_exists(self.con, 'buzz_histogram') and self.con.execute(
+                'UPDATE buzz_histogram SET count = count + 1 WHERE tournament = ? AND team = ? '
+                'AND player = ? AND category = ? AND value = ? AND bin_start = ?',
+                (self.tournament, team, player, category, value, bin_start)).rowcount > 0:
+            return
+        qbstreamlit.db.append_partition(self.con, 'buzz_histogram', pd.DataFrame([{
+            'team': team, 'player': player, 'category': category, 'value': value,
+            'bin_start': bin_start, 'count': 1, 'bin_end': bin_start + step
+        }]), self.tournament)
+
+
+def carry_over_live_games(con, tournament):
+    """Keeps the live games scored while an ingest worker build ran. Passed
+    to db.swap_partition, which calls it inside the swap transaction, with
+    the build attached as staged, before the tournament's partition is
+    replaced.
+
+    Games whose QBJ file the build ingested are left to it. For the others
+    that have had events since the build copied stats.db, the live rows
+    are saved and written back over the build's, and their teams' BPA and
+    buzz histogram rows are recomputed.
+    Args:
+        con (sqlite3.Connection): stats.db, in the swap transaction
+        tournament (str): Tournament being swapped
+    Returns:
+        callable: Restores the saved rows; None if no live game changed
+    Raises:
+        db.StaleSnapshotError: If a game started during the build has the
+            game_id the build gave a new QBJ file
+    """
+    def read(schema, columns, table, game_ids=None):
+        if con.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                       (table,)).fetchone() is None:
+            return []
+        sql = f'SELECT {columns} FROM {schema}."{table}" WHERE tournament = ?'
+        if game_ids is not None:
+            sql += f' AND game_id IN ({", ".join(["?"]*len(game_ids))})'
+        return con.execute(sql, [tournament] + (game_ids or [])).fetchall()
+
+    copied = {path: (game_id, events)
+              for path, game_id, events in read('staged', 'path, game_id, events', 'live_games')}
+    ingested = dict(read('staged', 'path, game_id', 'qbj_manifest'))
+    game_ids = [game_id for path, game_id, events in read('main', 'path, game_id, events', 'live_games')
+                if path not in ingested and copied.get(path) != (game_id, events)]
+    if len(game_ids) == 0:
+        return None
+    if len(set(game_ids) & set(ingested.values())) > 0:
+        raise qbstreamlit.db.StaleSnapshotError(
+            'A live game took the game_id the build gave a new QBJ file')
+
+    placeholders = ', '.join(['?']*len(game_ids))
+    teams = {row[0] for schema in ['main', 'staged']
+             for row in read(schema, 'DISTINCT team', 'team_stats', game_ids)}
+    saved = [name for name in GAME_TABLES if qbstreamlit.db.table_exists(con, name)]
+    for name in saved:
+        con.execute(
+            f'CREATE TEMP TABLE "carried_{name}" AS SELECT * FROM main."{name}" '
+            f'WHERE tournament = ? AND game_id IN ({placeholders})', [tournament] + game_ids)
+
+    def restore():
+        for name in saved:
+            columns = ', '.join([
+                f'"{row[1]}"' for row in con.execute(f'PRAGMA temp.table_info("carried_{name}")')])
+            qbstreamlit.db.delete_partition_rows(con, name, tournament, 'game_id', game_ids)
+            con.execute(
+                f'INSERT INTO main."{name}" ({columns}) SELECT {columns} FROM temp."carried_{name}"')
+            con.execute(f'DROP TABLE temp."carried_{name}"')
+        qbstreamlit.parser.recalculate_team_tables(con, tournament, sorted(teams))
+    return restore
+
+
+def read_feed(path, follow=False, interval=0.5, stopped=None):
+    """Yields the lines of a JSON-lines event feed. With follow, keeps
+    waiting for lines appended to the file, like tail -f, until stopped is
+    set; a line is only yielded once its newline has been written.
+    """
+    with open(path, 'r') as f:
+        partial = ''
+        while True:
+            line = f.readline()
+            if line.endswith('\n'):
+                yield partial + line
+                partial = ''
+                continue
+            partial += line
+            if not follow:
+                break
+            if stopped is not None:
+                if stopped.wait(interval):
+                    return
+            else:
+                time.sleep(interval)
+        if partial.strip() != '':
+            yield partial
+
+
+def run_feed(tournament, path, follow=False, interval=0.5, stopped=None, on_error=None,
+             recoding=None):
+    """Applies a JSON-lines feed of live events to stats.db.
+
+    Events are numbered per game in feed order, so running a feed again
+    after a restart skips the events already applied.
+    Args:
+        tournament (str): Tournament the games belong to
+        path (str): Feed file, one event per line
+        follow (bool): Keep applying lines appended to the file
+        interval (float): Seconds between checks for new lines
+        stopped (threading.Event): Stops following once set
+        on_error (callable): Called with a LiveEventError for each bad line;
+            None raises it
+        recoding (RecodingIndex): Team and player name recoding
+    Returns:
+        int: Number of events applied
+    """
+    scorer = LiveScorer(tournament, recoding=recoding)
+    seqs = {}
+    applied = 0
+    try:
+        for number, line in enumerate(read_feed(path, follow, interval, stopped), start=1):
+            if line.strip() == '':
+                continue
+            try:
+                try:
+                    event = json.loads(line)
+                except ValueError as e:
+                    raise LiveEventError(f'Invalid JSON: {e}') from None
+                seq = None
+                if isinstance(event, dict) and 'game' in event:
+                    seqs[event['game']] = seqs.get(event['game'], 0) + 1
+                    seq = seqs[event['game']]
+                applied += scorer.apply(event, seq)
+            except LiveEventError as e:
+                error = LiveEventError(f'{path}:{number}: {e}')
+                if on_error is None:
+                    raise error from None
+                on_error(error)
+    finally:
+        scorer.close()
+    return applied
@@ -1,106 +1,128 @@
 import pandas as pd
-import numpy as np
-import sqlite3 as sq
 import json
 import re
 import glob
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import qbstreamlit.data
-import streamlit as st
+import qbstreamlit.db
+import qbstreamlit.instrument
+import qbstreamlit.jsonstream
+import qbstreamlit.answers
+from qbstreamlit.recoding import RecodingIndex
+
+def get_qbj_lineups(qbj):
+    """Returns a QBJ game's (team name, player names) pairs, as
+    RecodingIndex.lineup takes them."""
+    return [
+        (team['team']['name'],
+         [player['name'] for lineup in team['lineups'] for player in lineup['players']])
+        for team in qbj['match_teams']
+    ]
+
+
+def parse_stats(qbj, player_recoding=None, team_recoding=None, recoding=None):
+    """Parses one QBJ game in a single pass over its questions.
+    Args:
+        qbj (dict): Loaded QBJ file
+        player_recoding (pd.DataFrame): Player recoding table, if recoding is not given
+        team_recoding (pd.DataFrame): Team recoding table, if recoding is not given
+        recoding (RecodingIndex): Team and player name recoding
+    Returns:
+        tuple: buzzes, bonuses, player_stats and team_stats DataFrames
+    """
+    if recoding is None:
+        recoding = RecodingIndex.from_frames(player_recoding, team_recoding)
+
+    buzz_columns = {'tossup': [], 'player': [], 'team': [],
+                    'buzz_position': [], 'value': []}
+    bonus_columns = {'tossup': [], 'bonus': [], 'part1_value': [],
+                     'part2_value': [], 'part3_value': [], 'team': []}
+    player_counts = {}
+    team_bpts = {}
 
-def parse_stats(qbj, player_recoding, team_recoding):
-    team_dict = {}
-    for i, row in team_recoding.iterrows():
-        team_dict[row['team']] = row['team_clean']
-    player_dict = {}
-    for i, row in player_recoding.iterrows():
-        player_dict[f"{row['player']}-{row['team']}"] = row['player_clean']
-
-    match_players = []
-    for team in qbj['match_teams']:
-        for lineup in team['lineups']:
-            match_players.extend(
-                [{'name': player['name'], 'team': team['team']['name']} for player in lineup['players']])
-
-    buzzes = []
     for question in qbj['match_questions']:
+        correct_teams = []
         for buzz in question['buzzes']:
-            buzzes.append(
-                {
-                    'tossup': question['question_number'],
-                    'player': player_dict[f"{buzz['player']['name']}-{team_dict[buzz['team']['name']]}"],
-                    'team': team_dict[buzz['team']['name']],
-                    'buzz_position': buzz['buzz_position']['word_index'],
-                    'value': str(buzz['result']['value'])
-                }
-            )
-    player_stats = pd.DataFrame(buzzes).groupby(
-        ['player', 'team', 'value'], as_index=False
-    ).agg('size').pivot(
-        index=['player', 'team'], columns='value', values='size'
-    ).reset_index()
-
-    for x in ['15', '10', '-5']:
-        if x not in player_stats.columns:
-            player_stats[x] = 0
-
-    if '0' in player_stats.columns:
-        player_stats = player_stats.drop(columns=['0'])
-
-    for player in match_players:
-        if player_dict[f"{player['name']}-{team_dict[player['team']]}"] not in player_stats['player'].values:
-            player_stats.loc[len(player_stats.index)] = [
-                player['name'], player['team'], 0, 0, 0]
-
-    player_stats[['15', '10', '-5']
-                 ] = player_stats[['15', '10', '-5']].fillna(0).astype(int)
+            team = recoding.team(buzz['team']['name'])
+            player = recoding.player(buzz['player']['name'], team)
+            value = str(buzz['result']['value'])
+
+            buzz_columns['tossup'].append(question['question_number'])
+            buzz_columns['player'].append(player)
+            buzz_columns['team'].append(team)
+            buzz_columns['buzz_position'].append(
+                buzz['buzz_position']['word_index'])
+            buzz_columns['value'].append(value)
+
+            counts = player_counts.setdefault(
+                (player, team), {'15': 0, '10': 0, '-5': 0})
+            if value in counts:
+                counts[value] += 1
+            if value in ['15', '10']:
+                correct_teams.append(team)
+
+        if 'bonus' in question:
+            parts = [part['controlled_points']
+                     for part in question['bonus']['parts']]
+            # A bonus belongs to every team with a correct buzz on its tossup.
+            for team in correct_teams:
+                bonus_columns['tossup'].append(question['question_number'])
+                bonus_columns['bonus'].append(
+                    question['bonus']['question']['question_number'])
+                bonus_columns['part1_value'].append(parts[0])
+                bonus_columns['part2_value'].append(parts[1])
+                bonus_columns['part3_value'].append(parts[2])
+                bonus_columns['team'].append(team)
+                team_bpts[team] = team_bpts.get(team, 0) + sum(parts)
+
+    buzzes = pd.DataFrame(buzz_columns)
+    bonuses = pd.DataFrame(bonus_columns)
+
+    # Players with buzzes come first, sorted; lineup players without any
+    # buzzes follow with zero rows.
+    player_columns = {'player': [], 'team': [], '15': [], '10': [], '-5': []}
+    for (player, team), counts in sorted(player_counts.items()):
+        player_columns['player'].append(player)
+        player_columns['team'].append(team)
+        for value in ['15', '10', '-5']:
+            player_columns[value].append(counts[value])
+
+    for player, team in recoding.lineup(get_qbj_lineups(qbj)):
+        if (player, team) not in player_counts:
+            player_columns['player'].append(player)
+            player_columns['team'].append(team)
+            for value in ['15', '10', '-5']:
+                player_columns[value].append(0)
+
+    player_stats = pd.DataFrame(player_columns)
     player_stats['Pts'] = 15*player_stats['15'] + \
         10*player_stats['10'] - 5*player_stats['-5']
-    player_stats = player_stats[['player', 'team', '15', '10', '-5', 'Pts']]
-
-    buzzes = pd.DataFrame(buzzes)
-
-    all_bonuses = [{'bonus': question['bonus'], 'question_number': question['question_number']}
-                   for question in qbj['match_questions'] if 'bonus' in question]
-    bonus_df = []
-    bonuses = []
-    for bonus in all_bonuses:
-        bonus_df.append(
-            {
-                'tossup': bonus['question_number'],
-                'bonus': bonus['bonus']['question']['question_number'],
-                'value': sum([part['controlled_points'] for part in bonus['bonus']['parts']])
-            }
-        )
-
-        bonuses.append(
-            {
-                'tossup': bonus['question_number'],
-                'bonus': bonus['bonus']['question']['question_number'],
-                'part1_value': bonus['bonus']['parts'][0]['controlled_points'],
-                'part2_value': bonus['bonus']['parts'][1]['controlled_points'],
-                'part3_value': bonus['bonus']['parts'][2]['controlled_points']
-            }
-        )
-
-    team_bonuses = pd.DataFrame(bonus_df).merge(buzzes[buzzes['value'].isin(['15', '10'])][['tossup', 'team']], on='tossup').groupby(['team'], as_index=False).agg(
-        {'value': 'sum'}
-    ).rename(columns={'value': 'BPts'})
-
-    bonuses = pd.DataFrame(bonuses).merge(
-        buzzes[buzzes['value'].isin(['15', '10'])][['tossup', 'team']], on='tossup')
-
-    team_stats = player_stats.groupby('team', as_index=False).agg(
-        'sum').rename(columns={'Pts': 'TUPts'})
+
+    # Teams that heard a bonus get summed stats, sorted; every other team
+    # in the match gets a zero row.
+    team_stats = player_stats.groupby('team')[['15', '10', '-5', 'Pts']].sum().loc[
+        sorted(team_bpts)
+    ].reset_index().rename(columns={'Pts': 'TUPts'})
     team_stats['BHrd'] = team_stats['10']
-    team_stats = team_stats.merge(pd.DataFrame(team_bonuses))
+    team_stats['BPts'] = [team_bpts[team] for team in team_stats['team']]
     team_stats['PPB'] = team_stats['BPts']/team_stats['BHrd']
     team_stats['PPB'] = team_stats['PPB'].round(decimals=2)
     team_stats['Pts'] = team_stats['TUPts'] + team_stats['BPts']
 
+    zero_teams = []
     for team in qbj['match_teams']:
-        if team_dict[team['team']['name']] not in team_stats['team'].values:
-            team_stats.loc[len(team_stats.index)] = [
-                team_dict[team['team']['name']], 0, 0, 0, 0, 0, 0, 0.00, 0]
+        clean_team = recoding.team(team['team']['name'])
+        if clean_team not in team_bpts and clean_team not in zero_teams:
+            zero_teams.append(clean_team)
+    if len(zero_teams) > 0:
+        team_stats = pd.concat([team_stats, pd.DataFrame({
+            'team': zero_teams, '15': 0, '10': 0, '-5': 0, 'TUPts': 0,
+            'BHrd': 0, 'BPts': 0, 'PPB': 0.0, 'Pts': 0
+        })], ignore_index=True)
 
     return buzzes, bonuses, player_stats, team_stats
 
@@ -155,17 +177,25 @@ def parse_packet(packet):
     return tossup_meta, bonus_meta
 
 
-def populate_db_qbjs(qbjs):
+def populate_db_qbjs(qbjs, tournament):
+    """Parses uploaded QBJ files into a tournament's partition of stats.db,
+    replacing its games. Other tournaments' rows are left in place.
+    Args:
+        qbjs (list): Uploaded QBJ files, named like 'Round 3 ...'
+        tournament (str): Tournament the games belong to
+    """
     all_buzzes = []
     all_bonuses = []
     all_player_stats = []
     all_team_stats = []
 
+    recoding = RecodingIndex.from_csvs()
+
     for i, qbj_path in enumerate(qbjs):
         qbj = json.load(qbj_path)
 
-        packet = re.search(r'(?<=Round\s)\d+', qbj_path.name).group(0)
-        buzzes, bonuses, player_stats, team_stats = parse_stats(qbj)
+        packet = int(re.search(r'(?<=Round\s)\d+', qbj_path.name).group(0))
+        buzzes, bonuses, player_stats, team_stats = parse_stats(qbj, recoding=recoding)
 
         buzzes['packet'] = packet
         buzzes['game_id'] = i
@@ -182,99 +212,412 @@ def populate_db_qbjs(qbjs):
         all_team_stats.append(team_stats)
 
     player_bpas, player_cat_bpas = calculate_player_bpas(
-        pd.concat(all_buzzes), pd.concat(all_player_stats))
+        tournament, pd.concat(all_buzzes), pd.concat(all_player_stats))
     team_bpas, team_cat_bpas = calculate_team_bpas(
-        pd.concat(all_buzzes), pd.concat(all_player_stats))
+        tournament, pd.concat(all_buzzes), pd.concat(all_player_stats))
+    buzz_histogram = calculate_buzz_histogram(
+        tournament, pd.concat(all_buzzes))
+
+    qbstreamlit.db.write_tables({
+        'buzzes': pd.concat(all_buzzes),
+        'bonuses': pd.concat(all_bonuses),
+        'player_stats': pd.concat(all_player_stats),
+        'team_stats': pd.concat(all_team_stats),
+        'player_bpa': player_bpas,
+        'player_cat_bpa': player_cat_bpas,
+        'team_bpa': team_bpas,
+        'team_cat_bpa': team_cat_bpas,
+        'buzz_histogram': buzz_histogram,
+        # Game ids are reassigned, as in a full populate_db_qbjs_nasat.
+        'live_games': pd.DataFrame(columns=['path', 'game_id', 'packet', 'events', 'finished']),
+        'scoresheets': pd.DataFrame(columns=['game_id', 'has_bonuses', 'spec', 'generation']),
+    }, tournament=tournament)
+
+
+class IngestError(ValueError):
+    """Raised when tournament files cannot be parsed. Nothing from the
+    failed ingest is written to stats.db."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self):
+        return f'{len(self.errors)} file(s) could not be ingested:\n' + \
+            '\n'.join(self.errors)
+
+
+def describe_error(path, error):
+    return f'{path}: {type(error).__name__}: {error}'
+
+
+def concat_frames(frames, name):
+    """Concatenates per-file frames, or returns an empty frame with the
+    table's columns when there are none."""
+    if len(frames) == 0:
+        return qbstreamlit.db.empty_frame(name)
+    return pd.concat(frames)
+
+
+def get_file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
 
-    con = sq.connect('stats.db')
+def get_qbj_packet(qbj_path, tournament):
+    if 'round-recoding.json' in glob.glob('*'):
+        with open('round-recoding.json', 'r') as f:
+            round_recoding = json.load(f)
+        return round_recoding[tournament][qbj_path[5:]]
+    return re.search(r'(?<=Round_)\d+', qbj_path).group(0)
 
-    pd.concat(all_buzzes).to_sql(name='buzzes', con=con, if_exists='replace')
-    pd.concat(all_bonuses).to_sql(name='bonuses', con=con, if_exists='replace')
-    pd.concat(all_player_stats).to_sql(
-        name='player_stats', con=con, if_exists='replace')
-    pd.concat(all_team_stats).to_sql(
-        name='team_stats', con=con, if_exists='replace')
 
-    player_bpas.to_sql(name='player_bpa', con=con, if_exists='replace')
-    player_cat_bpas.to_sql(name='player_cat_bpa', con=con, if_exists='replace')
-    team_bpas.to_sql(name='team_bpa', con=con, if_exists='replace')
-    team_cat_bpas.to_sql(name='team_cat_bpa', con=con, if_exists='replace')
+def parse_qbj_file(qbj_path, game_id, packet, recoding):
+    qbj = qbstreamlit.jsonstream.load_qbj(qbj_path)
 
+    buzzes, bonuses, player_stats, team_stats = parse_stats(
+        qbj, recoding=recoding)
+
+    for df in [buzzes, bonuses, player_stats, team_stats]:
+        df['packet'] = packet
+        df['game_id'] = game_id
+
+    return buzzes, bonuses, player_stats, team_stats
+
+
+_worker_recoding = {}
+
+
+def _init_parse_worker(recoding):
+    _worker_recoding['recoding'] = recoding
+
+
+def _parse_qbj_task(task):
+    qbj_path, game_id, tournament = task
+    start = time.perf_counter()
+    try:
+        packet = get_qbj_packet(qbj_path, tournament)
+        result = parse_qbj_file(
+            qbj_path, game_id, packet, _worker_recoding['recoding'])
+        error = None
+    except Exception as e:
+        result = None
+        error = describe_error(qbj_path, e)
+    # Measured here so it is also available when the task ran in a worker
+    # process, where instrumentation hooks are not installed.
+    stats = {
+        'path': qbj_path,
+        'game_id': game_id,
+        'seconds': time.perf_counter() - start,
+        'rows': 0 if result is None else sum(len(df.index) for df in result),
+        'peak_rss': qbstreamlit.instrument.get_peak_rss(),
+        'error': error
+    }
+    return result, error, stats
+
+
+def parse_qbj_files(tournament, qbj_paths, game_ids, recoding, workers=1):
+    """Parses QBJ files, optionally spread across a process pool.
+    Args:
+        tournament (str): Tournament the files belong to
+        qbj_paths (list): QBJ file paths
+        game_ids (list): game_id to assign to each file
+        recoding (RecodingIndex): Team and player name recoding
+        workers (int): Number of worker processes; 1 parses in this process
+    Returns:
+        list: (buzzes, bonuses, player_stats, team_stats) per file, sorted by game_id
+    Raises:
+        IngestError: Listing every file that could not be parsed
+    """
+    tasks = sorted(
+        [(qbj_path, game_id, tournament)
+         for qbj_path, game_id in zip(qbj_paths, game_ids)],
+        key=lambda task: task[1]
+    )
+
+    if workers <= 1 or len(tasks) <= 1:
+        _init_parse_worker(recoding)
+        outcomes = [_parse_qbj_task(task) for task in tasks]
+    else:
+        outcomes = _parse_qbj_tasks_in_pool(tasks, recoding, workers)
+
+    for result, error, stats in outcomes:
+        qbstreamlit.instrument.emit('parse_file', kind='qbj', **stats)
+
+    errors = [error for result, error, stats in outcomes if error is not None]
+    if len(errors) > 0:
+        raise IngestError(errors)
+    return [result for result, error, stats in outcomes]
+
+
+def _parse_qbj_tasks_in_pool(tasks, recoding, workers):
+    # The recoding index goes to each worker once through the initializer
+    # rather than being pickled with every task. Workers are spawned rather
+    # than forked so they never inherit open SQLite handles or the loader
+    # cache of a threaded parent such as the ingest worker's Streamlit app.
+    chunksize = max(1, len(tasks) // (workers*4))
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_parse_worker,
+        initargs=(recoding,)
+    ) as executor:
+        return list(executor.map(_parse_qbj_task, tasks, chunksize=chunksize))
+
+
+def load_qbj_manifest(con, tournament):
+    if not qbstreamlit.db.table_exists(con, 'qbj_manifest') or \
+            'tournament' not in qbstreamlit.db.get_table_columns(con, 'qbj_manifest'):
+        return None
+    return pd.read_sql(
+        'SELECT path, hash, mtime, game_id FROM qbj_manifest WHERE tournament = ?',
+        con, params=[tournament])
+
+
+def populate_db_qbjs_nasat(tournament, incremental=False, workers=1):
+    """Parses a tournament's QBJ files into its partition of stats.db.
+    Other tournaments' rows are left in place.
+    Args:
+        tournament (str): Tournament folder under qbjs/
+        incremental (bool): Only parse files that are new or changed since the
+            last ingest, and recompute BPA for the affected teams' players.
+            Falls back to a full rebuild when stats.db has no manifest.
+        workers (int): Number of processes used to parse QBJ files
+    Returns:
+        list: game_ids whose rows were written or removed
+    """
+    if incremental:
+        con = qbstreamlit.db.connect()
+        manifest = load_qbj_manifest(con, tournament)
+        con.close()
+        if manifest is not None:
+            return update_db_qbjs_nasat(tournament, manifest, workers=workers)
 
-def populate_db_qbjs_nasat(tournament):
     all_buzzes = []
     all_bonuses = []
     all_player_stats = []
     all_team_stats = []
+    manifest = []
 
-    player_recoding = pd.read_csv('player-recoding.csv')
-    team_recoding = pd.read_csv('team-recoding.csv')
+    recoding = RecodingIndex.from_csvs()
 
-    for i, qbj_path in enumerate(glob.glob(f'qbjs/{st.session_state.tournament}/*.qbj')):
-        with open(qbj_path, 'r') as f:
-            qbj = json.load(f)
-        
-        print(i)
+    qbj_paths = sorted(glob.glob(f'qbjs/{tournament}/*.qbj'))
+    results = parse_qbj_files(
+        tournament, qbj_paths, list(range(len(qbj_paths))), recoding, workers=workers)
 
-        if 'round-recoding.json' in glob.glob('*'):
-            with open('round-recoding.json', 'r') as f:
-                round_recoding = json.load(f)
-            packet = round_recoding[st.session_state.tournament][qbj_path[5:]]
-        else:
-            packet = re.search(r'(?<=Round_)\d+', qbj_path).group(0)
-        buzzes, bonuses, player_stats, team_stats = parse_stats(
-            qbj,
-            player_recoding,
-            team_recoding
-        )
-
-        buzzes['packet'] = packet
-        buzzes['game_id'] = i
-        bonuses['packet'] = packet
-        bonuses['game_id'] = i
-        player_stats['packet'] = packet
-        player_stats['game_id'] = i
-        team_stats['packet'] = packet
-        team_stats['game_id'] = i
-
-        if i == 128:
-            print(player_stats)
+    for i, (qbj_path, result) in enumerate(zip(qbj_paths, results)):
+        buzzes, bonuses, player_stats, team_stats = result
 
         all_buzzes.append(buzzes)
         all_bonuses.append(bonuses)
         all_player_stats.append(player_stats)
         all_team_stats.append(team_stats)
+        manifest.append({
+            'path': qbj_path,
+            'hash': get_file_hash(qbj_path),
+            'mtime': os.path.getmtime(qbj_path),
+            'game_id': i
+        })
 
+    # Before the first round there are no QBJ files, and the partition's
+    # tables are written empty.
+    all_buzzes = concat_frames(all_buzzes, 'buzzes')
+    all_player_stats = concat_frames(all_player_stats, 'player_stats')
     player_bpas, player_cat_bpas = calculate_player_bpas(
-        tournament, pd.concat(all_buzzes), pd.concat(all_player_stats))
+        tournament, all_buzzes.copy(), all_player_stats)
     team_bpas, team_cat_bpas = calculate_team_bpas(
-        tournament, pd.concat(all_buzzes), pd.concat(all_player_stats))
+        tournament, all_buzzes.copy(), all_player_stats)
+    buzz_histogram = calculate_buzz_histogram(
+        tournament, all_buzzes.copy())
+
+    qbstreamlit.db.write_tables({
+        'buzzes': all_buzzes,
+        'bonuses': concat_frames(all_bonuses, 'bonuses'),
+        'player_stats': all_player_stats,
+        'team_stats': concat_frames(all_team_stats, 'team_stats'),
+        'player_bpa': player_bpas,
+        'player_cat_bpa': player_cat_bpas,
+        'team_bpa': team_bpas,
+        'team_cat_bpa': team_cat_bpas,
+        'buzz_histogram': buzz_histogram,
+        'qbj_manifest': pd.DataFrame(manifest, columns=['path', 'hash', 'mtime', 'game_id']),
+        # Game ids are reassigned, so games still being scored live and every
+        # stored scoresheet are dropped.
+        'live_games': pd.DataFrame(columns=['path', 'game_id', 'packet', 'events', 'finished']),
+        'scoresheets': pd.DataFrame(columns=['game_id', 'has_bonuses', 'spec', 'generation']),
+    }, tournament=tournament)
+    return list(range(len(qbj_paths)))
+
+
+def update_db_qbjs_nasat(tournament, manifest, workers=1):
+    recoding = RecodingIndex.from_csvs()
+
+    known = {row['path']: row for row in manifest.to_dict('records')}
+    qbj_paths = sorted(glob.glob(f'qbjs/{tournament}/*.qbj'))
+    # A QBJ file for a game scored live by qbstreamlit.live takes over its
+    # game_id and replaces the live rows.
+    live_games = qbstreamlit.data.load_live_games(tournament=tournament)
+    live_game_ids = dict(zip(live_games['path'], live_games['game_id'].astype(int)))
+    next_game_id = max(
+        [-1] + [int(game_id) for game_id in manifest['game_id']] + list(live_game_ids.values())
+    ) + 1
+
+    stale_game_ids = [int(known[path]['game_id'])
+                      for path in known if path not in qbj_paths]
+    changed = []
+    for qbj_path in qbj_paths:
+        mtime = os.path.getmtime(qbj_path)
+        if qbj_path in known and known[qbj_path]['mtime'] == mtime:
+            continue
+        file_hash = get_file_hash(qbj_path)
+        if qbj_path in known:
+            game_id = int(known[qbj_path]['game_id'])
+            if known[qbj_path]['hash'] != file_hash:
+                stale_game_ids.append(game_id)
+                changed.append(qbj_path)
+        elif qbj_path in live_game_ids:
+            game_id = live_game_ids[qbj_path]
+            stale_game_ids.append(game_id)
+            changed.append(qbj_path)
+        else:
+            game_id = next_game_id
+            next_game_id += 1
+            changed.append(qbj_path)
+        known[qbj_path] = {'path': qbj_path, 'hash': file_hash,
+                           'mtime': mtime, 'game_id': game_id}
 
-    con = sq.connect('stats.db')
+    new_manifest = pd.DataFrame(
+        [known[path] for path in qbj_paths], columns=['path', 'hash', 'mtime', 'game_id'])
 
-    pd.concat(all_buzzes).to_sql(name='buzzes', con=con, if_exists='replace')
-    pd.concat(all_bonuses).to_sql(name='bonuses', con=con, if_exists='replace')
-    pd.concat(all_player_stats).to_sql(
-        name='player_stats', con=con, if_exists='replace')
-    pd.concat(all_team_stats).to_sql(
-        name='team_stats', con=con, if_exists='replace')
+    con = qbstreamlit.db.connect()
 
-    player_bpas.to_sql(name='player_bpa', con=con, if_exists='replace')
-    player_cat_bpas.to_sql(name='player_cat_bpa', con=con, if_exists='replace')
-    team_bpas.to_sql(name='team_bpa', con=con, if_exists='replace')
-    team_cat_bpas.to_sql(name='team_cat_bpa', con=con, if_exists='replace')
+    if len(stale_game_ids) == 0 and len(changed) == 0:
+        with qbstreamlit.db.transaction(con):
+            qbstreamlit.db.replace_partition(
+                con, 'qbj_manifest', new_manifest, tournament)
+        con.close()
+        return []
 
+    all_buzzes = []
+    all_bonuses = []
+    all_player_stats = []
+    all_team_stats = []
+    results = parse_qbj_files(
+        tournament, changed, [known[qbj_path]['game_id'] for qbj_path in changed],
+        recoding, workers=workers)
+    for buzzes, bonuses, player_stats, team_stats in results:
+        all_buzzes.append(buzzes)
+        all_bonuses.append(bonuses)
+        all_player_stats.append(player_stats)
+        all_team_stats.append(team_stats)
 
-def populate_db_packets(packets):
+    with qbstreamlit.db.transaction(con, bulk=True):
+        game_placeholders = ', '.join(['?']*len(stale_game_ids))
+        affected_teams = set(pd.read_sql(
+            f'SELECT DISTINCT team FROM team_stats WHERE tournament = ? AND game_id IN ({game_placeholders})',
+            con, params=[tournament] + stale_game_ids)['team'])
+        for team_stats in all_team_stats:
+            affected_teams.update(team_stats['team'])
+        affected_teams = list(affected_teams)
+
+        for table in ['buzzes', 'bonuses', 'player_stats', 'team_stats']:
+            qbstreamlit.db.delete_partition_rows(
+                con, table, tournament, 'game_id', stale_game_ids)
+
+        if len(changed) > 0:
+            qbstreamlit.db.append_partition(
+                con, 'buzzes', pd.concat(all_buzzes), tournament)
+            qbstreamlit.db.append_partition(
+                con, 'bonuses', pd.concat(all_bonuses), tournament)
+            qbstreamlit.db.append_partition(
+                con, 'player_stats', pd.concat(all_player_stats), tournament)
+            qbstreamlit.db.append_partition(
+                con, 'team_stats', pd.concat(all_team_stats), tournament)
+
+        recalculate_team_tables(con, tournament, affected_teams)
+
+        qbstreamlit.db.replace_partition(
+            con, 'qbj_manifest', new_manifest, tournament)
+        qbstreamlit.db.delete_partition_rows(
+            con, 'live_games', tournament, 'path',
+            [qbj_path for qbj_path in changed if qbj_path in live_game_ids])
+        touched_game_ids = sorted(
+            set(stale_game_ids) | {int(known[qbj_path]['game_id']) for qbj_path in changed})
+        qbstreamlit.db.delete_scoresheets(con, tournament, game_ids=touched_game_ids)
+        qbstreamlit.db.touch_partition(con, tournament)
+    con.close()
+    return touched_game_ids
+
+
+def recalculate_team_tables(con, tournament, teams):
+    """Recomputes BPA, ACC and buzz histogram rows for some teams and their
+    players from the buzzes and player_stats rows on con, replacing the
+    teams' old rows.
+    Args:
+        con (sqlite3.Connection): Connection with an open write transaction
+        tournament (str): Tournament whose partition is updated
+        teams (list): Teams whose rows are recomputed
+    """
+    team_placeholders = ', '.join(['?']*len(teams))
+    team_buzzes = pd.read_sql(
+        f'SELECT * FROM buzzes WHERE tournament = ? AND team IN ({team_placeholders})',
+        con, params=[tournament] + teams)
+    team_player_stats = pd.read_sql(
+        f'SELECT * FROM player_stats WHERE tournament = ? AND team IN ({team_placeholders})',
+        con, params=[tournament] + teams)
+
+    for table in ['player_bpa', 'player_cat_bpa', 'team_bpa', 'team_cat_bpa', 'buzz_histogram']:
+        qbstreamlit.db.delete_partition_rows(
+            con, table, tournament, 'team', teams)
+
+    if len(team_player_stats.index) > 0:
+        player_bpas, player_cat_bpas = calculate_player_bpas(
+            tournament, team_buzzes.copy(), team_player_stats)
+        team_bpas, team_cat_bpas = calculate_team_bpas(
+            tournament, team_buzzes.copy(), team_player_stats)
+
+        qbstreamlit.db.append_partition(
+            con, 'player_bpa', player_bpas, tournament)
+        qbstreamlit.db.append_partition(
+            con, 'player_cat_bpa', player_cat_bpas, tournament)
+        qbstreamlit.db.append_partition(
+            con, 'team_bpa', team_bpas, tournament)
+        qbstreamlit.db.append_partition(
+            con, 'team_cat_bpa', team_cat_bpas, tournament)
+        qbstreamlit.db.append_partition(
+            con, 'buzz_histogram', calculate_buzz_histogram(tournament, team_buzzes),
+            tournament)
+
+
+def sanitize_tossup_meta(tossup_meta):
+    tossup_meta['answer_clean'] = qbstreamlit.answers.sanitize_answers(
+        tossup_meta['answer'])
+    return tossup_meta
+
+
+def sanitize_bonus_meta(bonus_meta):
+    bonus_meta['answers_clean'] = qbstreamlit.answers.sanitize_bonus_answers(
+        bonus_meta['answers'])
+    return bonus_meta
+
+
+def populate_db_packets(packets, tournament):
+    """Saves uploaded packet JSONs under packets/<tournament>/ and parses
+    them into the tournament's partition of stats.db.
+    Args:
+        packets (list): Uploaded packet files, named like 'packet3.json'
+        tournament (str): Tournament the packets belong to
+    """
     all_tossup_meta = []
     all_bonus_meta = []
+    os.makedirs(f'packets/{tournament}', exist_ok=True)
     for packet_path in packets:
         packet = json.load(packet_path)
-        packet_num = re.search(r'(?<=packet)\d+', packet_path.name).group(0)
+        packet_num = int(re.search(r'(?<=packet)\d+', packet_path.name).group(0))
 
         json_object = json.dumps(packet)
 
-        with open(f"packets/packet{packet_num}.json", "w") as outfile:
+        with open(f"packets/{tournament}/packet{packet_num}.json", "w") as outfile:
             outfile.write(json_object)
 
         tossup_meta, bonus_meta = parse_packet(packet)
@@ -283,36 +626,132 @@ def populate_db_packets(packets):
         all_tossup_meta.append(tossup_meta)
         all_bonus_meta.append(bonus_meta)
 
-    con = sq.connect('stats.db')
+    qbstreamlit.db.write_tables({
+        'tossup_meta': sanitize_tossup_meta(pd.concat(all_tossup_meta)),
+        'bonus_meta': sanitize_bonus_meta(pd.concat(all_bonus_meta)),
+        # Stored scoresheets show the replaced answers.
+        'scoresheets': pd.DataFrame(columns=['game_id', 'has_bonuses', 'spec', 'generation']),
+    }, tournament=tournament)
+
+
+def load_packet_manifest(tournament):
+    con = qbstreamlit.db.connect()
+    try:
+        if not qbstreamlit.db.table_exists(con, 'packet_manifest') or \
+                'tournament' not in qbstreamlit.db.get_table_columns(con, 'packet_manifest'):
+            return {}
+        manifest = pd.read_sql(
+            'SELECT path, hash, mtime, packet FROM packet_manifest WHERE tournament = ?',
+            con, params=[tournament])
+    finally:
+        con.close()
+    return {row['path']: row for row in manifest.to_dict('records')}
+
 
-    pd.concat(all_tossup_meta).to_sql(
-        name='tossup_meta', con=con, if_exists='replace')
-    pd.concat(all_bonus_meta).to_sql(
-        name='bonus_meta', con=con, if_exists='replace')
+def parse_packet_file(packet_path, packet_num):
+    packet = qbstreamlit.jsonstream.load_json(packet_path)
+
+    tossup_meta, bonus_meta = parse_packet(packet)
+
+    tossup_meta['packet'] = packet_num
+    bonus_meta['packet'] = packet_num
+    packet_meta = qbstreamlit.data.get_tossup_lengths(packet['tossups'])
+    packet_meta['path'] = packet_path
+    return tossup_meta, bonus_meta, packet_meta
 
 
 def populate_db_packets_nasat(tournament):
+    """Parses a tournament's packet JSONs into stats.db.
+
+    Packets whose content hash matches the last ingest are not re-read;
+    their tossup_meta, bonus_meta and packet_meta rows are carried over.
+    """
     all_tossup_meta = []
     all_bonus_meta = []
-    for packet_path in glob.glob(f'packets/{tournament}/*.json'):
-        with open(packet_path, "r") as f:
-            packet = json.load(f)
+    all_packet_meta = []
+    manifest = []
+
+    packet_paths = sorted(glob.glob(f'packets/{tournament}/*.json'))
+    if len(packet_paths) == 0:
+        raise IngestError([f'packets/{tournament}: no packet files to ingest'])
+
+    known = load_packet_manifest(tournament)
+    unchanged = []
+    errors = []
+    for packet_path in packet_paths:
+        try:
+            packet_num = re.search(r'(?<=packet)\d+', packet_path).group(0)
+            file_hash = get_file_hash(packet_path)
+            manifest.append({
+                'path': packet_path,
+                'hash': file_hash,
+                'mtime': os.path.getmtime(packet_path),
+                'packet': int(packet_num)
+            })
 
-        packet_num = re.search(r'(?<=packet)\d+', packet_path).group(0)
+            if packet_path in known and known[packet_path]['hash'] == file_hash:
+                unchanged.append(packet_path)
+                continue
 
-        tossup_meta, bonus_meta = parse_packet(packet)
+            with qbstreamlit.instrument.timed('parse_file', kind='packet', path=packet_path) as fields:
+                tossup_meta, bonus_meta, packet_meta = parse_packet_file(
+                    packet_path, packet_num)
+                fields['rows'] = len(tossup_meta.index) + len(bonus_meta.index)
+        except Exception as e:
+            errors.append(describe_error(packet_path, e))
+            continue
 
-        tossup_meta['packet'] = packet_num
-        bonus_meta['packet'] = packet_num
         all_tossup_meta.append(tossup_meta)
         all_bonus_meta.append(bonus_meta)
-
-    con = sq.connect('stats.db')
-
-    pd.concat(all_tossup_meta).to_sql(
-        name='tossup_meta', con=con, if_exists='replace')
-    pd.concat(all_bonus_meta).to_sql(
-        name='bonus_meta', con=con, if_exists='replace')
+        all_packet_meta.append(packet_meta)
+
+    if len(errors) > 0:
+        raise IngestError(errors)
+
+    if len(unchanged) > 0:
+        unchanged_packets = [int(known[path]['packet']) for path in unchanged]
+        all_tossup_meta.append(
+            qbstreamlit.data.load_tossup_meta(
+                packet=unchanged_packets, tournament=tournament))
+        all_bonus_meta.append(
+            qbstreamlit.data.load_bonus_meta(
+                packet=unchanged_packets, tournament=tournament))
+        all_packet_meta.append(
+            qbstreamlit.data.query_table(
+                'packet_meta', tournament=tournament, path=unchanged))
+
+    tables = {
+        'tossup_meta': sanitize_tossup_meta(pd.concat(all_tossup_meta)),
+        'bonus_meta': sanitize_bonus_meta(pd.concat(all_bonus_meta)),
+        'packet_meta': pd.concat(all_packet_meta),
+        'packet_manifest': pd.DataFrame(manifest, columns=['path', 'hash', 'mtime', 'packet']),
+    }
+    # Scoresheets show tossup and bonus answers, so games played on a new,
+    # changed or removed packet need theirs rendered again.
+    current = {record['path'] for record in manifest}
+    stale_packets = [record['packet'] for record in manifest if record['path'] not in unchanged] + \
+        [int(row['packet']) for path, row in known.items() if path not in current]
+
+    con = qbstreamlit.db.connect()
+    try:
+        with qbstreamlit.db.transaction(con, bulk=True):
+            for name, df in tables.items():
+                qbstreamlit.db.replace_partition(con, name, df, tournament)
+            qbstreamlit.db.delete_scoresheets(con, tournament, packets=stale_packets)
+            qbstreamlit.db.touch_partition(con, tournament)
+    finally:
+        con.close()
+
+
+packet_tuhs = {
+    'History': 4,
+    'Science': 4,
+    'Literature': 4,
+    'Arts': 3,
+    'Beliefs': 2,
+    'Thought': 2,
+    'Other': 1,
+}
 
 
 def calculate_bpa(buzzes, tuh):
@@ -320,8 +759,9 @@ def calculate_bpa(buzzes, tuh):
     return (sum(buzzes['bpa_comp']))
 
 
-def calculate_player_bpas(tournament, buzzes, player_stats):
-    tossup_meta = qbstreamlit.data.load_tossup_meta()
+def get_full_buzzes(tournament, buzzes):
+    tossup_meta = qbstreamlit.data.load_tossup_meta(
+        columns=['packet', 'tossup', 'category'], tournament=tournament)
     packet_meta = qbstreamlit.data.get_packet_meta(tournament)
 
     buzzes['packet'] = buzzes['packet'].astype(int)
@@ -331,114 +771,97 @@ def calculate_player_bpas(tournament, buzzes, player_stats):
     ).merge(
         packet_meta, on=['packet', 'tossup']
     )
-
     full_buzzes['celerity'] = 1 - full_buzzes['buzz_position'] / \
         full_buzzes['tossup_length']
 
-    player_games = player_stats.groupby(
-        ['player', 'team']
-    ).agg({'game_id': 'nunique'}).reset_index().rename(columns={'game_id': 'Games'})
-    player_games['TUH'] = player_games['Games']*20
-
-    player_bpa_list = []
-    for i, row in player_games.iterrows():
-        player_buzzes = full_buzzes[full_buzzes['value'].isin(['15', '10'])]
-        player_buzzes = player_buzzes[player_buzzes['player'] == row['player']]
-        player_buzzes = player_buzzes[player_buzzes['team'] == row['team']]
-
-        player_bpa_list.append({
-            'player': row['player'],
-            'team': row['team'],
-            'BPA': calculate_bpa(player_buzzes, row['TUH']),
-            'ACC': np.mean(player_buzzes['celerity'])
-        })
-    player_bpa = pd.DataFrame(player_bpa_list)
-
-    packet_tuhs = {
-        'History': 4,
-        'Science': 4,
-        'Literature': 4,
-        'Arts': 3,
-        'Beliefs': 2,
-        'Thought': 2,
-        'Other': 1,
-    }
+    return full_buzzes
 
-    player_cat_bpa_list = []
-    for i, row in player_games.iterrows():
-        for category, tuh in packet_tuhs.items():
-            player_cat_buzzes = full_buzzes[full_buzzes['value'].isin([
-                                                                      '15', '10'])]
-            player_cat_buzzes = player_cat_buzzes[player_cat_buzzes['player']
-                                                  == row['player']]
-            player_cat_buzzes = player_cat_buzzes[player_cat_buzzes['team'] == row['team']]
-            player_cat_buzzes = player_cat_buzzes[player_cat_buzzes['category'] == category]
-
-            player_cat_bpa_list.append({
-                'player': row['player'],
-                'team': row['team'],
-                'category': category,
-                'BPA': calculate_bpa(player_cat_buzzes, row['Games']*tuh),
-                'ACC': np.mean(player_cat_buzzes['celerity'])
-            })
-    player_cat_bpa = pd.DataFrame(player_cat_bpa_list)
-    return player_bpa, player_cat_bpa
 
+def calculate_bpas(full_buzzes, stats, keys):
+    """Computes BPA and ACC for every entity in one grouped pass.
+    Args:
+        full_buzzes (pd.DataFrame): Buzzes merged with tossup and packet metadata
+        stats (pd.DataFrame): Per-game stats used to count games played
+        keys (list): Columns identifying an entity, e.g. ['player', 'team']
+    Returns:
+        tuple: Overall and per-category BPA/ACC DataFrames
+    """
+    games = stats.groupby(
+        keys
+    ).agg({'game_id': 'nunique'}).reset_index().rename(columns={'game_id': 'Games'})
+    games['TUH'] = games['Games']*20
 
-def calculate_team_bpas(tournament, buzzes, team_stats):
-    tossup_meta = qbstreamlit.data.load_tossup_meta()
-    packet_meta = qbstreamlit.data.get_packet_meta(tournament)
+    correct = full_buzzes[full_buzzes['value'].astype(int).isin([15, 10])]
+    correct = correct[keys + ['category', 'celerity']]
 
-    buzzes['packet'] = buzzes['packet'].astype(int)
+    bpa = correct.merge(games[keys + ['TUH']], on=keys)
+    bpa['bpa_comp'] = bpa['celerity']*100/bpa['TUH']
+    bpa = bpa.groupby(keys).agg(
+        BPA=('bpa_comp', 'sum'), ACC=('celerity', 'mean')
+    ).reset_index()
+    bpa = games[keys].merge(bpa, on=keys, how='left')
+    bpa['BPA'] = bpa['BPA'].fillna(0)
 
-    full_buzzes = buzzes.merge(
-        tossup_meta, on=['packet', 'tossup']
-    ).merge(
-        packet_meta, on=['packet', 'tossup']
+    cat_games = games[keys + ['Games']].merge(
+        pd.DataFrame({'category': list(packet_tuhs.keys()),
+                      'cat_tuh': list(packet_tuhs.values())}),
+        how='cross'
     )
-    full_buzzes['celerity'] = 1 - full_buzzes['buzz_position'] / \
-        full_buzzes['tossup_length']
+    cat_games['TUH'] = cat_games['Games']*cat_games['cat_tuh']
 
-    team_games = team_stats.groupby(
-        ['team']
-    ).agg({'game_id': 'nunique'}).reset_index().rename(columns={'game_id': 'Games'})
-    team_games['TUH'] = team_games['Games']*20
-
-    team_bpa_list = []
-    for i, row in team_games.iterrows():
-        team_buzzes = full_buzzes[full_buzzes['value'].isin(['15', '10'])]
-        team_buzzes = team_buzzes[team_buzzes['team'] == row['team']]
-        team_bpa_list.append({
-            'team': row['team'],
-            'BPA': calculate_bpa(team_buzzes, row['TUH']),
-            'ACC': np.mean(team_buzzes['celerity'])
-        })
-    team_bpa = pd.DataFrame(team_bpa_list)
-
-    packet_tuhs = {
-        'History': 4,
-        'Science': 4,
-        'Literature': 4,
-        'Arts': 3,
-        'Beliefs': 2,
-        'Thought': 2,
-        'Other': 1,
-    }
+    cat_bpa = correct.merge(
+        cat_games[keys + ['category', 'TUH']], on=keys + ['category'])
+    cat_bpa['bpa_comp'] = cat_bpa['celerity']*100/cat_bpa['TUH']
+    cat_bpa = cat_bpa.groupby(keys + ['category']).agg(
+        BPA=('bpa_comp', 'sum'), ACC=('celerity', 'mean')
+    ).reset_index()
+    cat_bpa = cat_games[keys + ['category']].merge(
+        cat_bpa, on=keys + ['category'], how='left')
+    cat_bpa['BPA'] = cat_bpa['BPA'].fillna(0)
+
+    return bpa, cat_bpa
 
-    team_cat_bpa_list = []
-    for i, row in team_games.iterrows():
-        for category, tuh in packet_tuhs.items():
-            team_cat_buzzes = full_buzzes[full_buzzes['value'].isin([
-                                                                    '15', '10'])]
-            team_cat_buzzes = team_cat_buzzes[team_cat_buzzes['team']
-                                              == row['team']]
-            team_cat_buzzes = team_cat_buzzes[team_cat_buzzes['category'] == category]
-            team_cat_bpa_list.append({
-                'team': row['team'],
-                'category': category,
-                'BPA': calculate_bpa(team_cat_buzzes, row['Games']*tuh),
-                'ACC': np.mean(team_cat_buzzes['celerity'])
-            })
-    team_cat_bpa = pd.DataFrame(team_cat_bpa_list)
 
-    return team_bpa, team_cat_bpa
+CATEGORY_RECODING = {'Geo/CE': 'Other', 'Other Academic': 'Other'}
+BUZZ_BIN_STEP = 15
+
+
+def recode_categories(categories):
+    return categories.replace(CATEGORY_RECODING)
+
+
+def bin_buzz_positions(df, by, step=BUZZ_BIN_STEP):
+    """Counts buzzes per buzz_position bin of width step, grouped by the
+    columns in by."""
+    binned = df[by].copy()
+    binned['bin_start'] = (df['buzz_position'] // step) * step
+    binned = binned.groupby(by + ['bin_start'], as_index=False).agg(
+        count=('bin_start', 'size'))
+    binned['bin_end'] = binned['bin_start'] + step
+    return binned
+
+
+def calculate_buzz_histogram(tournament, buzzes):
+    """Materializes buzz counts per (team, player, category, value, bin) so
+    the category buzz charts render from pre-binned rows."""
+    tossup_meta = qbstreamlit.data.load_tossup_meta(
+        columns=['packet', 'tossup', 'category'], tournament=tournament)
+    full_buzzes = buzzes[['packet', 'tossup', 'team', 'player', 'buzz_position', 'value']].astype(
+        {'packet': int, 'value': int}
+    ).merge(tossup_meta, on=['packet', 'tossup'])
+    full_buzzes['category'] = recode_categories(full_buzzes['category'])
+
+    buzz_histogram = bin_buzz_positions(
+        full_buzzes, ['team', 'player', 'category', 'value'])
+    buzz_histogram.insert(0, 'tournament', tournament)
+    return buzz_histogram
+
+
+def calculate_player_bpas(tournament, buzzes, player_stats):
+    full_buzzes = get_full_buzzes(tournament, buzzes)
+    return calculate_bpas(full_buzzes, player_stats, ['player', 'team'])
+
+
+def calculate_team_bpas(tournament, buzzes, team_stats):
+    full_buzzes = get_full_buzzes(tournament, buzzes)
+    return calculate_bpas(full_buzzes, team_stats, ['team'])
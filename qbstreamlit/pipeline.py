@@ -0,0 +1,70 @@
+import time
+import qbstreamlit.cache
+import qbstreamlit.charts
+import qbstreamlit.db
+import qbstreamlit.instrument
+import qbstreamlit.parser
+
+def build_db(tournament, incremental=False, workers=1, on_stage=None):
+    """Builds a tournament's partition of stats.db. Needs no Streamlit
+    session, so it can run from the command line or a scheduled job.
+
+    The build's profile (stage and per-file timings, rows, SQL write time
+    per table, peak RSS, cache hit rate, rows that match nothing they
+    reference) is written to instrument.PROFILE_PATH.
+    Args:
+        tournament (str): Folder name under packets/ and qbjs/
+        incremental (bool): Only parse QBJ files that changed since the last build
+        workers (int): Number of processes used to parse QBJ files
+        on_stage (callable): Called with (stage, seconds) as each stage finishes
+    Returns:
+        dict: Seconds taken by each stage, in the order they ran
+    Raises:
+        qbstreamlit.parser.IngestError: If any packet or QBJ file could not be parsed
+    """
+    touched_game_ids = []
+
+    def ingest_qbjs():
+        touched_game_ids.extend(qbstreamlit.parser.populate_db_qbjs_nasat(
+            tournament, incremental=incremental, workers=workers))
+
+    # Packets go first: BPA needs tossup_meta and the stored tossup lengths.
+    # Only games that changed, or have no stored scoresheet, are rendered.
+    stages = [
+        ('packets', lambda: qbstreamlit.parser.populate_db_packets_nasat(tournament)),
+        ('qbjs', ingest_qbjs),
+        ('scoresheets', lambda: qbstreamlit.charts.render_scoresheet_specs(
+            tournament, game_ids=touched_game_ids)),
+    ]
+
+    timings = {}
+    with qbstreamlit.instrument.record_profile():
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage()
+            timings[name] = time.perf_counter() - start
+            qbstreamlit.instrument.emit(
+                'stage', name=name, seconds=timings[name],
+                peak_rss=qbstreamlit.instrument.get_peak_rss())
+            if on_stage is not None:
+                on_stage(name, timings[name])
+        check_references(tournament)
+
+    qbstreamlit.cache.clear_cache()
+    return timings
+
+
+def check_references(tournament):
+    """Reports the tournament's rows that match nothing they reference, such
+    as buzzes on a tossup missing from its packet, as 'orphan_rows'
+    instrumentation events and warnings."""
+    con = qbstreamlit.db.connect()
+    try:
+        orphans = qbstreamlit.db.find_orphans(con, tournament)
+    finally:
+        con.close()
+    for orphan in orphans:
+        qbstreamlit.instrument.emit('orphan_rows', tournament=tournament, **orphan)
+        qbstreamlit.instrument.logger.warning(
+            '%s: %d %s rows match no %s row on (%s)', tournament, orphan['rows'],
+            orphan['table'], orphan['references'], ', '.join(orphan['columns']))
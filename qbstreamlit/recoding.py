@@ -0,0 +1,99 @@
+import hashlib
+import os
+import pickle
+import pandas as pd
+
+CACHE_DIR = '.qbstreamlit_cache'
+
+
+class UnknownNameError(KeyError):
+    """Raised when a QBJ name has no entry in the recoding CSVs."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+class RecodingIndex:
+    """Lookup from raw QBJ team and player names to their cleaned names.
+
+    Build it once per ingest and pass it to parse_stats instead of the raw
+    recoding DataFrames.
+    """
+
+    def __init__(self, player_dict, team_dict):
+        self.player_dict = player_dict
+        self.team_dict = team_dict
+
+    @classmethod
+    def from_frames(cls, player_recoding, team_recoding):
+        team_dict = dict(zip(team_recoding['team'], team_recoding['team_clean']))
+        player_dict = dict(zip(
+            zip(player_recoding['player'], player_recoding['team']),
+            player_recoding['player_clean']
+        ))
+        return cls(player_dict, team_dict)
+
+    @classmethod
+    def from_csvs(cls, player_path='player-recoding.csv', team_path='team-recoding.csv',
+                  cache_dir=CACHE_DIR):
+        """Loads the recoding CSVs, reusing a pickled index when neither has changed.
+        Args:
+            player_path (str): Path to the player recoding CSV
+            team_path (str): Path to the team recoding CSV
+            cache_dir (str): Directory for cached indexes; None disables caching
+        Returns:
+            RecodingIndex: The recoding index
+        """
+        digest = hashlib.sha1()
+        for path in [player_path, team_path]:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+        if cache_dir is not None:
+            cache_path = os.path.join(
+                cache_dir, f'recoding-{digest.hexdigest()}.pkl')
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    return pickle.load(f)
+
+        recoding = cls.from_frames(
+            pd.read_csv(player_path), pd.read_csv(team_path))
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump(recoding, f)
+
+        return recoding
+
+    def team(self, name):
+        try:
+            return self.team_dict[name]
+        except KeyError:
+            raise UnknownNameError(
+                f"Team '{name}' is not in team-recoding.csv") from None
+
+    def player(self, name, team):
+        """Looks up a player by raw name and cleaned team name."""
+        try:
+            return self.player_dict[(name, team)]
+        except KeyError:
+            raise UnknownNameError(
+                f"Player '{name}' on team '{team}' is not in player-recoding.csv") from None
+
+    def lineup(self, teams):
+        """Recodes the players listed in a game's lineups.
+        Args:
+            teams (list): (team name, player names) pairs, as named in the QBJ
+                file or live feed
+        Returns:
+            list: Cleaned (player, team) pairs in lineup order, without repeats
+        """
+        players = []
+        for team, names in teams:
+            clean_team = self.team(team)
+            for name in names:
+                player = (self.player(name, clean_team), clean_team)
+                if player not in players:
+                    players.append(player)
+        return players
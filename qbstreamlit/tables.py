@@ -1,38 +1,64 @@
+import copy
+import hashlib
+import html
+import itertools
+import json
+import re
+import numpy as np
 import pandas as pd
+import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder, ColumnsAutoSizeMode, JsCode
 from st_aggrid.shared import GridUpdateMode
-import subprocess
+import qbstreamlit.cache
+import qbstreamlit.data
+import qbstreamlit.db
 
-def aggrid_interactive_table(df: pd.DataFrame, accent_color='#ff4b4b', height=400):
-    """Creates an st-aggrid interactive table based on a dataframe.
+# GridOptions built once per column schema. AgGrid edits the dict it is
+# given, so each call gets a copy.
+_grid_options = {}
+
+def get_grid_options(df, paged=False):
+    """Returns GridOptions for a DataFrame's columns and dtypes.
     Args:
-        df (pd.DataFrame]): Source dataframe
+        df (pd.DataFrame): Source dataframe; only its schema is read
+        paged (bool): Rows are paged, sorted and filtered server-side, so the
+            grid's own pagination, sorting and filtering are turned off
     Returns:
-        dict: The selected row
+        dict: GridOptions for AgGrid
     """
-    options = GridOptionsBuilder.from_dataframe(
-        df, enableValue=True
-    )
+    schema = (tuple(df.columns), tuple(str(dtype) for dtype in df.dtypes), paged)
+    if schema not in _grid_options:
+        options = GridOptionsBuilder.from_dataframe(
+            df, enableValue=True
+        )
 
-    options.configure_default_column(min_column_width=0.1)
-    options.configure_selection("single")
-    options.configure_pagination()
-    # options.configure_auto_height(False)
+        if paged:
+            options.configure_default_column(
+                min_column_width=0.1, sortable=False, filterable=False)
+        else:
+            options.configure_default_column(min_column_width=0.1)
+            options.configure_pagination()
+        options.configure_selection("single")
+        # options.configure_auto_height(False)
 
-    for name in df.columns:
-        if name in ['P', 'G', 'N']:
-            options.configure_column(name, width=1)
+        for name in df.columns:
+            if name in ['P', 'G', 'N']:
+                options.configure_column(name, width=1)
 
-    bolding_js = JsCode('''
-    function(params) {
-        return params.value
-        }''')
+        bolding_js = JsCode('''
+        function(params) {
+            return params.value
+            }''')
 
-    for name in df.columns:
-        if name in ['answer', 'easy', 'medium', 'hard']:
-            options.configure_column(name, cellRenderer = bolding_js)
+        for name in df.columns:
+            if name in ['answer', 'easy', 'medium', 'hard']:
+                options.configure_column(name, cellRenderer = bolding_js)
 
-    custom_css = {
+        _grid_options[schema] = options.build()
+    return copy.deepcopy(_grid_options[schema])
+
+def get_custom_css(accent_color):
+    return {
         ".ag-header-viewport": {"background-color": "white"},
         ".ag-paging-panel": {"font-size": "1.2em"},
         ".ag-theme-streamlit .ag-root-wrapper": {"border": "0px solid pink !important"},
@@ -41,13 +67,21 @@ def aggrid_interactive_table(df: pd.DataFrame, accent_color='#ff4b4b', height=40
             "background-color": "#555555", "color": "white",
             "border-bottom": f"2px solid {accent_color} !important"}
     }
+
+def aggrid_interactive_table(df: pd.DataFrame, accent_color='#ff4b4b', height=400):
+    """Creates an st-aggrid interactive table based on a dataframe.
+    Args:
+        df (pd.DataFrame]): Source dataframe
+    Returns:
+        dict: The selected row
+    """
     selection = AgGrid(
         df,
         enable_enterprise_modules=True,
-        gridOptions=options.build(),
+        gridOptions=get_grid_options(df),
         theme="streamlit",
         height=height,
-        custom_css=custom_css,
+        custom_css=get_custom_css(accent_color),
         update_mode=GridUpdateMode.SELECTION_CHANGED,
         allow_unsafe_jscode=True,
         columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS
@@ -55,14 +89,216 @@ def aggrid_interactive_table(df: pd.DataFrame, accent_color='#ff4b4b', height=40
 
     return selection
 
-def df_to_kable(df):
-    df.to_csv('temp_df.csv', index = False)
-    process = subprocess.Popen("Rscript kable.R", stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell = True)
-    result = process.communicate()
-    return result[0]
-
-def df_to_dt(df):
-    df.to_csv('temp_df.csv', index = False)
-    process = subprocess.Popen("Rscript dt.R", stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell = True)
-    result = process.communicate()
-    return result[0]
\ No newline at end of file
+def aggrid_paged_table(table, columns=None, page_size=100, accent_color='#ff4b4b',
+                       height=400, key='paged_table', **filters):
+    """Creates an st-aggrid table over a stats.db table that sends only the
+    current page to the browser. Sorting, searching and paging run in SQLite.
+    Args:
+        table (str): stats.db table name
+        columns (list): Columns to show; None shows all of them
+        page_size (int): Rows per page
+        key (str): Prefix for the widget keys, unique per table on a page
+        **filters: Column to value, or to a list of values, applied to every page
+    Returns:
+        dict: The selected row
+    """
+    schema, total = qbstreamlit.data.load_page(
+        table, columns, page_size=0, **filters)
+    names = list(schema.columns)
+    declared = qbstreamlit.db.SCHEMA.get(table, {}).get('columns', {})
+    text_columns = [name for name in names if declared.get(name, 'TEXT') == 'TEXT']
+
+    controls = st.columns(5)
+    sort = controls[0].selectbox(
+        'Sort by', [None] + names, format_func=lambda name: '' if name is None else name,
+        key=f'{key}_sort')
+    ascending = controls[1].selectbox(
+        'Order', ['Ascending', 'Descending'], key=f'{key}_order') == 'Ascending'
+    search_column = controls[2].selectbox(
+        'Search in', text_columns, key=f'{key}_search_column')
+    search = controls[3].text_input('Search', key=f'{key}_search')
+    page = controls[4].number_input(
+        'Page', min_value=1, value=1, step=1, key=f'{key}_page')
+
+    contains = None
+    if search_column is not None and search != '':
+        contains = {search_column: search}
+    df, total = qbstreamlit.data.load_page(
+        table, columns, sort=sort, ascending=ascending, page=int(page) - 1,
+        page_size=page_size, contains=contains, **filters)
+    pages = max(1, -(-total // page_size))
+    if int(page) > pages:
+        page = pages
+        df, total = qbstreamlit.data.load_page(
+            table, columns, sort=sort, ascending=ascending, page=pages - 1,
+            page_size=page_size, contains=contains, **filters)
+
+    first = (int(page) - 1)*page_size
+    st.caption(f'Rows {min(first + 1, total)}-{first + len(df.index)} of {total} (page {int(page)} of {pages})')
+
+    selection = AgGrid(
+        df,
+        enable_enterprise_modules=False,
+        gridOptions=get_grid_options(df, paged=True),
+        theme="streamlit",
+        height=height,
+        custom_css=get_custom_css(accent_color),
+        update_mode=GridUpdateMode.SELECTION_CHANGED,
+        allow_unsafe_jscode=True,
+        columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS,
+        key=f'{key}_grid'
+    )
+
+    return selection
+
+# Rendered tables keyed by (DataFrame fingerprint, style, options), shared by
+# every session in the server process.
+table_cache = qbstreamlit.cache.FrameCache(max_entries=256)
+
+HTML_TAG_RE = re.compile(r'<[^>]*>')
+
+DT_TEMPLATE = '''<link rel="stylesheet" href="https://cdn.datatables.net/1.13.8/css/jquery.dataTables.min.css">
+<script src="https://code.jquery.com/jquery-3.7.1.min.js"></script>
+<script src="https://cdn.datatables.net/1.13.8/js/jquery.dataTables.min.js"></script>
+{table}
+<script>$(function() {{ $('#{table_id}').DataTable({options}); }});</script>
+'''
+
+_table_ids = itertools.count()
+
+def get_fingerprint(df):
+    """Hashes a DataFrame's columns, dtypes and values."""
+    digest = hashlib.sha1()
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(repr([str(dtype) for dtype in df.dtypes]).encode())
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    except TypeError:
+        # Unhashable cells, such as lists.
+        digest.update(df.to_csv(index=False).encode())
+    return digest.hexdigest()
+
+def render_cached(df, style, render, **options):
+    key = (get_fingerprint(df), style, tuple(sorted(options.items())))
+    found, rendered = table_cache.get(key)
+    if not found:
+        rendered = render(df, **options)
+        table_cache.set(key, rendered)
+    return rendered
+
+def is_numeric_column(column):
+    return pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
+
+def format_kable_column(column, digits=7):
+    """Formats a column the way kable does: numbers are rounded to digits
+    decimal places, then share the fewest decimal places that show each to
+    digits significant figures."""
+    if pd.api.types.is_bool_dtype(column):
+        return ['NA' if pd.isna(value) else str(bool(value)).upper() for value in column]
+    if not is_numeric_column(column):
+        return ['NA' if pd.isna(value) else str(value) for value in column]
+
+    values = column.astype('float64').round(digits).to_numpy()
+    finite = values[np.isfinite(values)]
+    decimals = 0
+    if not pd.api.types.is_integer_dtype(column):
+        for value in finite:
+            text = np.format_float_positional(
+                value, precision=digits, unique=False, fractional=False, trim='-')
+            if '.' in text:
+                decimals = max(decimals, len(text.split('.')[1]))
+
+    formatted = []
+    for value in values:
+        if np.isnan(value):
+            formatted.append('NA')
+        elif np.isinf(value):
+            formatted.append('Inf' if value > 0 else '-Inf')
+        else:
+            formatted.append(f'{value:.{decimals}f}')
+    return formatted
+
+def pad(text, width, align):
+    if align == 'r':
+        return text.rjust(width)
+    return text.ljust(width)
+
+def render_kable(df, digits=7):
+    headers = [str(name).replace('|', '&#124;') for name in df.columns]
+    cells = [
+        [value.replace('|', '&#124;') for value in format_kable_column(df[name], digits)]
+        for name in df.columns
+    ]
+    aligns = ['r' if is_numeric_column(df[name]) else 'l' for name in df.columns]
+
+    widths = []
+    for header, column in zip(headers, cells):
+        width = max([len(HTML_TAG_RE.sub('', value)) for value in [header] + column])
+        widths.append(max(width + 1, 3))
+
+    rules = [
+        ':' + '-'*(width - 1) if align == 'l' else '-'*(width - 1) + ':'
+        for width, align in zip(widths, aligns)
+    ]
+    rows = [
+        [pad(header, width, align) for header, width, align in zip(headers, widths, aligns)],
+        rules
+    ]
+    for i in range(len(df.index)):
+        rows.append([
+            pad(column[i], width, align)
+            for column, width, align in zip(cells, widths, aligns)
+        ])
+    return '\n'.join(['|' + '|'.join(row) + '|' for row in rows]) + '\n'
+
+def df_to_kable(df, digits=7):
+    """Renders a DataFrame as a markdown pipe table laid out like knitr's kable.
+    Args:
+        df (pd.DataFrame): Source dataframe; the index is not shown
+        digits (int): Decimal places numbers are rounded to
+    Returns:
+        str: Markdown table
+    """
+    return render_cached(df, 'kable', render_kable, digits=digits)
+
+def format_dt_value(value):
+    if pd.isna(value):
+        return ''
+    return html.escape(str(value))
+
+def render_dt(df, page_length=10):
+    table_id = f'qbstreamlit-dt-{next(_table_ids)}'
+    numeric = [is_numeric_column(df[name]) for name in df.columns]
+
+    header = ''.join([f'<th>{html.escape(str(name))}</th>' for name in df.columns])
+    body = []
+    for i, row in enumerate(df.itertuples(index=False, name=None)):
+        cells = ''.join([f'<td>{format_dt_value(value)}</td>' for value in row])
+        body.append(f'<tr><td>{i + 1}</td>{cells}</tr>')
+
+    table = (
+        f'<table id="{table_id}" class="display" style="width:100%">'
+        f'<thead><tr><th></th>{header}</tr></thead>'
+        f'<tbody>{"".join(body)}</tbody></table>'
+    )
+    # As in DT::datatable, numbers are right-aligned and row numbers lead.
+    options = {
+        'pageLength': page_length,
+        'columnDefs': [
+            {'className': 'dt-right', 'targets': [0] + [
+                j + 1 for j, is_numeric in enumerate(numeric) if is_numeric]},
+            {'orderable': False, 'targets': 0}
+        ],
+        'order': []
+    }
+    return DT_TEMPLATE.format(table=table, table_id=table_id, options=json.dumps(options))
+
+def df_to_dt(df, page_length=10):
+    """Renders a DataFrame as a DataTables widget like DT::datatable.
+    Args:
+        df (pd.DataFrame): Source dataframe; the index is not shown
+        page_length (int): Rows per page
+    Returns:
+        str: Self-contained HTML for st.components.v1.html
+    """
+    return render_cached(df, 'dt', render_dt, page_length=page_length)
@@ -1,6 +1,13 @@
-import re
+import datetime
+import pandas as pd
 import streamlit as st
-import qbstreamlit.parser
+import qbstreamlit.cache
+import qbstreamlit.instrument
+import qbstreamlit.pipeline
+import qbstreamlit.worker
+# The answer sanitizers live in qbstreamlit.answers so ingest can run
+# without Streamlit; they stay importable from here.
+from qbstreamlit.answers import sanitize_answer, sanitize_answers, sanitize_bonus_answers
 
 def local_css(file_name):
     st.markdown('<link rel="preconnect" href="https://fonts.googleapis.com"><link rel="preconnect" href="https://fonts.gstatic.com" crossorigin><link href="https://fonts.googleapis.com/css2?family=Inconsolata&display=swap" rel="stylesheet">', unsafe_allow_html=True)
@@ -8,22 +15,6 @@ def local_css(file_name):
     with open(file_name) as f:
         st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
-def sanitize_answer(answer, remove_formatting = True, remove_alternate_answers = True):
-    if remove_formatting:
-        answer = re.sub(r'\<b\>', '', answer)
-        answer = re.sub(r'\<i\>', '', answer)
-        answer = re.sub(r'\</b\>', '', answer)
-        answer = re.sub(r'\</i\>', '', answer)
-        answer = re.sub(r'\</u\>', '', answer)
-        answer = re.sub(r'\<u\>', '', answer)
-        answer = re.sub(r'\<em\>', '', answer)
-        answer = re.sub(r'\</em\>', '', answer)
-    if remove_alternate_answers:
-        answer = re.sub(r'\s\[.*', '', answer)
-        answer = re.sub(r'\s\(.*', '', answer)
-
-    return answer
-
 def hr():
     return st.markdown('<hr>', unsafe_allow_html=True)
 
@@ -44,7 +35,60 @@ def calc_pts(df):
     else:
         return df.G*10 - df.N*5
 
-def populate_db():
-    qbstreamlit.parser.populate_db_qbjs_nasat(st.session_state.tournament)
-    qbstreamlit.parser.populate_db_packets_nasat(st.session_state.tournament)
+def populate_db(incremental=False, workers=1):
+    return qbstreamlit.pipeline.build_db(
+        st.session_state.tournament, incremental=incremental, workers=workers)
+
+def start_ingest_worker(interval=5, workers=1):
+    return qbstreamlit.worker.get_ingest_worker(
+        st.session_state.tournament, interval=interval, workers=workers)
+
+def show_ingest_status(worker):
+    status = worker.status()
+    if status['state'] == 'building':
+        st.progress(status['progress'], text=f"Updating stats: {status['stage']}")
+    elif status['state'] == 'failed':
+        st.warning(f"Last stats update failed: {status['error']}")
+
+def format_rate(rate):
+    return '-' if rate is None else f'{rate:.0%}'
+
+def show_ingest_profile(path=qbstreamlit.instrument.PROFILE_PATH, files=20):
+    """Admin panel for the last rebuild's profile: stage times, the slowest
+    files, SQL write time per table, peak RSS and cache hit rates.
+    Args:
+        path (str): Profile JSON written by pipeline.build_db
+        files (int): Number of slowest files to list
+    """
+    profile = qbstreamlit.instrument.load_profile(path)
+    if profile is None:
+        st.info('No rebuild profile has been recorded yet.')
+        return
+
+    started = datetime.datetime.fromtimestamp(profile['started'])
+    st.caption(f"Last rebuild started {started:%Y-%m-%d %H:%M:%S}")
+    live_hits = qbstreamlit.cache.frame_cache.hits
+    live_total = live_hits + qbstreamlit.cache.frame_cache.misses
+    metrics = st.columns(4)
+    metrics[0].metric('Rebuild time', f"{profile['seconds']:.1f}s")
+    metrics[1].metric(
+        'Peak RSS',
+        '-' if profile['peak_rss'] is None else f"{profile['peak_rss']/2**20:.0f} MB")
+    metrics[2].metric('Rebuild cache hits', format_rate(profile['cache']['hit_rate']))
+    metrics[3].metric(
+        'Live cache hits', format_rate(live_hits/live_total if live_total > 0 else None))
 
+    st.markdown('#### Stages')
+    st.dataframe(pd.DataFrame(profile['stages']), hide_index=True)
+    st.markdown('#### Slowest files')
+    st.dataframe(pd.DataFrame(profile['files']).head(files), hide_index=True)
+    st.markdown('#### SQL writes')
+    st.dataframe(pd.DataFrame.from_dict(profile['tables'], orient='index'))
+    st.markdown('#### SQL reads')
+    st.dataframe(pd.DataFrame.from_dict(profile['reads'], orient='index'))
+    if len(profile.get('scoresheet_errors', [])) > 0:
+        st.markdown('#### Scoresheet errors')
+        st.dataframe(pd.DataFrame(profile['scoresheet_errors']), hide_index=True)
+    if len(profile.get('orphan_rows', [])) > 0:
+        st.markdown('#### Rows matching nothing they reference')
+        st.dataframe(pd.DataFrame(profile['orphan_rows']), hide_index=True)
@@ -0,0 +1,258 @@
+import glob
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import qbstreamlit.cache
+import qbstreamlit.db
+import qbstreamlit.live
+import qbstreamlit.pipeline
+
+STAGES = ['copy', 'packets', 'qbjs', 'scoresheets', 'swap']
+# Builds started over because the tournament's partition was written
+# during them, before the worker reports it and tries again on the next poll.
+SWAP_ATTEMPTS = 3
+
+
+def get_watched_files(root, tournament):
+    patterns = [
+        f'qbjs/{tournament}/*.qbj', f'packets/{tournament}/*.json',
+        'player-recoding.csv', 'team-recoding.csv', 'round-recoding.json'
+    ]
+    paths = []
+    for pattern in patterns:
+        paths.extend(glob.glob(os.path.join(root, pattern)))
+    return sorted(paths)
+
+
+def get_signature(root, tournament):
+    """Returns (path, mtime, size) for every file a build reads."""
+    signature = []
+    for path in get_watched_files(root, tournament):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def remove_db_files(path):
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def stage_and_swap(root, tournament, workers, events):
+    """Builds a tournament into a staging copy of its partition of stats.db,
+    then swaps the result into stats.db in one write transaction. Other
+    tournaments' rows are neither copied nor rewritten. Runs in its own
+    process and reports ('stage', name, seconds), ('retry', attempt, None),
+    ('done', None, None), ('stale', message, None) once every attempt has
+    been overtaken, or ('failed', message, None) on events.
+
+    If another ingest writes the tournament's partition while the build
+    runs, the swap is abandoned and the build starts over from a fresh copy
+    so those writes are kept. Live games scored during the build are
+    carried over into the swapped partition instead.
+    """
+    os.chdir(root)
+    live_path = qbstreamlit.db.DB_PATH
+    staging_path = f'{live_path}.staging'
+    try:
+        for attempt in range(SWAP_ATTEMPTS):
+            start = time.perf_counter()
+            qbstreamlit.db.DB_PATH = live_path
+            remove_db_files(staging_path)
+            generation = None
+            if os.path.exists(live_path):
+                generation = qbstreamlit.db.copy_partition(live_path, staging_path, tournament)
+            events.put(('stage', 'copy', time.perf_counter() - start))
+
+            qbstreamlit.db.DB_PATH = staging_path
+            qbstreamlit.pipeline.build_db(
+                tournament, incremental=True, workers=workers,
+                on_stage=lambda stage, seconds: events.put(('stage', stage, seconds)))
+
+            # Readers in the middle of a query keep their WAL snapshot; the next
+            # query sees the new contents and a higher generation.
+            start = time.perf_counter()
+            if qbstreamlit.db.swap_partition(
+                    staging_path, live_path, tournament, generation,
+                    carry_over=lambda con: qbstreamlit.live.carry_over_live_games(con, tournament)):
+                events.put(('stage', 'swap', time.perf_counter() - start))
+                remove_db_files(staging_path)
+                events.put(('done', None, None))
+                return
+            events.put(('retry', attempt + 1, None))
+        remove_db_files(staging_path)
+        events.put((
+            'stale', f'{tournament} changed in stats.db during each of {SWAP_ATTEMPTS} builds',
+            None))
+    except Exception as e:
+        events.put(('failed', f'{type(e).__name__}: {e}', None))
+
+
+class IngestWorker:
+    """Watches a tournament's qbjs/ and packets/ folders and rebuilds it in a
+    separate process whenever they change.
+
+    Builds run against a staging copy of the tournament's partition that
+    replaces it in the live database only once every stage has succeeded,
+    so pages keep serving the last good snapshot until then. If another
+    ingest writes the partition while a build runs, the build starts over
+    from a fresh copy rather than overwriting those writes; live scoring
+    during a build is merged into the swap. Poll status() for progress and the generation
+    now being served.
+    """
+
+    def __init__(self, tournament, root='.', interval=5, workers=1):
+        self.tournament = tournament
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.process = None
+        self.events = None
+        self.state = 'idle'
+        self.stage = None
+        self.timings = {}
+        self.error = None
+        self.last_build = None
+        self.requested = False
+        self.built_signature = None
+        self.pending_signature = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, name=f'qbstreamlit-ingest-{self.tournament}', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def request_build(self):
+        """Rebuilds on the next poll even if no file changed."""
+        with self.lock:
+            self.requested = True
+
+    def status(self):
+        """Returns the worker's state for a page to display.
+        Returns:
+            dict: state ('idle', 'building' or 'failed'), the running stage,
+                progress from 0 to 1, per-stage timings, the last error, the
+                time of the last successful build and the generation of the
+                live stats.db
+        """
+        identity = qbstreamlit.cache.get_db_identity(
+            os.path.join(self.root, qbstreamlit.db.DB_PATH))
+        with self.lock:
+            return {
+                'state': self.state,
+                'stage': self.stage,
+                'progress': len(self.timings)/len(STAGES) if self.state == 'building' else 1.0,
+                'timings': dict(self.timings),
+                'error': self.error,
+                'last_build': self.last_build,
+                'generation': None if identity is None else identity[3],
+            }
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.poll()
+            self.stopped.wait(
+                min(self.interval, 0.5) if self.process is not None else self.interval)
+
+    def poll(self):
+        if self.process is not None:
+            self.drain_events()
+            if self.process.is_alive():
+                return
+            self.process.join()
+            self.drain_events()
+            with self.lock:
+                if self.state == 'building':
+                    self.state = 'failed'
+                    self.error = f'Build process exited with code {self.process.exitcode}'
+                    self.stage = None
+            self.process = None
+
+        signature = get_signature(self.root, self.tournament)
+        with self.lock:
+            requested = self.requested
+        # Wait until the folders have stopped changing for one interval, so a
+        # file that is still being copied is not ingested half-written.
+        settled = signature == self.pending_signature
+        self.pending_signature = signature
+        if requested or (settled and signature != self.built_signature):
+            self.start_build(signature)
+
+    def start_build(self, signature):
+        # Forking a threaded server process is unsafe, so the build process
+        # is spawned fresh.
+        context = multiprocessing.get_context('spawn')
+        self.events = context.Queue()
+        self.process = context.Process(
+            target=stage_and_swap,
+            args=(self.root, self.tournament, self.workers, self.events))
+        with self.lock:
+            self.state = 'building'
+            self.stage = STAGES[0]
+            self.timings = {}
+            self.error = None
+            self.requested = False
+        # A failed build is not retried until the files change again.
+        self.built_signature = signature
+        self.process.start()
+
+    def drain_events(self):
+        while True:
+            try:
+                kind, value, seconds = self.events.get_nowait()
+            except queue.Empty:
+                return
+            with self.lock:
+                if kind == 'stage':
+                    self.timings[value] = seconds
+                    remaining = [stage for stage in STAGES if stage not in self.timings]
+                    self.stage = remaining[0] if len(remaining) > 0 else None
+                elif kind == 'retry':
+                    self.timings = {}
+                    self.stage = STAGES[0]
+                elif kind == 'done':
+                    self.state = 'idle'
+                    self.stage = None
+                    self.last_build = time.time()
+                elif kind in ['failed', 'stale']:
+                    self.state = 'failed'
+                    self.stage = None
+                    self.error = value
+                    # Other writes overtook the build; unlike a parse error,
+                    # that is worth another try on the next poll.
+                    if kind == 'stale':
+                        self.requested = True
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_ingest_worker(tournament, root='.', interval=5, workers=1):
+    """Returns the server process's ingest worker for a tournament, starting
+    it on first use. Streamlit reruns page scripts on every interaction, so
+    pages call this rather than constructing an IngestWorker themselves.
+    """
+    key = (os.path.abspath(root), tournament)
+    with _workers_lock:
+        if key not in _workers:
+            _workers[key] = IngestWorker(
+                tournament, root=root, interval=interval, workers=workers).start()
+        return _workers[key]
@@ -24,5 +24,8 @@ setup(
         "altair",
         "streamlit",
         "streamlit_aggrid"
-        ]
+        ],
+    extras_require={
+        "streaming": ["ijson", "orjson"]
+    }
 )
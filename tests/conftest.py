@@ -0,0 +1,138 @@
+import json
+import os
+import sqlite3
+import pandas as pd
+import pytest
+import qbstreamlit.benchmark
+import qbstreamlit.cache
+import qbstreamlit.db
+import qbstreamlit.parser
+
+TOURNAMENT = 'synthetic'
+# Tables derived from the QBJ files, compared between builds.
+STAT_TABLES = [
+    'buzzes', 'bonuses', 'player_stats', 'team_stats', 'player_bpa', 'player_cat_bpa',
+    'team_bpa', 'team_cat_bpa', 'buzz_histogram'
+]
+
+
+def make_tournament(root, tournament=TOURNAMENT):
+    """Writes a synthetic tournament whose recoding CSVs rename every team
+    and player, and whose lineups include a player who never buzzes.
+    Returns:
+        list: The QBJ file names, sorted
+    """
+    qbstreamlit.benchmark.generate_tournament(
+        str(root), tournament, games=8, teams=4, seed=1)
+    qbjs = sorted(os.listdir(os.path.join(root, 'qbjs', tournament)))
+    for name in qbjs:
+        path = os.path.join(root, 'qbjs', tournament, name)
+        with open(path) as f:
+            qbj = json.load(f)
+        for team in qbj['match_teams']:
+            team['lineups'][0]['players'].append({'name': f"{team['team']['name']} bench"})
+        with open(path, 'w') as f:
+            json.dump(qbj, f)
+
+    teams = pd.read_csv(os.path.join(root, 'team-recoding.csv'))
+    teams['team_clean'] = teams['team'].str.replace('Team', 'School')
+    teams.to_csv(os.path.join(root, 'team-recoding.csv'), index=False)
+    players = pd.read_csv(os.path.join(root, 'player-recoding.csv'))
+    players = pd.concat([players, pd.DataFrame({
+        'player': teams['team'] + ' bench', 'team': teams['team'],
+        'player_clean': teams['team'] + ' bench'})], ignore_index=True)
+    players['player_clean'] = players['player_clean'].str.replace('Player', 'P.')
+    players['team'] = players['team'].map(dict(zip(teams['team'], teams['team_clean'])))
+    players.to_csv(os.path.join(root, 'player-recoding.csv'), index=False)
+    return qbjs
+
+
+def ingest(tournament=TOURNAMENT):
+    """Ingests packets and QBJ files without rendering scoresheets."""
+    qbstreamlit.cache.clear_cache()
+    qbstreamlit.parser.populate_db_packets_nasat(tournament)
+    qbstreamlit.parser.populate_db_qbjs_nasat(tournament, incremental=True)
+    qbstreamlit.cache.clear_cache()
+
+
+def qbj_events(game, qbj):
+    """The live feed a scorer would have sent while playing a QBJ file."""
+    yield {'event': 'start', 'game': game, 'teams': [
+        {'name': team['team']['name'],
+         'players': [player['name'] for lineup in team['lineups']
+                     for player in lineup['players']]}
+        for team in qbj['match_teams']]}
+    for question in qbj['match_questions']:
+        correct_teams = []
+        for buzz in question['buzzes']:
+            yield {'event': 'buzz', 'game': game, 'tossup': question['question_number'],
+                   'team': buzz['team']['name'], 'player': buzz['player']['name'],
+                   'buzz_position': buzz['buzz_position']['word_index'],
+                   'value': buzz['result']['value']}
+            if buzz['result']['value'] > 0:
+                correct_teams.append(buzz['team']['name'])
+        if 'bonus' in question:
+            for team in correct_teams:
+                for part, value in enumerate(question['bonus']['parts']):
+                    yield {'event': 'bonus', 'game': game, 'tossup': question['question_number'],
+                           'bonus': question['bonus']['question']['question_number'],
+                           'team': team, 'part': part + 1, 'value': value['controlled_points']}
+    yield {'event': 'end', 'game': game}
+
+
+def write_feed(qbj_path, feed_path):
+    """Writes a QBJ file's game as a live feed, named after the file.
+    Returns:
+        list: The feed's events
+    """
+    game = os.path.basename(qbj_path)
+    with open(qbj_path) as f:
+        events = list(qbj_events(game, json.load(f)))
+    with open(feed_path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+    return events
+
+
+@pytest.fixture
+def tournament_root(tmp_path, monkeypatch):
+    """A synthetic tournament in an empty working directory."""
+    make_tournament(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    qbstreamlit.cache.clear_cache()
+    yield tmp_path
+    qbstreamlit.cache.clear_cache()
+
+
+def read_stat_tables(path=qbstreamlit.db.DB_PATH, tournament=TOURNAMENT):
+    """Reads a tournament's stat tables with game_ids replaced by QBJ paths,
+    sorted on every column, so builds that numbered games differently
+    compare equal. Live games have no manifest row yet; their path comes
+    from live_games."""
+    con = sqlite3.connect(path)
+    try:
+        def read(sql):
+            return pd.read_sql(f'{sql} WHERE tournament = ?', con, params=[tournament])
+
+        paths = read('SELECT path, game_id FROM qbj_manifest')
+        if qbstreamlit.db.table_exists(con, 'live_games'):
+            paths = pd.concat([paths, read('SELECT path, game_id FROM live_games')])
+        tables = {name: read(f'SELECT * FROM {name}') for name in STAT_TABLES}
+    finally:
+        con.close()
+
+    for name, df in tables.items():
+        if 'game_id' in df.columns:
+            df = df.merge(paths, on='game_id', how='left').drop(columns='game_id')
+        if 'PPB' in df.columns:
+            df['PPB'] = df['PPB'].fillna(0)
+        df = df[sorted(df.columns)]
+        tables[name] = df.sort_values(list(df.columns)).reset_index(drop=True)
+    return tables
+
+
+def assert_same_tables(actual, expected):
+    for name in STAT_TABLES:
+        pd.testing.assert_frame_equal(
+            actual[name], expected[name], check_dtype=False, check_exact=False,
+            obj=name)
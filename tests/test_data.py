@@ -0,0 +1,42 @@
+import sqlite3
+import pandas as pd
+import qbstreamlit.data
+import qbstreamlit.db
+import qbstreamlit.pipeline
+from conftest import TOURNAMENT
+
+
+def test_fetch_df_matches_read_sql(tournament_root):
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    con = qbstreamlit.db.connect()
+    try:
+        for table in qbstreamlit.db.SCHEMA:
+            if not qbstreamlit.db.table_exists(con, table):
+                continue
+            dtypes = qbstreamlit.data.get_dtypes(table)
+            for sql in [f'SELECT * FROM {table}', f'SELECT * FROM {table} WHERE 0']:
+                expected = pd.read_sql(sql, con)
+                if len(expected.index) == 0:
+                    # read_sql has no values to infer from; fetch_df keeps the schema's dtypes.
+                    expected = expected.astype(dtypes)
+                actual = qbstreamlit.data.fetch_df(con.execute(sql), dtypes, chunksize=100)
+                pd.testing.assert_frame_equal(actual, expected, obj=sql)
+    finally:
+        con.close()
+
+
+def test_fetch_df_parses_untyped_columns():
+    con = sqlite3.connect(':memory:')
+    try:
+        # Tables written before the typed schema hold numbers as text.
+        con.execute('CREATE TABLE buzzes (tossup, value, buzz_position)')
+        con.executemany('INSERT INTO buzzes VALUES (?, ?, ?)',
+                        [('1', '10', 40), ('2', '-5', None)])
+        df = qbstreamlit.data.fetch_df(con.execute('SELECT * FROM buzzes'), {
+            'tossup': 'int64', 'value': 'int64', 'buzz_position': 'int64'})
+        expected = pd.read_sql('SELECT * FROM buzzes', con).astype(
+            {'tossup': 'int64', 'value': 'int64'})
+    finally:
+        con.close()
+    pd.testing.assert_frame_equal(df, expected)
+    assert str(df['buzz_position'].dtype) == 'float64'
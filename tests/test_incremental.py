@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import sqlite3
+import qbstreamlit.cache
+import qbstreamlit.pipeline
+from conftest import TOURNAMENT, assert_same_tables, read_stat_tables
+
+
+def read_scoresheet_generations():
+    con = sqlite3.connect('stats.db')
+    try:
+        rows = con.execute(
+            'SELECT m.path, s.generation FROM scoresheets s JOIN qbj_manifest m '
+            'ON m.tournament = s.tournament AND m.game_id = s.game_id').fetchall()
+    finally:
+        con.close()
+    return dict(rows)
+
+
+def rebuild_from_scratch():
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists('stats.db' + suffix):
+            os.remove('stats.db' + suffix)
+    qbstreamlit.cache.clear_cache()
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+
+
+def test_incremental_build_matches_full_build(tournament_root):
+    qbjs = os.path.join('qbjs', TOURNAMENT)
+    removed, changed, copied, unchanged = sorted(os.listdir(qbjs))[:4]
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    before = read_scoresheet_generations()
+
+    os.remove(os.path.join(qbjs, removed))
+    with open(os.path.join(qbjs, changed)) as f:
+        qbj = json.load(f)
+    for question in qbj['match_questions'][:5]:
+        question['buzzes'] = []
+        question.pop('bonus', None)
+    with open(os.path.join(qbjs, changed), 'w') as f:
+        json.dump(qbj, f)
+    added = 'Round_1_9.qbj'
+    shutil.copy(os.path.join(qbjs, copied), os.path.join(qbjs, added))
+
+    qbstreamlit.pipeline.build_db(TOURNAMENT, incremental=True)
+    incremental = read_stat_tables()
+    after = read_scoresheet_generations()
+
+    # Only the changed and added games are rendered again.
+    assert set(after) == set(before) - {os.path.join(qbjs, removed)} | {os.path.join(qbjs, added)}
+    assert after[os.path.join(qbjs, changed)] > before[os.path.join(qbjs, changed)]
+    assert after[os.path.join(qbjs, unchanged)] == before[os.path.join(qbjs, unchanged)]
+
+    rebuild_from_scratch()
+    assert_same_tables(incremental, read_stat_tables())
+    assert set(read_scoresheet_generations()) == set(after)
+
+
+def test_incremental_build_without_changes_writes_nothing(tournament_root):
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    full = read_stat_tables()
+    before = read_scoresheet_generations()
+
+    qbstreamlit.pipeline.build_db(TOURNAMENT, incremental=True)
+    assert_same_tables(read_stat_tables(), full)
+    assert read_scoresheet_generations() == before
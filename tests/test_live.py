@@ -0,0 +1,37 @@
+import shutil
+import qbstreamlit.cache
+import qbstreamlit.data
+import qbstreamlit.live
+from conftest import (
+    TOURNAMENT, assert_same_tables, ingest, make_tournament, read_stat_tables, write_feed)
+
+
+def test_live_game_matches_ingested_qbj(tournament_root, tmp_path, monkeypatch):
+    reference = tmp_path / 'reference'
+    game = make_tournament(reference)[-1]
+    monkeypatch.chdir(reference)
+    ingest()
+    expected = read_stat_tables()
+
+    monkeypatch.chdir(tournament_root)
+    qbj_path = qbstreamlit.live.get_live_path(TOURNAMENT, game)
+    shutil.move(qbj_path, game)
+    ingest()
+    events = write_feed(game, 'feed.jsonl')
+
+    errors = []
+    applied = qbstreamlit.live.run_feed(TOURNAMENT, 'feed.jsonl', on_error=errors.append)
+    qbstreamlit.cache.clear_cache()
+    assert errors == []
+    assert applied == len(events)
+    live_games = qbstreamlit.data.load_live_games(tournament=TOURNAMENT)
+    assert list(live_games['path']) == [qbj_path]
+    assert_same_tables(read_stat_tables(), expected)
+
+    # Once the QBJ file lands, it takes over the live game's rows and game_id.
+    shutil.move(game, qbj_path)
+    ingest()
+    assert len(qbstreamlit.data.load_live_games(tournament=TOURNAMENT).index) == 0
+    assert_same_tables(read_stat_tables(), expected)
+    game_ids = qbstreamlit.data.load_team_stats(tournament=TOURNAMENT)['game_id']
+    assert int(live_games['game_id'].iloc[0]) in set(game_ids)
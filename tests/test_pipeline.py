@@ -0,0 +1,30 @@
+import os
+import shutil
+import pytest
+import qbstreamlit.data
+import qbstreamlit.parser
+import qbstreamlit.pipeline
+from conftest import TOURNAMENT, assert_same_tables, read_stat_tables
+
+
+def test_build_with_packets_and_no_qbjs(tournament_root):
+    qbjs = os.path.join('qbjs', TOURNAMENT)
+    shutil.move(qbjs, 'held')
+    os.makedirs(qbjs)
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    assert len(qbstreamlit.data.load_team_stats(tournament=TOURNAMENT).index) == 0
+    assert len(qbstreamlit.data.load_tossup_meta(tournament=TOURNAMENT).index) > 0
+
+    # The first round's files then arrive through an incremental build.
+    for name in os.listdir('held'):
+        shutil.move(os.path.join('held', name), qbjs)
+    qbstreamlit.pipeline.build_db(TOURNAMENT, incremental=True)
+    incremental = read_stat_tables()
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    assert_same_tables(incremental, read_stat_tables())
+
+
+def test_build_without_packets_fails(tournament_root):
+    shutil.rmtree(os.path.join('packets', TOURNAMENT))
+    with pytest.raises(qbstreamlit.parser.IngestError, match='no packet files'):
+        qbstreamlit.pipeline.build_db(TOURNAMENT)
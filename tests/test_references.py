@@ -0,0 +1,30 @@
+import json
+import os
+import qbstreamlit.db
+import qbstreamlit.instrument
+import qbstreamlit.pipeline
+from conftest import TOURNAMENT
+
+
+def read_orphan_rows():
+    with open(qbstreamlit.instrument.PROFILE_PATH) as f:
+        return json.load(f)['orphan_rows']
+
+
+def test_clean_build_reports_no_orphans(tournament_root):
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    assert read_orphan_rows() == []
+
+
+def test_missing_packet_reports_orphans(tournament_root):
+    os.remove(os.path.join('packets', TOURNAMENT, 'packet1.json'))
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+
+    orphans = {(orphan['table'], orphan['references']) for orphan in read_orphan_rows()}
+    assert ('buzzes', 'tossup_meta') in orphans
+    assert ('team_stats', 'tossup_meta') in orphans
+    con = qbstreamlit.db.connect()
+    try:
+        assert qbstreamlit.db.find_orphans(con, 'other') == []
+    finally:
+        con.close()
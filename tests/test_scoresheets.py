@@ -0,0 +1,64 @@
+import json
+import pytest
+import qbstreamlit.charts
+import qbstreamlit.data
+import qbstreamlit.pipeline
+from conftest import TOURNAMENT
+
+
+def inline_datasets(spec):
+    """Replaces references to a spec's named datasets with their values, so
+    specs that named the same data differently compare equal."""
+    spec = json.loads(json.dumps(spec))
+    datasets = spec.pop('datasets', {})
+
+    def inline(value):
+        if isinstance(value, dict):
+            if list(value) == ['name'] and value['name'] in datasets:
+                return {'values': datasets[value['name']]}
+            return {key: inline(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [inline(item) for item in value]
+        return value
+    return inline(spec)
+
+
+def test_stored_scoresheets_match_charts(tournament_root):
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    game_ids = sorted(qbstreamlit.data.load_team_stats(tournament=TOURNAMENT)['game_id'].unique().tolist())
+    # Loaded as render_scoresheet_specs loads them, so rows come in the same order.
+    buzzes, bonuses, player_stats, team_stats = \
+        qbstreamlit.charts.load_scoresheet_data(TOURNAMENT, game_ids)
+    for game_id in game_ids:
+        stored = qbstreamlit.data.load_scoresheet(game_id, tournament=TOURNAMENT)
+        chart = qbstreamlit.charts.make_scoresheet(
+            game_id, buzzes, bonuses, player_stats[player_stats['game_id'] == game_id],
+            team_stats=team_stats)
+        assert inline_datasets(json.loads(stored)) == inline_datasets(chart.to_dict())
+
+    game_id = game_ids[0]
+    specs = qbstreamlit.charts.make_scoresheet_specs(
+        [game_id], buzzes, bonuses, player_stats, team_stats, has_bonuses=False)
+    chart = qbstreamlit.charts.make_scoresheet(
+        game_id, buzzes, bonuses, player_stats[player_stats['game_id'] == game_id],
+        has_bonuses=False, team_stats=team_stats)
+    assert inline_datasets(json.loads(specs[game_id])) == inline_datasets(chart.to_dict())
+
+
+def test_failed_scoresheet_skips_only_its_game(tournament_root):
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    buzzes, bonuses, player_stats, team_stats = \
+        qbstreamlit.charts.load_scoresheet_data(TOURNAMENT)
+    game_ids = sorted(team_stats['game_id'].unique())
+    buzzes = buzzes.astype({'value': object})
+    buzzes.loc[buzzes['game_id'] == game_ids[0], 'value'] = 'ten'
+
+    errors = []
+    specs = qbstreamlit.charts.make_scoresheet_specs(
+        game_ids, buzzes, bonuses, player_stats, team_stats,
+        on_error=lambda game_id, e: errors.append(game_id))
+    assert errors == [game_ids[0]]
+    assert sorted(specs) == game_ids[1:]
+    with pytest.raises(ValueError):
+        qbstreamlit.charts.make_scoresheet_specs(
+            game_ids, buzzes, bonuses, player_stats, team_stats)
@@ -0,0 +1,176 @@
+import json
+import os
+import queue
+import shutil
+import sqlite3
+from contextlib import contextmanager
+import pytest
+import qbstreamlit.cache
+import qbstreamlit.data
+import qbstreamlit.db
+import qbstreamlit.live
+import qbstreamlit.parser
+import qbstreamlit.pipeline
+import qbstreamlit.worker
+from conftest import (
+    TOURNAMENT, assert_same_tables, ingest, make_tournament, read_stat_tables, write_feed)
+
+OTHER = 'other'
+
+
+@pytest.fixture
+def two_tournaments(tournament_root, monkeypatch):
+    """The synthetic tournament, unbuilt, next to another built one."""
+    # stage_and_swap points DB_PATH at its staging copy while it builds.
+    monkeypatch.setattr(qbstreamlit.db, 'DB_PATH', qbstreamlit.db.DB_PATH)
+    make_tournament(tournament_root, OTHER)
+    qbstreamlit.pipeline.build_db(OTHER)
+    return tournament_root
+
+
+def run_worker_build(tournament, during_build=None, monkeypatch=None):
+    """Runs one worker build in this process and returns its events. during_build
+    is called with stats.db's path after the build's stages, before the swap."""
+    if during_build is not None:
+        build_db = qbstreamlit.pipeline.build_db
+        live_path = os.path.abspath(qbstreamlit.db.DB_PATH)
+
+        def build_then_write(*args, **kwargs):
+            timings = build_db(*args, **kwargs)
+            during_build(live_path)
+            return timings
+        monkeypatch.setattr(qbstreamlit.pipeline, 'build_db', build_then_write)
+
+    events = queue.Queue()
+    qbstreamlit.worker.stage_and_swap(os.getcwd(), tournament, 1, events)
+    if during_build is not None:
+        monkeypatch.setattr(qbstreamlit.pipeline, 'build_db', build_db)
+    qbstreamlit.db.DB_PATH = 'stats.db'
+    return [events.get_nowait() for _ in range(events.qsize())]
+
+
+@contextmanager
+def using_db(path):
+    previous = qbstreamlit.db.DB_PATH
+    qbstreamlit.db.DB_PATH = path
+    try:
+        yield
+    finally:
+        qbstreamlit.db.DB_PATH = previous
+
+
+def read_partition_generation(tournament):
+    con = sqlite3.connect('stats.db')
+    try:
+        return qbstreamlit.db.get_partition_generation(con, tournament)
+    finally:
+        con.close()
+
+
+def test_copy_reads_only_the_built_tournament(two_tournaments):
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    qbstreamlit.db.copy_partition('stats.db', 'copy.db', TOURNAMENT)
+    con = sqlite3.connect('copy.db')
+    try:
+        for table in ['buzzes', 'player_bpa', 'scoresheets', 'partitions']:
+            tournaments = {row[0] for row in con.execute(f'SELECT DISTINCT tournament FROM {table}')}
+            assert tournaments == {TOURNAMENT}
+    finally:
+        con.close()
+
+
+def test_worker_swaps_only_its_tournament(two_tournaments, monkeypatch):
+    other = read_stat_tables(tournament=OTHER)
+    other_generation = read_partition_generation(OTHER)
+
+    events = run_worker_build(TOURNAMENT)
+    assert events[-1] == ('done', None, None)
+    assert_same_tables(read_stat_tables(tournament=OTHER), other)
+    assert read_partition_generation(OTHER) == other_generation
+
+    built = read_stat_tables()
+    qbstreamlit.pipeline.build_db(TOURNAMENT)
+    assert_same_tables(built, read_stat_tables())
+
+
+def test_worker_keeps_other_tournaments_written_during_a_build(two_tournaments, monkeypatch):
+    def rebuild_other(live_path):
+        os.remove(os.path.join('qbjs', OTHER, sorted(os.listdir(os.path.join('qbjs', OTHER)))[0]))
+        with using_db(live_path):
+            qbstreamlit.parser.populate_db_qbjs_nasat(OTHER, incremental=True)
+
+    events = run_worker_build(TOURNAMENT, rebuild_other, monkeypatch)
+    assert [kind for kind, value, seconds in events if kind in ['retry', 'done']] == ['done']
+    other = read_stat_tables(tournament=OTHER)
+    qbstreamlit.pipeline.build_db(OTHER)
+    assert_same_tables(other, read_stat_tables(tournament=OTHER))
+
+
+def add_game(root):
+    """Adds a QBJ file for a new game on packet 1."""
+    qbjs = os.path.join(root, 'qbjs', TOURNAMENT)
+    shutil.copy(os.path.join(qbjs, sorted(os.listdir(qbjs))[0]), os.path.join(qbjs, 'Round_1_9.qbj'))
+
+
+def change_game(root):
+    """Clears the buzzes and bonuses on one game's first five tossups."""
+    qbj_path = os.path.join(root, 'qbjs', TOURNAMENT, sorted(os.listdir(os.path.join(root, 'qbjs', TOURNAMENT)))[0])
+    with open(qbj_path) as f:
+        qbj = json.load(f)
+    for question in qbj['match_questions'][:5]:
+        question['buzzes'] = []
+        question.pop('bonus', None)
+    with open(qbj_path, 'w') as f:
+        json.dump(qbj, f)
+
+
+@pytest.mark.parametrize('change, expected_events', [
+    (change_game, ['done']),
+    # The live game starts during the build and takes the game_id the build
+    # gives the new file, so the build runs again from a copy with the game.
+    (add_game, ['retry', 'done']),
+])
+def test_worker_keeps_live_events_scored_during_a_build(
+        tournament_root, tmp_path, monkeypatch, change, expected_events):
+    monkeypatch.setattr(qbstreamlit.db, 'DB_PATH', qbstreamlit.db.DB_PATH)
+    reference = tmp_path / 'reference'
+    make_tournament(reference)
+    change(reference)
+    monkeypatch.chdir(reference)
+    ingest()
+    expected = read_stat_tables()
+
+    monkeypatch.chdir(tournament_root)
+    game = sorted(os.listdir(os.path.join('qbjs', TOURNAMENT)))[-1]
+    shutil.move(qbstreamlit.live.get_live_path(TOURNAMENT, game), game)
+    write_feed(game, 'feed.jsonl')
+    ingest()
+    change(tournament_root)
+
+    def score_live_game(live_path):
+        errors = []
+        with using_db(live_path):
+            qbstreamlit.live.run_feed(TOURNAMENT, 'feed.jsonl', on_error=errors.append)
+        assert errors == []
+
+    events = run_worker_build(TOURNAMENT, score_live_game, monkeypatch)
+    assert [kind for kind, value, seconds in events if kind in ['retry', 'done']] == expected_events
+    qbstreamlit.cache.clear_cache()
+    live_games = qbstreamlit.data.load_live_games(tournament=TOURNAMENT)
+    assert list(live_games['path']) == [qbstreamlit.live.get_live_path(TOURNAMENT, game)]
+    assert list(live_games['finished']) == [1]
+    assert_same_tables(read_stat_tables(), expected)
+
+
+def test_worker_tries_again_after_being_overtaken(tournament_root):
+    worker = qbstreamlit.worker.IngestWorker(TOURNAMENT, root=str(tournament_root))
+    worker.events = queue.Queue()
+    worker.events.put(('stale', 'overtaken', None))
+    worker.drain_events()
+    assert worker.status()['state'] == 'failed'
+    assert worker.requested
+
+    worker.events.put(('failed', 'IngestError', None))
+    worker.requested = False
+    worker.drain_events()
+    assert not worker.requested